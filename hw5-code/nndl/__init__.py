@@ -1,6 +1,10 @@
 from .cnn import *
 from .conv_layer_utils import *
 from .conv_layers import *
+from .fc_net import *
+from .flat_params import *
 from .layer_utils import *
 from .layers import *
 from .optim import *
+from .pruning import *
+from .quantization import *
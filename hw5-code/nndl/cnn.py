@@ -17,11 +17,25 @@ class ThreeLayerConvNet(object):
   The network operates on minibatches of data that have shape (N, C, H, W)
   consisting of N images, each with height H and width W and with C input
   channels.
+
+  With layout='NHWC' the minibatch is transposed to channels-last once on
+  entry, and the conv, relu and pool layers then all work on (N, H, W, C)
+  data. Parameter shapes are the same in both layouts, but the rows of W2
+  follow the flattening order of the pooled activations, so trained weights
+  are tied to the layout they were trained in.
+
+  With global_pool=True the pooled activations are averaged over all
+  spatial positions before the hidden affine layer:
+
+  conv - relu - 2x2 max pool - global average pool - affine - relu - affine - softmax
+
+  so W2 has num_filters rows whatever the image size.
   """
   
   def __init__(self, input_dim=(3, 32, 32), num_filters=32, filter_size=7,
                hidden_dim=100, num_classes=10, weight_scale=1e-3, reg=0.0,
-               dtype=np.float32, use_batchnorm=False):
+               dtype=np.float32, use_batchnorm=False, mixed_precision=False,
+               layout='NCHW', global_pool=False, conv_autotuner=None):
     """
     Initialize a new network.
     
@@ -35,11 +49,35 @@ class ThreeLayerConvNet(object):
       of weights.
     - reg: Scalar giving L2 regularization strength
     - dtype: numpy datatype to use for computation.
+    - mixed_precision: If True, store activations and caches in float16 while
+      the weights (and the matrix multiplies) stay in dtype.
+    - layout: Memory layout of the activations, 'NCHW' or 'NHWC'. Inputs are
+      always given as (N, C, H, W).
+    - global_pool: If True, use global average pooling instead of
+      flattening the pooled activations into the hidden affine layer.
+    - conv_autotuner: Optional ConvAutotuner that picks the convolution
+      method of the conv layer; it may be shared between models.
     """
+    if layout not in ('NCHW', 'NHWC'):
+      raise ValueError('Unrecognized layout "%s"' % layout)
     self.use_batchnorm = use_batchnorm
     self.params = {}
     self.reg = reg
     self.dtype = dtype
+    self.mixed_precision = mixed_precision
+    self.layout = layout
+    self.global_pool = global_pool
+
+    # Scratch buffers reused by the conv layer across iterations
+    self.conv_workspace = ConvWorkspace()
+    self.conv_autotuner = conv_autotuner
+
+    # Sparse copies of pruned weights used at test time; see nndl/pruning.py
+    self.sparse_params = {}
+
+    # Factor applied to the gradients of the loss (but not to the loss
+    # itself); set by the Solver for dynamic loss scaling.
+    self.loss_scale = 1.0
 
     
     # ================================================================ #
@@ -58,6 +96,8 @@ class ThreeLayerConvNet(object):
 
     conv_output = (num_filters, C, H, W)
     size_W2 = (hidden_dim,(H//2)*(W//2)*num_filters)
+    if global_pool:
+      size_W2 = (hidden_dim, num_filters)
     size_b2 = hidden_dim
 
     size_W3 = (num_classes, hidden_dim)
@@ -87,15 +127,35 @@ class ThreeLayerConvNet(object):
     W1, b1 = self.params['W1'], self.params['b1']
     W2, b2 = self.params['W2'], self.params['b2']
     W3, b3 = self.params['W3'], self.params['b3']
+
+    if self.mixed_precision:
+      X = X.astype(np.float16)
+    if self.layout == 'NHWC':
+      X = np.ascontiguousarray(X.transpose(0, 2, 3, 1))
     
     # pass conv_param to the forward pass for the convolutional layer
     filter_size = W1.shape[2]
-    conv_param = {'stride': 1, 'pad': (filter_size - 1) / 2}
+    conv_param = {'stride': 1, 'pad': (filter_size - 1) / 2,
+                  'layout': self.layout, 'workspace': self.conv_workspace}
+    if self.conv_autotuner is not None:
+      conv_param['autotuner'] = self.conv_autotuner
 
     # pass pool_param to the forward pass for the max-pooling layer
-    pool_param = {'pool_height': 2, 'pool_width': 2, 'stride': 2}
+    pool_param = {'pool_height': 2, 'pool_width': 2, 'stride': 2,
+                  'layout': self.layout}
 
     scores = None
+
+    # At test time run a forward-only pass that keeps no caches, so each
+    # activation is released as soon as the next layer has consumed it.
+    if y is None:
+      sparse = self.sparse_params
+      out = conv_relu_pool_inference(X, W1, b1, conv_param, pool_param)
+      if self.global_pool:
+        out, _ = global_avg_pool_forward(out, pool_param)
+      out = affine_relu_inference(out, sparse.get('W2', W2), b2)
+      scores = affine_inference(out, sparse.get('W3', W3), b3)
+      return scores
     
     # ================================================================ #
     # YOUR CODE HERE:
@@ -103,7 +163,9 @@ class ThreeLayerConvNet(object):
     #   scores as the variable "scores".
     # ================================================================ #
     # conv - relu - 2x2 max pool - affine - relu - affine - softmax
-    conv_relu_pool_out, conv_relu_pool_cache        = conv_relu_pool_forward(X,W1,b1,conv_param,pool_param)
+    conv_relu_pool_out, conv_relu_pool_cache        = conv_relu_pool_fused_forward(X,W1,b1,conv_param,pool_param)
+    if self.global_pool:
+      conv_relu_pool_out, gap_cache = global_avg_pool_forward(conv_relu_pool_out, pool_param)
     affrelu_out, affrelu_cache  = affine_relu_forward(conv_relu_pool_out,W2,b2)
     scores ,aff_cache          = affine_forward(affrelu_out,W3,b3)
     
@@ -124,12 +186,18 @@ class ThreeLayerConvNet(object):
     #   don't forget to add regularization on ALL weight matrices.
     # ================================================================ #
     loss, dz = softmax_loss(scores,y)
+    dz *= self.loss_scale
     loss += 0.5*self.reg*(np.sum(W1*W1) + np.sum(W2*W2) + np.sum(W3*W3))
     # conv - relu - 2x2 max pool - affine - relu - affine - softmax
 
     dh1 , grads['W3'] , db3 = affine_backward(dz,aff_cache)
     dh2 , grads['W2'] , db2 = affine_relu_backward(dh1, affrelu_cache)
-    dh3 , grads['W1'], db1  = conv_relu_pool_backward(dh2,conv_relu_pool_cache)
+    if self.global_pool:
+      dh2 = global_avg_pool_backward(dh2, gap_cache)
+    # The gradient with respect to the images is never used, so the conv
+    # layer skips its col2im
+    dh3 , grads['W1'], db1  = conv_relu_pool_fused_backward(dh2,conv_relu_pool_cache,
+                                                            requires_grad=(False, True, True))
     
 
     grads['W1'] += self.reg *  grads['W1']
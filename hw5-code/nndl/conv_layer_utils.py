@@ -4,7 +4,9 @@ from utils.fast_layers import *
 
 def conv_relu_forward(x, w, b, conv_param):
   """
-  A convenience layer that performs a convolution followed by a ReLU.
+  A convenience layer that performs a convolution followed by a ReLU. The
+  convolution method (im2col, Winograd or FFT) is chosen per layer by
+  conv_method, or set with conv_param['method'].
 
   Inputs:
   - x: Input to the convolutional layer
@@ -14,19 +16,20 @@ def conv_relu_forward(x, w, b, conv_param):
   - out: Output from the ReLU
   - cache: Object to give to the backward pass
   """
-  a, conv_cache = conv_forward_fast(x, w, b, conv_param)
+  a, conv_cache = conv_forward_auto(x, w, b, conv_param)
   out, relu_cache = relu_forward(a)
   cache = (conv_cache, relu_cache)
   return out, cache
 
 
-def conv_relu_backward(dout, cache):
+def conv_relu_backward(dout, cache, requires_grad=(True, True, True)):
   """
   Backward pass for the conv-relu convenience layer.
+  requires_grad is passed on to conv_backward_auto.
   """
   conv_cache, relu_cache = cache
   da = relu_backward(dout, relu_cache)
-  dx, dw, db = conv_backward_fast(da, conv_cache)
+  dx, dw, db = conv_backward_auto(da, conv_cache, requires_grad)
   return dx, dw, db
 
 
@@ -43,19 +46,72 @@ def conv_relu_pool_forward(x, w, b, conv_param, pool_param):
   - out: Output from the pooling layer
   - cache: Object to give to the backward pass
   """
-  a, conv_cache = conv_forward_fast(x, w, b, conv_param)
+  a, conv_cache = conv_forward_auto(x, w, b, conv_param)
   s, relu_cache = relu_forward(a)
   out, pool_cache = max_pool_forward_fast(s, pool_param)
   cache = (conv_cache, relu_cache, pool_cache)
   return out, cache
 
 
-def conv_relu_pool_backward(dout, cache):
+def conv_relu_pool_backward(dout, cache, requires_grad=(True, True, True)):
   """
   Backward pass for the conv-relu-pool convenience layer
+  requires_grad is passed on to conv_backward_auto.
   """
   conv_cache, relu_cache, pool_cache = cache
   ds = max_pool_backward_fast(dout, pool_cache)
   da = relu_backward(ds, relu_cache)
-  dx, dw, db = conv_backward_fast(da, conv_cache)
-  return dx, dw, db
\ No newline at end of file
+  dx, dw, db = conv_backward_auto(da, conv_cache, requires_grad)
+  return dx, dw, db
+
+def conv_relu_pool_fused_forward(x, w, b, conv_param, pool_param):
+  """
+  Convolution, ReLU and max pool with a compact cache. Since ReLU is
+  monotonic, relu(max(a)) == max(relu(a)), so the pool runs directly on the
+  conv output, recording the uint8 argmax offset of every window, and the
+  ReLU is applied to the pooled result only. The full-resolution conv
+  output is released on return; the cache holds the conv cache (the input
+  and im2col columns needed for the weight gradient), the argmax offsets
+  and a pooled-resolution ReLU mask.
+
+  Inputs and outputs are as for conv_relu_pool_forward. pool_param may have
+  any window and stride with at most 256 elements per window.
+  """
+  a, conv_cache = conv_forward_auto(x, w, b, conv_param)
+  if pool_param.get('layout', 'NCHW') == 'NHWC':
+    out, pool_cache = max_pool_forward_nhwc(a, pool_param)
+  else:
+    out, pool_cache = max_pool_forward_window(a, pool_param)
+  del a
+  mask = out > 0
+  out *= mask
+  cache = (conv_cache, pool_cache, mask)
+  return out, cache
+
+
+def conv_relu_pool_fused_backward(dout, cache, requires_grad=(True, True, True)):
+  """
+  Backward pass for conv_relu_pool_fused_forward.
+  requires_grad is passed on to conv_backward_auto.
+  """
+  conv_cache, pool_cache, mask = cache
+  ds = dout * mask
+  if pool_cache[2].get('layout', 'NCHW') == 'NHWC':
+    da = max_pool_backward_nhwc(ds, pool_cache)
+  else:
+    da = max_pool_backward_window(ds, pool_cache)
+  dx, dw, db = conv_backward_auto(da, conv_cache, requires_grad)
+  return dx, dw, db
+
+
+def conv_relu_pool_inference(x, w, b, conv_param, pool_param):
+  """
+  Forward-only conv - relu - pool for test time. The ReLU is applied in place
+  on the conv output, which is released once the pool has consumed it.
+
+  Returns:
+  - out: Output from the pooling layer
+  """
+  a = conv_forward_inference(x, w, b, conv_param)
+  np.maximum(a, 0, out=a)
+  return max_pool_forward_inference(a, pool_param)
@@ -123,7 +123,7 @@ def conv_backward_naive(dout, cache):
           dx[i,:,start_h:(start_h+f_height),start_w:(start_w+f_width)] += jth_filter * dout_selected 
 
           
-  dx = dx[:, :, pad:-pad, pad:-pad]
+  dx = dx[:, :, pad:dx.shape[2]-pad, pad:dx.shape[3]-pad]
 
   # ================================================================ #
   # END YOUR CODE HERE
@@ -132,6 +132,61 @@ def conv_backward_naive(dout, cache):
   return dx, dw, db
 
 
+def conv_forward_grouped_naive(x, w, b, conv_param):
+  """
+  A naive implementation of the forward pass for a grouped convolution.
+  The C input channels and F filters are split into G = conv_param['groups']
+  equal groups, and the filters of each group only see the channels of
+  that group. G = 1 is a dense convolution and G = C a depthwise one.
+
+  Input:
+  - x: Input data of shape (N, C, H, W)
+  - w: Filter weights of shape (F, C // G, HH, WW)
+  - b: Biases, of shape (F,)
+  - conv_param: As for conv_forward_naive, plus 'groups'
+
+  Returns a tuple of:
+  - out: Output data, of shape (N, F, H', W')
+  - cache: (conv_param, caches), where caches holds the conv_forward_naive
+    cache of every group
+  """
+  G = conv_param.get('groups', 1)
+  Cg, Fg = x.shape[1] // G, w.shape[0] // G
+  outs, caches = [], []
+  for g in range(G):
+    out, group_cache = conv_forward_naive(x[:, g*Cg:(g+1)*Cg], w[g*Fg:(g+1)*Fg],
+                                          b[g*Fg:(g+1)*Fg], conv_param)
+    outs.append(out)
+    caches.append(group_cache)
+  out = np.concatenate(outs, axis=1)
+  cache = (conv_param, caches)
+  return out, cache
+
+
+def conv_backward_grouped_naive(dout, cache):
+  """
+  A naive implementation of the backward pass for a grouped convolution.
+
+  Inputs:
+  - dout: Upstream derivatives.
+  - cache: A tuple of (conv_param, caches) as in conv_forward_grouped_naive
+
+  Returns a tuple of:
+  - dx: Gradient with respect to x
+  - dw: Gradient with respect to w
+  - db: Gradient with respect to b
+  """
+  conv_param, caches = cache
+  Fg = dout.shape[1] // len(caches)
+  dxs, dws, dbs = [], [], []
+  for g, group_cache in enumerate(caches):
+    dx, dw, db = conv_backward_naive(dout[:, g*Fg:(g+1)*Fg], group_cache)
+    dxs.append(dx)
+    dws.append(dw)
+    dbs.append(db)
+  return np.concatenate(dxs, axis=1), np.concatenate(dws), np.concatenate(dbs)
+
+
 def max_pool_forward_naive(x, pool_param):
   """
   A naive implementation of the forward pass for a max pooling layer.
@@ -244,6 +299,8 @@ def spatial_batchnorm_forward(x, gamma, beta, bn_param):
       default of momentum=0.9 should work well in most situations.
     - running_mean: Array of shape (D,) giving running mean of features
     - running_var Array of shape (D,) giving running variance of features
+    - layout: 'NCHW' (default) or 'NHWC'; for 'NHWC', x has shape
+      (N, H, W, C) and out has the same shape
     
   Returns a tuple of:
   - out: Output data, of shape (N, C, H, W)
@@ -251,6 +308,12 @@ def spatial_batchnorm_forward(x, gamma, beta, bn_param):
   """
   out, cache = None, None
 
+  # Channels-last data is already a (N*H*W, C) matrix
+  layout = bn_param.get('layout', 'NCHW')
+  if layout == 'NHWC':
+    out, cache = batchnorm_forward(x.reshape(-1, x.shape[3]), gamma, beta, bn_param)
+    return out.reshape(x.shape), (cache, layout)
+
   # ================================================================ #
   # YOUR CODE HERE:
   #   Implement the spatial batchnorm forward pass.
@@ -258,15 +321,41 @@ def spatial_batchnorm_forward(x, gamma, beta, bn_param):
   #   You may find it useful to use the batchnorm forward pass you 
   #   implemented in HW #4.
   # ================================================================ #
-  
-  N, C, H, W = x.shape
-  x = x.reshape((N,H,W,C))
-  x = x.reshape((N*H*W,C))
 
-  out, cache = batchnorm_forward(x, gamma, beta, bn_param)
-  out = out.T 
-  out = out.reshape(C,N,H,W)
-  out = out.swapaxes(0,1)
+  # Statistics are reduced over (N, H, W) directly on the NCHW array, with
+  # (1, C, 1, 1) parameters broadcast against it, so no layout copies are made
+  mode = bn_param['mode']
+  eps = bn_param.get('eps', 1e-5)
+  momentum = bn_param.get('momentum', 0.9)
+
+  C = x.shape[1]
+  running_mean = bn_param.get('running_mean', np.zeros(C, dtype=x.dtype))
+  running_var = bn_param.get('running_var', np.zeros(C, dtype=x.dtype))
+  g = gamma.reshape(1, C, 1, 1)
+  bt = beta.reshape(1, C, 1, 1)
+
+  if mode == 'train':
+    sample_mean = np.mean(x, axis=(0, 2, 3))
+    sample_var = np.var(x, axis=(0, 2, 3))
+    inv_std = 1.0 / np.sqrt(sample_var + eps)
+    x_norm = x - sample_mean.reshape(1, C, 1, 1)
+    x_norm *= inv_std.reshape(1, C, 1, 1)
+    out = x_norm * g
+    out += bt
+    running_mean = momentum * running_mean + (1 - momentum) * sample_mean
+    running_var = momentum * running_var + (1 - momentum) * sample_var
+    cache = {'x_norm': x_norm, 'gamma': gamma, 'inv_std': inv_std}
+  elif mode == 'test':
+    scale = gamma / np.sqrt(running_var + eps)
+    shift = beta - running_mean * scale
+    out = x * scale.reshape(1, C, 1, 1).astype(x.dtype)
+    out += shift.reshape(1, C, 1, 1).astype(x.dtype)
+  else:
+    raise ValueError('Invalid forward batchnorm mode "%s"' % mode)
+
+  bn_param['running_mean'] = running_mean
+  bn_param['running_var'] = running_var
+  cache = (cache, layout)
 
   # ================================================================ #
   # END YOUR CODE HERE
@@ -280,7 +369,8 @@ def spatial_batchnorm_backward(dout, cache):
   Computes the backward pass for spatial batch normalization.
   
   Inputs:
-  - dout: Upstream derivatives, of shape (N, C, H, W)
+  - dout: Upstream derivatives, of shape (N, C, H, W), or (N, H, W, C) if the
+    forward pass used the 'NHWC' layout
   - cache: Values from the forward pass
   
   Returns a tuple of:
@@ -290,6 +380,11 @@ def spatial_batchnorm_backward(dout, cache):
   """
   dx, dgamma, dbeta = None, None, None
 
+  cache, layout = cache
+  if layout == 'NHWC':
+    dx, dgamma, dbeta = batchnorm_backward(dout.reshape(-1, dout.shape[3]), cache)
+    return dx.reshape(dout.shape), dgamma, dbeta
+
   # ================================================================ #
   # YOUR CODE HERE:
   #   Implement the spatial batchnorm backward pass.
@@ -298,19 +393,42 @@ def spatial_batchnorm_backward(dout, cache):
   #   implemented in HW #4.
   # ================================================================ #
   N, C, H, W = dout.shape
-    
-  dout = dout.swapaxes(0,1)
-  dout = dout.reshape(C,N*H*W)
-  dout = dout.T
-  
-  dx, dgamma, dbeta = batchnorm_backward(dout, cache)
-  
-  dx      = dx.reshape((N,C,H,W))
-  dgamma  = dgamma.reshape((C,))
-  dbeta   = dbeta.reshape((C,))
+  M = N * H * W
+  x_norm = cache['x_norm']
+
+  dbeta = np.sum(dout, axis=(0, 2, 3))
+  dgamma = np.sum(dout * x_norm, axis=(0, 2, 3))
+  dx = x_norm * dgamma.reshape(1, C, 1, 1)
+  dx += dbeta.reshape(1, C, 1, 1)
+  dx /= -M
+  dx += dout
+  dx *= (cache['gamma'] * cache['inv_std']).reshape(1, C, 1, 1)
 
   # ================================================================ #
   # END YOUR CODE HERE
   # ================================================================ # 
 
-  return dx, dgamma, dbeta
\ No newline at end of file
+  return dx, dgamma, dbeta
+
+def fold_batchnorm(w, b, gamma, beta, bn_param):
+  """
+  Folds test-time spatial batchnorm into the preceding convolution. Since
+  test-time batchnorm is a per-channel affine map with scale
+  gamma / sqrt(running_var + eps), scaling each filter and shifting its
+  bias gives a convolution whose output equals conv followed by batchnorm.
+
+  Inputs:
+  - w: Filter weights of shape (F, C, HH, WW)
+  - b: Biases, of shape (F,)
+  - gamma, beta: Batchnorm scale and shift, of shape (F,)
+  - bn_param: Batchnorm parameters holding running_mean and running_var
+
+  Returns a tuple of:
+  - w_folded: Weights of shape (F, C, HH, WW)
+  - b_folded: Biases of shape (F,)
+  """
+  eps = bn_param.get('eps', 1e-5)
+  scale = gamma / np.sqrt(bn_param['running_var'] + eps)
+  w_folded = (w * scale.reshape(-1, 1, 1, 1)).astype(w.dtype)
+  b_folded = ((b - bn_param['running_mean']) * scale + beta).astype(b.dtype)
+  return w_folded, b_folded
@@ -0,0 +1,123 @@
+import argparse
+import json
+import os
+import pickle
+
+import numpy as np
+
+from nndl.cnn import ThreeLayerConvNet
+from nndl.quantization import model_layers
+from utils.runtime import FORMAT, FORMAT_VERSION
+
+
+def model_graph(model, input_dim):
+  """
+  Describes a trained model as the layer list of an export. Each layer is a
+  dictionary with an 'op' key ('conv', 'relu', 'max_pool',
+  'global_avg_pool' or 'affine') and its attributes; conv and affine layers
+  name their weights and biases in the returned params.
+
+  Fully connected models are described by quantization.model_layers, which
+  folds test-time batchnorm into the affine layers and drops dropout. The rows
+  of W2 in an NHWC ThreeLayerConvNet are reordered to follow the NCHW
+  flattening that the runtime uses.
+
+  Inputs:
+  - model: A trained model.
+  - input_dim: Shape of one example, e.g. (3, 32, 32).
+
+  Returns a tuple of:
+  - layers: List of layer dictionaries
+  - params: Dictionary of the arrays the layers refer to
+  """
+  p = model.params
+  if isinstance(model, ThreeLayerConvNet):
+    C, H, W = input_dim
+    F, _, HH, _ = p['W1'].shape
+    W2 = p['W2']
+    global_pool = getattr(model, 'global_pool', False)
+    if getattr(model, 'layout', 'NCHW') == 'NHWC' and not global_pool:
+      W2 = W2.reshape(H // 2, W // 2, F, -1).transpose(2, 0, 1, 3)
+      W2 = W2.reshape(F * (H // 2) * (W // 2), -1)
+    layers = [
+      {'op': 'conv', 'w': 'W1', 'b': 'b1', 'stride': 1, 'pad': (HH - 1) // 2},
+      {'op': 'relu'},
+      {'op': 'max_pool', 'pool_height': 2, 'pool_width': 2, 'stride': 2},
+    ]
+    if global_pool:
+      layers.append({'op': 'global_avg_pool'})
+    layers += [
+      {'op': 'affine', 'w': 'W2', 'b': 'b2'},
+      {'op': 'relu'},
+      {'op': 'affine', 'w': 'W3', 'b': 'b3'},
+    ]
+    params = {'W1': p['W1'], 'b1': p['b1'], 'W2': W2, 'b2': p['b2'],
+              'W3': p['W3'], 'b3': p['b3']}
+    return layers, params
+
+  layers, params = [], {}
+  for i, layer in enumerate(model_layers(model)):
+    # Folding batchnorm computes in float64; keep the model's dtype
+    dtype = p['W%d' % (i + 1)].dtype
+    params['W%d' % (i + 1)] = layer['w'].astype(dtype, copy=False)
+    params['b%d' % (i + 1)] = layer['b'].astype(dtype, copy=False)
+    layers.append({'op': 'affine', 'w': 'W%d' % (i + 1), 'b': 'b%d' % (i + 1)})
+    if layer['relu']:
+      layers.append({'op': 'relu'})
+  return layers, params
+
+
+def export_model(model, filename, input_dim, dtype=None):
+  """
+  Exports a trained model for utils.runtime: a JSON graph description in
+  filename and the weights in an uncompressed .npz file of the same name
+  next to it, which the runtime can memory-map.
+
+  Inputs:
+  - model: A trained ThreeLayerConvNet, TwoLayerNet or FullyConnectedNet.
+  - filename: Path of the .json file to write.
+  - input_dim: Shape of one example, e.g. (3, 32, 32).
+  - dtype: Optional numpy datatype to store the weights in, e.g. float32;
+    by default they keep the model's dtype.
+
+  Returns:
+  - graph: The dictionary written to filename.
+  """
+  layers, params = model_graph(model, input_dim)
+  if dtype is not None:
+    params = {k: v.astype(dtype) for k, v in params.items()}
+  params = {k: np.ascontiguousarray(v) for k, v in params.items()}
+  scores = params[layers[-1]['w']]
+
+  stem = os.path.splitext(filename)[0]
+  graph = {
+    'format': FORMAT,
+    'version': FORMAT_VERSION,
+    'model': type(model).__name__,
+    'input_dim': [int(d) for d in input_dim],
+    'num_classes': int(scores.shape[1]),
+    'weights': os.path.basename(stem) + '.npz',
+    'layers': layers,
+  }
+  np.savez(stem + '.npz', **params)
+  with open(filename, 'w') as f:
+    json.dump(graph, f, indent=2)
+  return graph
+
+
+def main():
+  parser = argparse.ArgumentParser(
+      description='Export the model of a Solver checkpoint for utils.runtime.')
+  parser.add_argument('checkpoint', help='checkpoint written by Solver')
+  parser.add_argument('output', help='.json file to write')
+  parser.add_argument('--input-dim', type=int, nargs='+', default=[3, 32, 32])
+  parser.add_argument('--dtype', default=None, help='e.g. float32')
+  args = parser.parse_args()
+
+  with open(args.checkpoint, 'rb') as f:
+    model = pickle.load(f)['model']
+  export_model(model, args.output, args.input_dim, args.dtype)
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,143 @@
+import numpy as np
+
+
+class FlatParams(object):
+  """
+  Packs every array in a model's params dictionary into one contiguous
+  buffer and rebinds model.params[k] to views into it. A second buffer of
+  the same layout holds the gradients. Snapshots, norms and update rules can
+  then act on the whole model with a single vectorized operation, while the
+  model (and anything else reading model.params) keeps working on the usual
+  dictionary of arrays.
+
+  Example usage:
+
+  model = ThreeLayerConvNet()
+  flat = FlatParams(model)
+  loss, grads = model.loss(X, y)
+  flat.load_grads(grads)
+  flat.w -= 1e-3 * flat.dw   # updates every model.params[k] in place
+
+  All parameters share the dtype of the buffer; by default this is the
+  common dtype of the model's parameters.
+  """
+
+  def __init__(self, model, dtype=None):
+    """
+    Inputs:
+    - model: A model object with a params dictionary, e.g. FullyConnectedNet,
+      TwoLayerNet or ThreeLayerConvNet.
+    - dtype: Optional numpy datatype of the buffers.
+    """
+    self.model = model
+    self.names = list(model.params.keys())
+    if dtype is None:
+      dtype = np.result_type(*[model.params[k] for k in self.names])
+
+    self.shapes = {}
+    self.slices = {}
+    offset = 0
+    for k in self.names:
+      size = model.params[k].size
+      self.shapes[k] = model.params[k].shape
+      self.slices[k] = slice(offset, offset + size)
+      offset += size
+
+    self.w = np.empty(offset, dtype=dtype)
+    self.dw = np.zeros(offset, dtype=dtype)
+    for k in self.names:
+      self.w[self.slices[k]] = model.params[k].ravel()
+    self.bind()
+
+
+  def attach(self, w, dw, copy=True):
+    """
+    Moves both buffers into caller-provided storage, for example arrays
+    backed by shared memory, and rebinds model.params to views of it.
+
+    Inputs:
+    - w, dw: 1-D arrays with the same size and dtype as the current buffers.
+    - copy: If True, copy the current parameters and gradients across; set to
+      False to adopt whatever values the new storage already holds.
+    """
+    assert w.shape == self.w.shape and dw.shape == self.dw.shape
+    if copy:
+      np.copyto(w, self.w)
+      np.copyto(dw, self.dw)
+    self.w, self.dw = w, dw
+    self.bind()
+
+
+  def view(self, flat, k):
+    """
+    Returns the view of a flat vector that corresponds to parameter k.
+    """
+    return flat[self.slices[k]].reshape(self.shapes[k])
+
+
+  def views(self, flat):
+    """
+    Returns a params-style dictionary of views into a flat vector.
+    """
+    return {k: self.view(flat, k) for k in self.names}
+
+
+  def segments(self):
+    """
+    Returns the (slice, shape) of every parameter within the flat buffers,
+    in order, for update rules that treat each parameter separately.
+    """
+    return [(self.slices[k], self.shapes[k]) for k in self.names]
+
+
+  def bind(self):
+    """
+    Points model.params back at views of the parameter buffer.
+    """
+    self.model.params = self.views(self.w)
+    self.grads = self.views(self.dw)
+
+
+  def load_grads(self, grads):
+    """
+    Copies a gradient dictionary, as returned by model.loss, into the
+    gradient buffer.
+    """
+    for k in self.names:
+      np.copyto(self.grads[k], grads[k], casting='same_kind')
+
+
+  def set(self, flat):
+    """
+    Overwrites all parameters from a flat vector, keeping the views valid.
+    """
+    if flat is not self.w:
+      np.copyto(self.w, flat, casting='same_kind')
+
+
+  def snapshot(self):
+    """
+    Returns a copy of all parameters as one flat vector.
+    """
+    return self.w.copy()
+
+
+  def restore(self, snapshot):
+    """
+    Restores parameters saved with snapshot().
+    """
+    self.set(snapshot)
+
+
+  def norm(self):
+    """
+    L2 norm of all parameters.
+    """
+    return np.sqrt(np.dot(self.w, self.w))
+
+
+  def grad_norm(self):
+    """
+    L2 norm of the gradient buffer.
+    """
+    return np.sqrt(np.dot(self.dw, self.dw))
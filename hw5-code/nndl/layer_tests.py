@@ -1,7 +1,36 @@
 from nndl.layers import *
 from utils.gradient_check import eval_numerical_gradient, eval_numerical_gradient_array
 from nndl.layer_utils import affine_relu_forward, affine_relu_backward
-from nndl.fc_net import FullyConnectedNet
+from nndl.layer_utils import affine_batchnorm_relu_forward
+from nndl.conv_layer_utils import conv_relu_pool_forward, conv_relu_pool_backward
+from nndl.conv_layer_utils import conv_relu_pool_fused_forward, conv_relu_pool_fused_backward
+from nndl.fc_net import FullyConnectedNet, TwoLayerNet
+from nndl.quantization import QuantizedModel, int8_matmul
+from nndl.pruning import magnitude_prune, sparsify
+from nndl.conv_layers import conv_forward_naive, conv_backward_naive
+from utils.fast_layers import conv_forward_winograd, conv_backward_winograd
+from utils.fast_layers import conv_forward_fft, conv_backward_fft
+from utils.fast_layers import conv_forward_nhwc, conv_backward_nhwc
+from utils.fast_layers import max_pool_forward_nhwc, max_pool_backward_nhwc
+from utils.fast_layers import max_pool_forward_window, max_pool_backward_window
+from nndl.conv_layers import max_pool_forward_naive, max_pool_backward_naive
+from nndl.conv_layers import spatial_batchnorm_forward, spatial_batchnorm_backward
+from nndl.conv_layers import fold_batchnorm
+from nndl.conv_layers import conv_forward_grouped_naive, conv_backward_grouped_naive
+from utils.fast_layers import conv_forward_grouped, conv_backward_grouped
+from utils.fast_layers import conv_forward_depthwise, conv_backward_depthwise
+from utils.fast_layers import conv_forward_pointwise, conv_backward_pointwise
+from utils.fast_layers import avg_pool_forward_fast, avg_pool_backward_fast
+from utils.fast_layers import global_avg_pool_forward, global_avg_pool_backward
+from utils.fast_layers import ConvAutotuner, conv_forward_auto, conv_forward_strides
+from utils.fast_layers import conv_forward_fast, conv_backward_fast, default_autotuner
+from utils.fast_layers import ConvWorkspace, conv_backward_strides
+from utils.fast_layers import conv_forward_chunked, conv_backward_chunked, _chunk_size
+from nndl.cnn import ThreeLayerConvNet
+from nndl.memory_planner import MemoryPlanner
+import os
+from utils.solver import Solver
+from utils.parallel_solver import DataParallelSolver
 
 def rel_error(x, y):
   """ returns relative error """
@@ -112,4 +141,1053 @@ def fc_net_test():
       for name in sorted(grads):
         f = lambda _: model.loss(X, y)[0]
         grad_num = eval_numerical_gradient(f, model.params[name], verbose=False, h=1e-5)
-        print('{} relative error: {}'.format(name, rel_error(grad_num, grads[name])))
\ No newline at end of file
+        print('{} relative error: {}'.format(name, rel_error(grad_num, grads[name])))
+
+def conv_winograd_test():
+    # Compare the Winograd convolution against the naive implementation
+    x = np.random.randn(2, 3, 7, 6)
+    w = np.random.randn(4, 3, 3, 3)
+    b = np.random.randn(4)
+    conv_param = {'stride': 1, 'pad': 1}
+
+    out_naive, cache_naive = conv_forward_naive(x, w, b, conv_param)
+    out, cache = conv_forward_winograd(x, w, b, conv_param)
+    dout = np.random.randn(*out.shape)
+    dx_naive, dw_naive, db_naive = conv_backward_naive(dout, cache_naive)
+    dx, dw, db = conv_backward_winograd(dout, cache)
+
+    dx_num = eval_numerical_gradient_array(lambda x: conv_forward_winograd(x, w, b, conv_param)[0], x, dout)
+    dw_num = eval_numerical_gradient_array(lambda w: conv_forward_winograd(x, w, b, conv_param)[0], w, dout)
+
+    # The tight check is the comparison with the naive convolution. Finite
+    # differences lose about eps * |out| / h on elements with tiny gradients,
+    # which takes even the naive convolution to ~1e-7 over random draws, so
+    # the numerical-gradient bound is looser.
+    print('If conv_forward_winograd and conv_backward_winograd are working, differences from naive should be less than 1e-10')
+    print('and numerical gradient errors less than 1e-6:')
+    print('Difference from naive: {}'.format(rel_error(out_naive, out)))
+    print('dx difference from naive: {}'.format(rel_error(dx_naive, dx)))
+    print('dw difference from naive: {}'.format(rel_error(dw_naive, dw)))
+    print('db difference from naive: {}'.format(rel_error(db_naive, db)))
+    print('dx error: {}'.format(rel_error(dx_num, dx)))
+    print('dw error: {}'.format(rel_error(dw_num, dw)))
+
+def conv_fft_test():
+    # Compare the FFT convolution against the naive implementation
+    x = np.random.randn(2, 3, 9, 7)
+    w = np.random.randn(4, 3, 5, 5)
+    b = np.random.randn(4)
+
+    for stride in [1, 2]:
+      conv_param = {'stride': stride, 'pad': 2 if stride == 1 else 1}
+      out_naive, cache_naive = conv_forward_naive(x, w, b, conv_param)
+      out, cache = conv_forward_fft(x, w, b, conv_param)
+      dout = np.random.randn(*out.shape)
+      dx_naive, dw_naive, db_naive = conv_backward_naive(dout, cache_naive)
+      dx, dw, db = conv_backward_fft(dout, cache)
+
+      print('Stride {}: if conv_forward_fft and conv_backward_fft are working, differences should be less than 1e-9:'.format(stride))
+      print('Difference from naive: {}'.format(rel_error(out_naive, out)))
+      print('dx difference from naive: {}'.format(rel_error(dx_naive, dx)))
+      print('dw difference from naive: {}'.format(rel_error(dw_naive, dw)))
+      print('db difference from naive: {}'.format(rel_error(db_naive, db)))
+
+def nhwc_layout_test():
+    # Compare the channels-last conv and pool layers against the naive NCHW ones
+    x = np.random.randn(2, 3, 8, 8)
+    w = np.random.randn(4, 3, 3, 3)
+    b = np.random.randn(4)
+    conv_param = {'stride': 1, 'pad': 1}
+    pool_param = {'pool_height': 2, 'pool_width': 2, 'stride': 2}
+    to_nhwc = lambda a: np.ascontiguousarray(a.transpose(0, 2, 3, 1))
+    to_nchw = lambda a: a.transpose(0, 3, 1, 2)
+
+    out_naive, cache_naive = conv_forward_naive(x, w, b, conv_param)
+    out, cache = conv_forward_nhwc(to_nhwc(x), w, b, conv_param)
+    dout = np.random.randn(*out_naive.shape)
+    dx_naive, dw_naive, db_naive = conv_backward_naive(dout, cache_naive)
+    dx, dw, db = conv_backward_nhwc(to_nhwc(dout), cache)
+
+    print('If conv_forward_nhwc and conv_backward_nhwc are working, differences should be less than 1e-9:')
+    print('Difference from naive: {}'.format(rel_error(out_naive, to_nchw(out))))
+    print('dx difference from naive: {}'.format(rel_error(dx_naive, to_nchw(dx))))
+    print('dw difference from naive: {}'.format(rel_error(dw_naive, dw)))
+    print('db difference from naive: {}'.format(rel_error(db_naive, db)))
+
+    out_naive, cache_naive = max_pool_forward_naive(x, pool_param)
+    out, cache = max_pool_forward_nhwc(to_nhwc(x), pool_param)
+    dout = np.random.randn(*out_naive.shape)
+    dx_naive = max_pool_backward_naive(dout, cache_naive)
+    dx = max_pool_backward_nhwc(to_nhwc(dout), cache)
+
+    print('If max_pool_forward_nhwc and max_pool_backward_nhwc are working, differences should be less than 1e-9:')
+    print('Difference from naive: {}'.format(rel_error(out_naive, to_nchw(out))))
+    print('dx difference from naive: {}'.format(rel_error(dx_naive, to_nchw(dx))))
+
+def max_pool_window_test():
+    # Compare the general max pool on overlapping windows against the naive one
+    x = np.random.randn(2, 3, 9, 9)
+    pool_param = {'pool_height': 3, 'pool_width': 3, 'stride': 2}
+
+    out_naive, cache_naive = max_pool_forward_naive(x, pool_param)
+    out, cache = max_pool_forward_window(x, pool_param)
+    dout = np.random.randn(*out_naive.shape)
+    dx_naive = max_pool_backward_naive(dout, cache_naive)
+    dx = max_pool_backward_window(dout, cache)
+    dx_num = eval_numerical_gradient_array(lambda x: max_pool_forward_window(x, pool_param)[0], x, dout)
+
+    print('If max_pool_forward_window and max_pool_backward_window are working, errors should be less than 1e-9:')
+    print('Difference from naive: {}'.format(rel_error(out_naive, out)))
+    print('dx difference from naive: {}'.format(rel_error(dx_naive, dx)))
+    print('dx error: {}'.format(rel_error(dx_num, dx)))
+
+def spatial_batchnorm_test():
+    # Gradient check of spatial batchnorm, and the test-time fold into conv
+    N, C, H, W = 2, 3, 4, 5
+    x = 5 * np.random.randn(N, C, H, W) + 12
+    gamma = np.random.randn(C)
+    beta = np.random.randn(C)
+    dout = np.random.randn(N, C, H, W)
+    bn_param = {'mode': 'train'}
+
+    out, _ = spatial_batchnorm_forward(x, gamma, beta, bn_param)
+    x_nhwc = x.transpose(0, 2, 3, 1).reshape(-1, C)
+    out_ref, _ = batchnorm_forward(x_nhwc, gamma, beta, {'mode': 'train'})
+    out_ref = out_ref.reshape(N, H, W, C).transpose(0, 3, 1, 2)
+
+    fx = lambda x: spatial_batchnorm_forward(x, gamma, beta, bn_param)[0]
+    fg = lambda a: spatial_batchnorm_forward(x, a, beta, bn_param)[0]
+    fb = lambda b: spatial_batchnorm_forward(x, gamma, b, bn_param)[0]
+    dx_num = eval_numerical_gradient_array(fx, x, dout)
+    da_num = eval_numerical_gradient_array(fg, gamma.copy(), dout)
+    db_num = eval_numerical_gradient_array(fb, beta.copy(), dout)
+    _, cache = spatial_batchnorm_forward(x, gamma, beta, bn_param)
+    dx, dgamma, dbeta = spatial_batchnorm_backward(dout, cache)
+
+    # Fold test-time batchnorm into a preceding convolution
+    w = np.random.randn(C, 2, 3, 3)
+    b = np.random.randn(C)
+    x_in = np.random.randn(N, 2, H, W)
+    conv_param = {'stride': 1, 'pad': 1}
+    bn_param['mode'] = 'test'
+    a, _ = conv_forward_naive(x_in, w, b, conv_param)
+    out_bn, _ = spatial_batchnorm_forward(a, gamma, beta, bn_param)
+    w_fold, b_fold = fold_batchnorm(w, b, gamma, beta, bn_param)
+    out_fold, _ = conv_forward_naive(x_in, w_fold, b_fold, conv_param)
+
+    print('If spatial batchnorm is working, errors should be less than 1e-7:')
+    print('Difference from transposed batchnorm: {}'.format(rel_error(out_ref, out)))
+    print('dx error: {}'.format(rel_error(dx_num, dx)))
+    print('dgamma error: {}'.format(rel_error(da_num, dgamma)))
+    print('dbeta error: {}'.format(rel_error(db_num, dbeta)))
+    print('Folded conv difference: {}'.format(rel_error(out_bn, out_fold)))
+
+def grouped_conv_test():
+    # Compare the grouped, depthwise and pointwise fast paths against the
+    # naive grouped convolution
+    x = np.random.randn(2, 4, 7, 7)
+    tests = [
+        ('grouped', conv_forward_grouped, conv_backward_grouped, (6, 2, 3, 3), 2, 1),
+        ('depthwise', conv_forward_depthwise, conv_backward_depthwise, (8, 1, 3, 3), 4, 2),
+        ('pointwise', conv_forward_pointwise, conv_backward_pointwise, (5, 4, 1, 1), 1, 2),
+    ]
+
+    print('If the grouped convolutions are working, differences should be less than 1e-9:')
+    for name, forward, backward, w_shape, groups, stride in tests:
+        w = np.random.randn(*w_shape)
+        b = np.random.randn(w_shape[0])
+        conv_param = {'stride': stride, 'pad': (w_shape[2] - 1) // 2, 'groups': groups}
+
+        out_naive, cache_naive = conv_forward_grouped_naive(x, w, b, conv_param)
+        out, cache = forward(x, w, b, conv_param)
+        dout = np.random.randn(*out.shape)
+        grads_naive = conv_backward_grouped_naive(dout, cache_naive)
+        grads = backward(dout, cache)
+
+        print('{} difference from naive: {}'.format(name, rel_error(out_naive, out)))
+        for g_name, g_naive, g in zip(['dx', 'dw', 'db'], grads_naive, grads):
+            print('{} {} difference from naive: {}'.format(name, g_name, rel_error(g_naive, g)))
+
+def avg_pool_test():
+    # Gradient checks of average pooling on tiling and overlapping windows,
+    # and of global average pooling
+    x = np.random.randn(2, 3, 8, 8)
+
+    print('If average pooling is working, errors should be less than 1e-8:')
+    for pool_param in [{'pool_height': 2, 'pool_width': 2, 'stride': 2},
+                       {'pool_height': 3, 'pool_width': 3, 'stride': 2}]:
+        out, cache = avg_pool_forward_fast(x, pool_param)
+        dout = np.random.randn(*out.shape)
+        dx = avg_pool_backward_fast(dout, cache)
+        dx_num = eval_numerical_gradient_array(lambda x: avg_pool_forward_fast(x, pool_param)[0], x, dout)
+        print('{}x{} stride {} dx error: {}'.format(pool_param['pool_height'], pool_param['pool_width'],
+                                                   pool_param['stride'], rel_error(dx_num, dx)))
+
+    out, cache = global_avg_pool_forward(x)
+    dout = np.random.randn(*out.shape)
+    dx = global_avg_pool_backward(dout, cache)
+    dx_num = eval_numerical_gradient_array(lambda x: global_avg_pool_forward(x)[0], x, dout)
+    print('Global average pool difference: {}'.format(rel_error(x.mean(axis=(2, 3)), out)))
+    print('Global average pool dx error: {}'.format(rel_error(dx_num, dx)))
+
+    # The float16 sum of these activations overflows, so the mean has to be
+    # accumulated in a wider type
+    x16 = (100 + np.random.randn(2, 3, 32, 32)).astype(np.float16)
+    out, _ = global_avg_pool_forward(x16)
+    expected = x16.astype(np.float64).mean(axis=(2, 3))
+    print('Global average pool float16 dtype {} and difference (should be less than 1e-3): {}'.format(
+        out.dtype, rel_error(expected, out.astype(np.float64))))
+    for pool_param in [{'pool_height': 32, 'pool_width': 32, 'stride': 32},
+                       {'pool_height': 27, 'pool_width': 27, 'stride': 5}]:
+        out, _ = avg_pool_forward_fast(x16, pool_param)
+        expected, _ = avg_pool_forward_fast(x16.astype(np.float64), pool_param)
+        print('{}x{} stride {} float16 dtype {} and difference (should be less than 1e-3): {}'.format(
+            pool_param['pool_height'], pool_param['pool_width'], pool_param['stride'],
+            out.dtype, rel_error(expected, out.astype(np.float64))))
+
+def conv_autotuner_test():
+    # Tune two layer shapes, then check that the decisions are read back from
+    # the JSON file and that the tuned layers compute the same output
+    import os, tempfile
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'conv_autotune.json')
+    tuner = ConvAutotuner(path, num_repeats=1)
+    x = np.random.randn(4, 16, 8, 8)
+    outs = []
+    for w_shape in [(8, 16, 3, 3), (8, 16, 1, 1)]:
+        w = np.random.randn(*w_shape)
+        b = np.random.randn(w_shape[0])
+        conv_param = {'stride': 1, 'pad': (w_shape[2] - 1) // 2, 'autotuner': tuner}
+        out, _ = conv_forward_auto(x, w, b, conv_param)
+        out_strides, _ = conv_forward_strides(x, w, b, conv_param)
+        outs.append(rel_error(out_strides, out))
+
+    reloaded = ConvAutotuner(path)
+    print('If the autotuner is working, differences should be less than 1e-9 and the decisions equal:')
+    print('Difference from strides: {}'.format(max(outs)))
+    print('Decisions reloaded: {}'.format(reloaded.decisions == tuner.decisions))
+    print('Only the cache is left in its directory: {}'.format(os.listdir(directory) == ['conv_autotune.json']))
+    reloaded.report()
+    os.remove(path)
+    os.rmdir(directory)
+
+    # conv_forward_fast tunes new shapes with the module's default tuner
+    w = np.random.randn(6, 16, 3, 3)
+    b = np.random.randn(6)
+    conv_param = {'stride': 1, 'pad': 1}
+    out, cache = conv_forward_fast(x, w, b, conv_param)
+    dout = np.random.randn(*out.shape)
+    grads = conv_backward_fast(dout, cache)
+    out_strides, cache = conv_forward_strides(x, w, b, conv_param)
+    grads_strides = conv_backward_strides(dout, cache)
+    print('conv_forward_fast used the default tuner: {}, difference from strides: {}'.format(
+        ConvAutotuner.signature(x, w, conv_param) in default_autotuner.decisions,
+        max(rel_error(u, v) for u, v in zip((out,) + grads, (out_strides,) + grads_strides))))
+
+    # When no candidate runs, the decision falls back to 'strides'
+    class FailingTuner(ConvAutotuner):
+        @staticmethod
+        def candidates(x, w, conv_param):
+            return ['winograd']  # rejects the 5x5 filter below
+    w = np.random.randn(6, 16, 5, 5)
+    decision = FailingTuner().tune(x, w, {'stride': 1, 'pad': 2})
+    print('Decision when every candidate fails (should be strides): {}'.format(decision['method']))
+
+
+def memory_planner_test(batch_sizes=(20, 50)):
+    # Compare predicted peaks against tracemalloc for a conv net trained with
+    # Adam, a fully-connected net with batchnorm and dropout, and update rules
+    # whose optim_config changes the size of their state
+    rng = np.random.RandomState(0)
+    data = {'X_train': rng.randn(100, 3, 16, 16).astype(np.float32),
+            'y_train': rng.randint(10, size=100),
+            'X_val': rng.randn(100, 3, 16, 16).astype(np.float32),
+            'y_val': rng.randint(10, size=100)}
+    fc_data = {k: v.reshape(v.shape[0], -1) if k.startswith('X') else v
+               for k, v in data.items()}
+    conv = ThreeLayerConvNet(input_dim=(3, 16, 16), dtype=np.float32)
+    fc = FullyConnectedNet([200, 200], input_dim=768, dropout=0.5,
+                           use_batchnorm=True, dtype=np.float32)
+    errors, state_bytes = [], {}
+    for model, d, input_dim, rule, optim_config in [
+            (conv, data, (3, 16, 16), 'adam', None),
+            (fc, fc_data, (768,), 'sgd', None),
+            (fc, fc_data, (768,), 'adam_compact', {'moment_dtype': 'int8'}),
+            (fc, fc_data, (768,), 'adafactor', {'beta1': 0.9})]:
+        planner = MemoryPlanner(model, input_dim, update_rule=rule,
+                                optim_config=optim_config)
+        for row in planner.validate(d, batch_sizes):
+            errors.append(abs(row[1] - row[2]) / float(row[2]))
+            errors.append(abs(row[3] - row[4]) / float(row[4]))
+        if optim_config is not None:
+            default = MemoryPlanner(model, input_dim, update_rule=rule)
+            state_bytes[rule] = (planner.state_bytes, default.state_bytes)
+    print('If the memory planner is working, predictions should be within a few percent of the measured peaks:')
+    print('Largest relative error: {}'.format(max(errors)))
+    print('Optimizer state bytes with and without optim_config (should differ): {}'.format(state_bytes))
+
+    # A tuned model picks its conv method per batch size, so it is refused
+    # rather than tuned as a side effect
+    tuner = ConvAutotuner()
+    tuned = ThreeLayerConvNet(input_dim=(3, 16, 16), dtype=np.float32, conv_autotuner=tuner)
+    try:
+        MemoryPlanner(tuned, (3, 16, 16))
+        refused = False
+    except ValueError:
+        refused = True
+    print('Model with a conv_autotuner refused (should be True): {}, tuner decisions {}'.format(
+        refused, len(tuner.decisions)))
+
+
+def flat_checkpoint_test():
+    # Save a flat-params Solver mid-training, resume a second Solver from the
+    # checkpoint, and check that both take the same next step
+    import os, tempfile
+    rng = np.random.RandomState(0)
+    data = {'X_train': rng.randn(50, 20), 'y_train': rng.randint(10, size=50),
+            'X_val': rng.randn(10, 20), 'y_val': rng.randint(10, size=10)}
+    name = os.path.join(tempfile.mkdtemp(), 'flat')
+    model = FullyConnectedNet([15], input_dim=20, dtype=np.float64, seed=0)
+    solver = Solver(model, data, update_rule='adam', flat_params=True,
+                    checkpoint_name=name, verbose=False)
+    for _ in range(3):
+        solver._step()
+    solver._save_checkpoint()
+
+    resumed = Solver(FullyConnectedNet([15], input_dim=20, dtype=np.float64),
+                     data, update_rule='adam', flat_params=True, verbose=False)
+    resumed.load_checkpoint('%s_epoch_0.pkl' % name)
+    state = solver.optim_configs['flat']
+    state_resumed = resumed.optim_configs['flat']
+    for s in (solver, resumed):
+        np.random.seed(1)
+        s._step()
+
+    print('If flat checkpoints round-trip, differences should be 0 and t equal:')
+    print('Moment differences: {}, {}'.format(rel_error(state['v'], state_resumed['v']),
+                                              rel_error(state['a'], state_resumed['a'])))
+    print('t: {} vs {}'.format(state['t'], state_resumed['t']))
+    print('Parameter difference after the next step: {}'.format(
+        rel_error(solver.flat.w, resumed.flat.w)))
+    print('Params are views of the flat buffer: {}'.format(
+        all(np.shares_memory(v, resumed.flat.w) for v in resumed.model.params.values())))
+
+
+def inference_test():
+    # Compare the cache-free test-time pass of loss(X) with the cached
+    # training-path layers run with batchnorm and dropout in test mode
+    rng = np.random.RandomState(0)
+    X = rng.randn(6, 3, 8, 8)
+    y = rng.randint(10, size=6)
+
+    print('If the inference paths are working, differences should be less than 1e-12:')
+    model = FullyConnectedNet([20, 15], input_dim=192, dropout=0.5, use_batchnorm=True,
+                              dtype=np.float64, seed=0)
+    for i in range(1, 3):
+        model.params['gamma%d' % i] = rng.rand(model.params['gamma%d' % i].size) + 0.5
+        model.params['beta%d' % i] = rng.randn(model.params['beta%d' % i].size)
+    model.loss(X, y)  # updates the running means and variances
+    scores = model.loss(X)
+    out = X
+    for i in range(1, 3):
+        bn_param = dict(model.bn_params[i - 1], mode='test')
+        out, _ = affine_batchnorm_relu_forward(out, model.params['W%d' % i], model.params['b%d' % i],
+                                               model.params['gamma%d' % i], model.params['beta%d' % i],
+                                               bn_param)
+        out, _ = dropout_forward(out, {'mode': 'test', 'p': 0.5})
+    expected, _ = affine_forward(out, model.params['W3'], model.params['b3'])
+    print('FullyConnectedNet with batchnorm and dropout: {}'.format(rel_error(expected, scores)))
+
+    for layout, global_pool in [('NCHW', False), ('NHWC', False), ('NCHW', True)]:
+        model = ThreeLayerConvNet(input_dim=(3, 8, 8), num_filters=4, filter_size=3, hidden_dim=10,
+                                  weight_scale=1e-1, dtype=np.float64, layout=layout,
+                                  global_pool=global_pool)
+        scores = model.loss(X)
+        x = X if layout == 'NCHW' else np.ascontiguousarray(X.transpose(0, 2, 3, 1))
+        conv_param = {'stride': 1, 'pad': 1, 'layout': layout}
+        pool_param = {'pool_height': 2, 'pool_width': 2, 'stride': 2, 'layout': layout}
+        out, _ = conv_relu_pool_forward(x, model.params['W1'], model.params['b1'], conv_param, pool_param)
+        if global_pool:
+            out, _ = global_avg_pool_forward(out, pool_param)
+        out, _ = affine_relu_forward(out, model.params['W2'], model.params['b2'])
+        expected, _ = affine_forward(out, model.params['W3'], model.params['b3'])
+        print('ThreeLayerConvNet {}{}: {}'.format(layout, ' with global_pool' if global_pool else '',
+                                                 rel_error(expected, scores)))
+
+
+class _ExitingNet(FullyConnectedNet):
+    # Exits as soon as a worker process asks it for gradients
+    def loss(self, X, y=None):
+        if y is not None:
+            os._exit(3)
+        return super(_ExitingNet, self).loss(X, y)
+
+
+def parallel_solver_test(num_workers=2):
+    # Train the same model with Solver and DataParallelSolver from the same
+    # seed, with and without a fixed loss scale, and check that the losses
+    # and parameters agree up to summation order
+    rng = np.random.RandomState(0)
+    data = {'X_train': rng.randn(100, 20), 'y_train': rng.randint(10, size=100),
+            'X_val': rng.randn(10, 20), 'y_val': rng.randint(10, size=10)}
+    print('If DataParallelSolver is working, differences should be less than 1e-10:')
+    for loss_scale in [1.0, 8.0]:
+        solvers = []
+        for cls, kwargs in [(Solver, {'flat_params': True}),
+                            (DataParallelSolver, {'num_workers': num_workers})]:
+            np.random.seed(1)
+            model = FullyConnectedNet([15], input_dim=20, dtype=np.float64)
+            solver = cls(model, data, update_rule='adam', batch_size=20, num_epochs=2,
+                         loss_scale=loss_scale, verbose=False, **kwargs)
+            solver.train()
+            solvers.append(solver)
+        serial, parallel = solvers
+        print('loss_scale={}: loss difference {}, parameter difference {}'.format(
+            loss_scale, rel_error(np.array(serial.loss_history), np.array(parallel.loss_history)),
+            rel_error(serial.flat.w, parallel.flat.w)))
+
+    solver = DataParallelSolver(_ExitingNet([15], input_dim=20, dtype=np.float64), data,
+                                batch_size=20, num_epochs=1, verbose=False,
+                                num_workers=num_workers)
+    try:
+        solver.train()
+        print('A dead worker should raise, but training finished')
+    except RuntimeError as e:
+        print('A dead worker raises: {}'.format(e))
+
+
+def loss_scale_test(num_steps=12):
+    # Force gradient overflows under dynamic loss scaling and check that the
+    # scale halves, that overflowing steps are skipped without touching the
+    # parameters, and that the steps taken match an unscaled Solver (all
+    # scales are powers of two, so unscaling is exact)
+    rng = np.random.RandomState(0)
+    data = {'X_train': rng.randn(50, 20), 'y_train': rng.randint(10, size=50),
+            'X_val': rng.randn(10, 20), 'y_val': rng.randint(10, size=10)}
+    solvers = []
+    for loss_scale in ['dynamic', 1.0]:
+        np.random.seed(0)
+        model = FullyConnectedNet([15], input_dim=20, weight_scale=1, dtype=np.float32)
+        solvers.append(Solver(model, data, update_rule='sgd', batch_size=10,
+                              loss_scale=loss_scale, verbose=False))
+    solver, reference = solvers
+
+    def step(t):
+        scale, skipped = solver.loss_scale, solver.num_skipped_steps
+        w = {k: v.copy() for k, v in solver.model.params.items()}
+        reference.model.params = {k: v.copy() for k, v in w.items()}
+        np.random.seed(t)
+        solver._step()
+        assert solver.model.loss_scale == scale
+        if solver.num_skipped_steps > skipped:
+            assert solver.loss_scale == scale / 2
+            assert all(np.array_equal(w[k], v) for k, v in solver.model.params.items())
+            return False
+        np.random.seed(t)
+        reference._step()
+        assert all(np.array_equal(reference.model.params[k], v)
+                   for k, v in solver.model.params.items())
+        return True
+
+    # Start just below the float32 limit so that the first steps overflow
+    solver.loss_scale = 2.0 ** 127
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        taken = [step(t) for t in range(num_steps)]
+    assert solver.num_skipped_steps == taken.count(False) > 0
+    assert solver.loss_scale == 2.0 ** (127 - taken.count(False))
+
+    # An overflow at a scale of 1 is still caught
+    solver.loss_scale = 1.0
+    loss = solver.model.loss
+    def overflowing_loss(X, y=None):
+        out, grads = loss(X, y)
+        grads['W1'][0, 0] = np.inf
+        return out, grads
+    solver.model.loss = overflowing_loss
+    assert not step(num_steps)
+    del solver.model.loss
+    assert solver.loss_scale == 0.5
+
+    # And the scale doubles after 1000 steps without overflow
+    solver._good_steps = 999
+    assert step(num_steps + 1)
+    assert solver.loss_scale == 1.0
+
+    # A resumed run picks up the scale and counters where the checkpoint left
+    # them rather than restarting at 2**15
+    import tempfile
+    solver._good_steps = 7
+    solver.checkpoint_name = os.path.join(tempfile.mkdtemp(), 'scale')
+    solver._save_checkpoint()
+    resumed = Solver(FullyConnectedNet([15], input_dim=20, dtype=np.float32), data,
+                     update_rule='sgd', batch_size=10, loss_scale='dynamic', verbose=False)
+    resumed.load_checkpoint('%s_epoch_0.pkl' % solver.checkpoint_name)
+    assert resumed.loss_scale == solver.loss_scale == 1.0
+    assert resumed._good_steps == 7
+    assert resumed.num_skipped_steps == solver.num_skipped_steps
+    print('Dynamic loss scaling skipped {} of {} steps, down to a scale of 2**{}, '
+          'and caught an overflow at a scale of 1'.format(
+          taken.count(False), num_steps, 127 - taken.count(False)))
+
+
+def pruning_test(sparsity=0.8):
+    # Compare the sparse test-time forward pass of a pruned model with the
+    # dense forward pass over its masked weights, then fine-tune with Solver
+    # and check that the pruned weights stay at zero
+    rng = np.random.RandomState(0)
+    X, y = rng.randn(50, 20), rng.randint(10, size=50)
+    data = {'X_train': X, 'y_train': y, 'X_val': X, 'y_val': y}
+    print('If pruning is working, differences should be less than 1e-12 and all pruned weights zero:')
+    for use_batchnorm in [False, True]:
+        model = FullyConnectedNet([30, 20], input_dim=20, use_batchnorm=use_batchnorm,
+                                  weight_scale=1e-1, dtype=np.float64)
+        magnitude_prune(model, sparsity)
+        dense = model.loss(data['X_val'])
+        density = sparsify(model)
+        scores = model.loss(data['X_val'])
+        print('use_batchnorm={}: sparse vs dense difference {}, densities {}'.format(
+            use_batchnorm, rel_error(dense, scores),
+            ', '.join('%s %.2f' % (k, density[k]) for k in sorted(density))))
+
+    for flat_params in [False, True]:
+        model = FullyConnectedNet([30, 20], input_dim=20, weight_scale=1e-1, dtype=np.float64)
+        masks = magnitude_prune(model, sparsity)
+        solver = Solver(model, data, update_rule='sgd_momentum', batch_size=10, num_epochs=2,
+                        flat_params=flat_params, verbose=False)
+        solver.train()
+        zero = all(not np.any(model.params[k][~m]) for k, m in masks.items())
+        trained = all(np.any(model.params[k][m] != 0) for k, m in masks.items())
+        print('flat_params={}: pruned weights zero after training: {}, kept weights nonzero: {}'.format(
+            flat_params, zero, trained))
+
+
+def quantization_test():
+    # int8_matmul must equal the exact integer product, including across
+    # several float32 blocks and at the ends of the int8 range; quantized
+    # models must give scores close to the float model's
+    rng = np.random.RandomState(0)
+    a = rng.randint(-128, 128, size=(7, 3000)).astype(np.int8)
+    b = rng.randint(-128, 128, size=(3000, 5)).astype(np.int8)
+    a[0], b[:, 0] = -128, -128
+    exact = a.astype(np.int64).dot(b.astype(np.int64))
+    print('If int8_matmul is working, the integer products should be equal:')
+    print('int8_matmul exact: {}'.format(np.array_equal(int8_matmul(a, b), exact)))
+
+    print('If QuantizedModel is working, errors relative to the largest score should be less than 5e-2:')
+    X = rng.randn(20, 3, 8, 8)
+    fc = FullyConnectedNet([30, 20], input_dim=192, use_batchnorm=True, weight_scale=1e-1,
+                           dtype=np.float64)
+    fc.loss(X, rng.randint(10, size=20))  # updates the running means and variances
+    models = [('TwoLayerNet', TwoLayerNet(input_dim=192, hidden_dims=30, weight_scale=1e-1)),
+              ('FullyConnectedNet with batchnorm', fc),
+              ('ThreeLayerConvNet', ThreeLayerConvNet(input_dim=(3, 8, 8), num_filters=4, filter_size=3,
+                                                      hidden_dim=10, weight_scale=1e-1,
+                                                      dtype=np.float64))]
+    for name, model in models:
+        scores = model.loss(X)
+        quantized = QuantizedModel(model, X).loss(X)
+        err = np.max(np.abs(quantized - scores)) / np.max(np.abs(scores))
+        agree = np.mean(np.argmax(quantized, axis=1) == np.argmax(scores, axis=1))
+        print('{}: error {}, top-1 agreement {}'.format(name, err, agree))
+
+
+def parallel_im2col_test(thread_counts=(1, 2, 3, 4)):
+    # The OpenMP kernels must give exactly the serial results for any number
+    # of threads, and fast_layers must fall back to the serial kernels when
+    # the compiled extension predates them
+    import importlib.util, sys, types
+    import utils.fast_layers as fast_layers
+    from utils.im2col_cython import im2col_cython, col2im_cython, col2im_6d_cython
+    from utils.im2col_cython import im2col_cython_parallel, col2im_cython_parallel
+    from utils.im2col_cython import col2im_6d_cython_parallel, set_num_threads, get_num_threads
+
+    N, C, H, W, HH, WW, pad, stride = 3, 5, 9, 9, 3, 3, 1, 2
+    out_h, out_w = (H + 2 * pad - HH) // stride + 1, (W + 2 * pad - WW) // stride + 1
+    x = np.random.randn(N, C, H, W)
+    cols = np.random.randn(C * HH * WW, N * out_h * out_w)
+    cols_6d = np.random.randn(C, HH, WW, N, out_h, out_w)
+    serial = (im2col_cython(x, HH, WW, pad, stride),
+              col2im_cython(cols, N, C, H, W, HH, WW, pad, stride),
+              col2im_6d_cython(cols_6d, N, C, H, W, HH, WW, pad, stride))
+
+    print('If the parallel kernels are working, they should equal the serial ones for every thread count:')
+    num_threads = get_num_threads()
+    try:
+        for t in thread_counts:
+            set_num_threads(t)
+            parallel = (im2col_cython_parallel(x, HH, WW, pad, stride),
+                        col2im_cython_parallel(cols, N, C, H, W, HH, WW, pad, stride),
+                        col2im_6d_cython_parallel(cols_6d, N, C, H, W, HH, WW, pad, stride))
+            print('{} threads: {}'.format(t, all(np.array_equal(s, p) for s, p in zip(serial, parallel))))
+    finally:
+        set_num_threads(num_threads)
+
+    # Load a second copy of fast_layers against an extension module that only
+    # has the original serial kernels
+    stale = types.ModuleType('utils.im2col_cython')
+    stale.im2col_cython, stale.col2im_cython = im2col_cython, col2im_cython
+    stale.col2im_6d_cython = col2im_6d_cython
+    extension = sys.modules['utils.im2col_cython']
+    sys.modules['utils.im2col_cython'] = stale
+    try:
+        spec = importlib.util.spec_from_file_location('fast_layers_stale', fast_layers.__file__)
+        fallback = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(fallback)
+    finally:
+        sys.modules['utils.im2col_cython'] = extension
+
+    w = np.random.randn(4, C, HH, WW)
+    b = np.random.randn(4)
+    conv_param = {'stride': stride, 'pad': pad}
+    errors = []
+    for name in ['strides', 'im2col']:
+        forward, backward = 'conv_forward_' + name, 'conv_backward_' + name
+        out, cache = getattr(fast_layers, forward)(x, w, b, conv_param)
+        dout = np.random.randn(*out.shape)
+        grads = getattr(fast_layers, backward)(dout, cache)
+        out_stale, cache = getattr(fallback, forward)(x, w, b, conv_param)
+        grads_stale = getattr(fallback, backward)(dout, cache)
+        errors += [rel_error(u, v) for u, v in zip((out,) + grads, (out_stale,) + grads_stale)]
+    print('With a stale extension, get_num_threads() should be 1 and the strides and im2col '
+          'convolutions unchanged: {}, {}'.format(fallback.get_num_threads(), max(errors)))
+
+
+def conv_workspace_test():
+    # Run conv_forward_strides and conv_backward_strides with and without a
+    # ConvWorkspace over a sequence of changing shapes, in a roomy workspace
+    # and in one that only holds a few buffers at a time, and check that the
+    # results are identical and that dx never aliases the workspace
+    shapes = [((4, 3, 8, 8), (5, 3, 3, 3), 1, 1),
+              ((2, 3, 8, 8), (5, 3, 3, 3), 1, 1),
+              ((1, 3, 8, 8), (5, 3, 3, 3), 1, 1),
+              ((4, 3, 9, 9), (5, 3, 3, 3), 2, 1),
+              ((4, 3, 8, 8), (5, 3, 1, 1), 1, 0),
+              ((4, 3, 8, 8), (5, 3, 3, 3), 1, 1)]
+    print('If ConvWorkspace is working, outputs and gradients should equal those without it:')
+    for max_bytes in [512 * 2 ** 20, 128 * 1024]:
+        workspace = ConvWorkspace(max_bytes)
+        equal, aliased = True, False
+        for _ in range(2):
+            for x_shape, w_shape, stride, pad in shapes:
+                x, w, b = np.random.randn(*x_shape), np.random.randn(*w_shape), np.random.randn(w_shape[0])
+                conv_param = {'stride': stride, 'pad': pad}
+                out, cache = conv_forward_strides(x, w, b, conv_param)
+                dout = np.random.randn(*out.shape)
+                grads = conv_backward_strides(dout, cache)
+
+                conv_param = {'stride': stride, 'pad': pad, 'workspace': workspace}
+                out_ws, cache = conv_forward_strides(x, w, b, conv_param)
+                grads_ws = conv_backward_strides(dout, cache)
+                equal &= all(np.array_equal(u, v) for u, v in zip((out,) + grads, (out_ws,) + grads_ws))
+                aliased |= any(np.shares_memory(grads_ws[0], buf) for buf in workspace.buffers.values())
+                assert workspace.nbytes <= workspace.max_bytes
+        print('max_bytes={}: equal {}, dx aliases the workspace {}, hits {}, misses {}'.format(
+            max_bytes, equal, aliased, workspace.hits, workspace.misses))
+
+    # With a single image or filter the transposed output is already
+    # contiguous; it must still be a copy that survives the next call
+    workspace = ConvWorkspace()
+    survived = True
+    for x_shape, w_shape in [((1, 3, 8, 8), (5, 3, 3, 3)), ((4, 3, 8, 8), (1, 3, 3, 3))]:
+        conv_param = {'stride': 1, 'pad': 1, 'workspace': workspace}
+        w, b = np.random.randn(*w_shape), np.random.randn(w_shape[0])
+        out1, _ = conv_forward_strides(np.random.randn(*x_shape), w, b, conv_param)
+        saved = out1.copy()
+        out2, _ = conv_forward_strides(np.random.randn(*x_shape), w, b, conv_param)
+        survived &= np.array_equal(out1, saved) and not np.shares_memory(out1, out2)
+    assert survived
+    print('Outputs with N=1 and F=1 survive the next call (should be True): {}'.format(survived))
+
+    # Least recently used buffers are evicted first, and a buffer larger than
+    # the budget is handed out without being kept
+    workspace = ConvWorkspace(max_bytes=3 * 800)
+    for key in ['a', 'b', 'c', 'a', 'd']:
+        workspace.get(key, (100,), np.float64)
+    big = workspace.get('e', (1000,), np.float64)
+    print('Retained after LRU eviction (should be c, a, d): {}'.format(
+        ', '.join(k[0] for k in workspace.buffers)))
+    print('Oversized buffer retained (should be False): {}'.format(
+        any(buf is big for buf in workspace.buffers.values())))
+
+
+def conv_chunked_test():
+    # conv_forward_chunked and conv_backward_chunked against the unchunked
+    # strided convolution, for budgets that hold the whole batch, an uneven
+    # number of images, and less than a single image, with and without a
+    # workspace and with the input gradient skipped
+    x = np.random.randn(5, 3, 9, 9)
+    w = np.random.randn(4, 3, 3, 3)
+    b = np.random.randn(4)
+    conv_param = {'stride': 2, 'pad': 1}
+    out, cache = conv_forward_strides(x, w, b, conv_param)
+    dout = np.random.randn(*out.shape)
+    grads = conv_backward_strides(dout, cache)
+    bytes_per_image = 3 * 3 * 3 * 5 * 5 * x.itemsize
+
+    print('If conv_forward_chunked and conv_backward_chunked are working, differences should be less than 1e-12:')
+    for budget in [None, 2 * bytes_per_image, bytes_per_image // 3]:
+        for workspace in [None, ConvWorkspace()]:
+            conv_param = {'stride': 2, 'pad': 1}
+            if budget is not None:
+                conv_param['memory_budget'] = budget
+            if workspace is not None:
+                conv_param['workspace'] = workspace
+            out_chunked, cache = conv_forward_chunked(x, w, b, conv_param)
+            grads_chunked = conv_backward_chunked(dout, cache)
+            dx, dw, db = conv_backward_chunked(dout, cache, requires_grad=(False, True, True))
+            errors = [rel_error(u, v) for u, v in zip((out,) + grads, (out_chunked,) + grads_chunked)]
+            errors += [rel_error(grads[1], dw), rel_error(grads[2], db)]
+            print('budget {}, {}: chunk of {} images, max difference {}, dx skipped {}'.format(
+                'default' if budget is None else budget,
+                'workspace' if workspace is not None else 'no workspace',
+                _chunk_size(x, w, conv_param), max(errors), dx is None))
+
+
+def conv_relu_pool_fused_test():
+    # The fused conv-relu-pool layer against the unfused one and against
+    # numerical gradients, for non-overlapping and overlapping pool windows
+    # in both layouts
+    x = np.random.randn(2, 3, 8, 8)
+    w = np.random.randn(4, 3, 3, 3)
+    b = np.random.randn(4)
+    print('If conv_relu_pool_fused_forward and conv_relu_pool_fused_backward are working, differences')
+    print('from the unfused layer should be less than 1e-12 and numerical gradient errors less than 1e-6:')
+    for layout in ['NCHW', 'NHWC']:
+        for pool in [(2, 2), (3, 2)]:
+            conv_param = {'stride': 1, 'pad': 1, 'layout': layout}
+            pool_param = {'pool_height': pool[0], 'pool_width': pool[0], 'stride': pool[1],
+                          'layout': layout}
+            x_l = x if layout == 'NCHW' else np.ascontiguousarray(x.transpose(0, 2, 3, 1))
+            out, cache = conv_relu_pool_fused_forward(x_l, w, b, conv_param, pool_param)
+            out_ref, cache_ref = conv_relu_pool_forward(x_l, w, b, conv_param, pool_param)
+            dout = np.random.randn(*out.shape)
+            grads = conv_relu_pool_fused_backward(dout, cache)
+            grads_ref = conv_relu_pool_backward(dout, cache_ref)
+            diff = max(rel_error(u, v) for u, v in zip((out,) + grads, (out_ref,) + grads_ref))
+
+            f = lambda: conv_relu_pool_fused_forward(x_l, w, b, conv_param, pool_param)[0]
+            num_grads = [eval_numerical_gradient_array(lambda _: f(), v, dout) for v in (x_l, w, b)]
+            num_err = max(rel_error(g, n) for g, n in zip(grads, num_grads))
+            print('{} {}x{} pool, stride {}: unfused {}, numerical {}'.format(
+                layout, pool[0], pool[0], pool[1], diff, num_err))
+
+
+def requires_grad_test():
+    # For every backward pass that takes requires_grad, the gradients that are
+    # not needed must come back as None and the others must be exactly those
+    # of the full backward pass
+    from nndl.layer_utils import affine_relu_backward, affine_batchnorm_relu_backward
+    from nndl.conv_layer_utils import conv_relu_forward, conv_relu_backward
+    import utils.fast_layers as fl
+
+    x = np.random.randn(3, 4, 6, 6)
+    x_nhwc = np.ascontiguousarray(x.transpose(0, 2, 3, 1))
+    x_fc = np.random.randn(5, 7)
+    w_fc, b_fc = np.random.randn(7, 6), np.random.randn(6)
+    gamma, beta = np.random.rand(6) + 0.5, np.random.randn(6)
+    w, b = np.random.randn(8, 4, 3, 3), np.random.randn(8)
+    conv_param = {'stride': 1, 'pad': 1}
+    pool_param = {'pool_height': 2, 'pool_width': 2, 'stride': 2}
+    nhwc = {'layout': 'NHWC'}
+    cases = [
+        ('affine', affine_forward, affine_backward, (x_fc, w_fc, b_fc)),
+        ('affine_relu', affine_relu_forward, affine_relu_backward, (x_fc, w_fc, b_fc)),
+        ('affine_batchnorm_relu', affine_batchnorm_relu_forward, affine_batchnorm_relu_backward,
+         (x_fc, w_fc, b_fc, gamma, beta, {'mode': 'train'})),
+        ('conv_im2col', fl.conv_forward_im2col, fl.conv_backward_im2col, (x, w, b, conv_param)),
+        ('conv_strides', fl.conv_forward_strides, fl.conv_backward_strides, (x, w, b, conv_param)),
+        ('conv_chunked', fl.conv_forward_chunked, fl.conv_backward_chunked,
+         (x, w, b, dict(conv_param, memory_budget=1))),
+        ('conv_nhwc', fl.conv_forward_nhwc, fl.conv_backward_nhwc, (x_nhwc, w, b, conv_param)),
+        ('conv_winograd', fl.conv_forward_winograd, fl.conv_backward_winograd, (x, w, b, conv_param)),
+        ('conv_fft', fl.conv_forward_fft, fl.conv_backward_fft, (x, w, b, conv_param)),
+        ('conv_grouped', fl.conv_forward_grouped, fl.conv_backward_grouped,
+         (x, w[:, :2], b, dict(conv_param, groups=2))),
+        ('conv_depthwise', fl.conv_forward_depthwise, fl.conv_backward_depthwise,
+         (x, w[:, :1], b, dict(conv_param, groups=4))),
+        ('conv_pointwise', fl.conv_forward_pointwise, fl.conv_backward_pointwise,
+         (x, w[:, :, :1, :1], b, {'stride': 1, 'pad': 0})),
+        ('conv_auto', fl.conv_forward_auto, fl.conv_backward_auto, (x, w, b, conv_param)),
+        ('conv_relu', conv_relu_forward, conv_relu_backward, (x, w, b, conv_param)),
+        ('conv_relu_pool', conv_relu_pool_forward, conv_relu_pool_backward,
+         (x, w, b, conv_param, pool_param)),
+        ('conv_relu_pool NHWC', conv_relu_pool_forward, conv_relu_pool_backward,
+         (x_nhwc, w, b, dict(conv_param, **nhwc), dict(pool_param, **nhwc))),
+        ('conv_relu_pool_fused', conv_relu_pool_fused_forward, conv_relu_pool_fused_backward,
+         (x, w, b, conv_param, pool_param)),
+    ]
+
+    print('If requires_grad is working, every line should read True:')
+    for name, forward, backward, args in cases:
+        out, cache = forward(*args)
+        dout = np.random.randn(*out.shape)
+        full = backward(dout, forward(*args)[1])
+        ok = True
+        for requires_grad in [(False, True, True), (False, False, True), (True, False, False),
+                              (False, True, False)]:
+            grads = backward(dout, forward(*args)[1], requires_grad)
+            for need, g, g_full in zip(requires_grad, grads, full):
+                ok &= (g is None) if not need else np.array_equal(g, g_full)
+            # Any trailing gradients (gamma and beta) are always computed
+            ok &= all(np.array_equal(g, g_full) for g, g_full in zip(grads[3:], full[3:]))
+        print('{}: {}'.format(name, ok))
+
+
+def inference_server_test(num_clients=8):
+    # Start an InferenceServer in-process, send concurrent requests over keep-
+    # alive connections and compare the batched answers with top-k of
+    # model.loss(X); then check the status codes of bad requests
+    import asyncio, json
+    from utils.inference_server import InferenceServer, top_k, _request
+
+    X = np.random.randn(num_clients, 3, 8, 8).astype(np.float32)
+    model = FullyConnectedNet([20], input_dim=192, weight_scale=1e-1, dtype=np.float64)
+    classes, probs = top_k(model.loss(X), 3)
+
+    class FailingModel(object):
+        def loss(self, X, y=None):
+            raise RuntimeError('forward pass failed')
+
+    async def status(server, raw):
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        writer.write(raw)
+        await writer.drain()
+        line = await reader.readline()
+        writer.close()
+        return int(line.split()[1])
+
+    def predict(body, k=3, content_type='application/json'):
+        return ('POST /predict?k=%d HTTP/1.1\r\nContent-Type: %s\r\nContent-Length: %d\r\n\r\n' % (
+                k, content_type, len(body))).encode() + body
+
+    async def run():
+        server = InferenceServer(model, (3, 8, 8), port=0, max_batch_size=4, max_wait=0.05)
+        await server.start()
+        try:
+            async def client(i):
+                reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+                answers = []
+                for _ in range(2):
+                    answers.append(await _request(reader, writer, X[i].tobytes(), 3))
+                writer.close()
+                return answers
+            answers = await asyncio.gather(*[client(i) for i in range(num_clients)])
+            batch_sizes = list(server.batcher.batch_sizes)
+
+            x_json = json.dumps({'x': X[0].tolist()}).encode()
+            bad = {
+                'malformed request line': b'POST\r\n\r\n',
+                'header without a colon': b'POST /predict HTTP/1.1\r\nContent-Length 4\r\n\r\n',
+                'bad Content-Length': b'POST /predict HTTP/1.1\r\nContent-Length: abc\r\n\r\n',
+                'non-UTF-8 header': b'POST /predict HTTP/1.1\r\nX-Name: \xff\r\n\r\n',
+                'non-UTF-8 body': predict(b'{"x": "\xff"}'),
+                'wrong input shape': predict(b'{"x": [1, 2, 3]}'),
+                'k = 0': predict(x_json, k=0),
+                'k > num_classes': predict(x_json, k=11),
+            }
+            codes = {}
+            for name, raw in bad.items():
+                codes[name] = await status(server, raw)
+            server.batcher.model = FailingModel()
+            codes['model error'] = await status(server, predict(x_json))
+            return answers, batch_sizes, codes
+        finally:
+            await server.stop()
+
+    answers, batch_sizes, codes = asyncio.run(run())
+    err = 0
+    same_classes = True
+    for i, client_answers in enumerate(answers):
+        for answer in client_answers:
+            same_classes &= answer['classes'] == classes[i].tolist()
+            err = max(err, rel_error(np.array(answer['probs']), probs[i]))
+    print('If the inference server is working, the top-3 classes should match and the probabilities')
+    print('differ by less than 1e-12:')
+    print('classes match: {}, probability difference: {}, batch sizes {}'.format(
+        same_classes, err, batch_sizes))
+    print('Bad requests should get 400 and a failing model 500:')
+    for name, code in codes.items():
+        print('{}: {}'.format(name, code))
+
+
+def export_runtime_test():
+    # Export trained-looking models, load them back into utils.runtime with
+    # and without memory-mapping and compare the scores with model.loss(X)
+    import mmap, os, tempfile
+    from nndl.export import export_model
+    from utils.runtime import Runtime
+
+    rng = np.random.RandomState(0)
+    X = rng.randn(6, 3, 8, 8)
+    fc = FullyConnectedNet([20, 15], input_dim=192, use_batchnorm=True, dropout=0.5,
+                           weight_scale=1e-1, dtype=np.float64, seed=0)
+    for i in range(1, 3):
+        fc.params['gamma%d' % i] = rng.rand(fc.params['gamma%d' % i].size) + 0.5
+        fc.params['beta%d' % i] = rng.randn(fc.params['beta%d' % i].size)
+    fc.loss(X, rng.randint(10, size=6))  # updates the running means and variances
+    models = [('FC with batchnorm', fc)]
+    for layout, global_pool in [('NCHW', False), ('NHWC', False), ('NCHW', True)]:
+        name = 'ThreeLayerConvNet {}{}'.format(layout, ' with global_pool' if global_pool else '')
+        models.append((name, ThreeLayerConvNet(input_dim=(3, 8, 8), num_filters=4, filter_size=3,
+                                               hidden_dim=10, weight_scale=1e-1, dtype=np.float64,
+                                               layout=layout, global_pool=global_pool)))
+
+    directory = tempfile.mkdtemp()
+    print('If the export and the runtime are working, differences should be less than 1e-12:')
+    for name, model in models:
+        filename = os.path.join(directory, 'model.json')
+        export_model(model, filename, (3, 8, 8))
+        scores = model.loss(X)
+        errors = []
+        for use_mmap in [False, True]:
+            runtime = Runtime(filename, mmap=use_mmap)
+            errors.append(rel_error(scores, runtime.loss(X)))
+        mapped = all(isinstance(v.base, mmap.mmap) for v in runtime.params.values())
+        del runtime
+        print('{}: loaded {}, memory-mapped {}, weights mapped {}'.format(name, errors[0], errors[1], mapped))
+    for f in os.listdir(directory):
+        os.remove(os.path.join(directory, f))
+    os.rmdir(directory)
+
+
+def optim_inplace_test(num_steps=5):
+    # Run every in-place rule next to its original on the same gradients,
+    # over several blocks of INPLACE_BLOCK elements, and compare parameters
+    # and state: exactly in float64 and to float32 rounding in float32, where
+    # adam computes in float64. Differences are relative to the largest
+    # element, since float32 rounding is relative to each array's scale.
+    from nndl import optim
+    rules = ['sgd_momentum', 'sgd_nesterov_momentum', 'rmsprop', 'adam']
+    shape = (3, optim.INPLACE_BLOCK + 1000)
+    diff = lambda x, y: np.max(np.abs(x - y)) / np.max(np.abs(x))
+    print('If the in-place rules are working, float64 differences should be 0 and float32')
+    print('differences less than 1e-6:')
+    for dtype in [np.float64, np.float32]:
+        for name in rules:
+            rng = np.random.RandomState(0)
+            w = rng.randn(*shape).astype(dtype)
+            w_inplace = w.copy()
+            config, config_inplace = {}, {}
+            for _ in range(num_steps):
+                dw = rng.randn(*shape).astype(dtype)
+                w, config = getattr(optim, name)(w, dw, config)
+                w_inplace, config_inplace = getattr(optim, name + '_inplace')(w_inplace, dw, config_inplace)
+            diffs = [diff(w, w_inplace)]
+            diffs += [diff(config[k], config_inplace[k]) for k in config
+                      if isinstance(config[k], np.ndarray)]
+            print('{} {}: {} (parameters kept their dtype: {})'.format(
+                np.dtype(dtype).name, name, max(diffs), w_inplace.dtype == dtype))
+
+
+def optim_compact_test(num_steps=100):
+    # adam_compact with float16 and 8-bit moments should follow the path of
+    # adam; Adafactor should keep O(rows + cols) state per weight matrix, also
+    # when a flat-params Solver packs the model into one vector, and take the
+    # same steps there as per parameter
+    from nndl import optim
+    rng = np.random.RandomState(0)
+    w0 = rng.randn(64, 100).astype(np.float32)
+    target = rng.randn(64, 100).astype(np.float32)
+    paths = {}
+    for name, config in [('adam', {}), ('float16', {'moment_dtype': 'float16'}),
+                         ('int8', {'moment_dtype': 'int8'})]:
+        rule = optim.adam if name == 'adam' else optim.adam_compact
+        config = dict(config, learning_rate=1e-2)
+        w = w0.copy()
+        noise = np.random.RandomState(1)
+        for _ in range(num_steps):
+            # Gradient of 0.5 * ||w - target||^2 plus minibatch-like noise
+            dw = (w - target + 0.5 * noise.randn(*w.shape)).astype(np.float32)
+            w, config = rule(w, dw, config)
+        paths[name] = w
+    moved = np.linalg.norm(paths['adam'] - w0)
+    print('If adam_compact is working, its distance from adam relative to the distance adam moved')
+    print('should be less than 1e-2 for float16 and 1e-1 for int8 moments:')
+    for name in ['float16', 'int8']:
+        print('{}: {}'.format(name, np.linalg.norm(paths[name] - paths['adam']) / moved))
+
+    def state_sizes(config):
+        return sum(v.size for v in config.values() if isinstance(v, np.ndarray))
+    print('If adafactor is working, its state should have rows + cols elements per matrix:')
+    for shape in [(300, 200), (16, 3, 5, 5), (50,)]:
+        config = {}
+        w = rng.randn(*shape)
+        for _ in range(2):
+            w, config = optim.adafactor(w, rng.randn(*shape), config)
+        expected = shape[0] + int(np.prod(shape[1:])) if len(shape) > 1 else shape[0]
+        print('{}: {} state elements, expected {}'.format(shape, state_sizes(config), expected))
+
+    data = {'X_train': rng.randn(50, 20), 'y_train': rng.randint(10, size=50),
+            'X_val': rng.randn(10, 20), 'y_val': rng.randint(10, size=10)}
+    solvers = []
+    for flat_params in [False, True]:
+        np.random.seed(0)
+        model = FullyConnectedNet([15], input_dim=20, dtype=np.float64)
+        solver = Solver(model, data, update_rule='adafactor', flat_params=flat_params,
+                        optim_config={'learning_rate': 1e-2, 'beta1': 0.9}, verbose=False)
+        for _ in range(5):
+            solver._step()
+        solvers.append(solver)
+    per_param, flat = solvers
+    flat_state = sum(state_sizes(c) for c in flat.optim_configs['flat']['segment_configs'])
+    param_state = sum(state_sizes(c) for c in per_param.optim_configs.values())
+    print('Flat params: parameter difference from per-parameter updates {} (should be 0),'.format(
+        max(rel_error(per_param.model.params[k], flat.model.params[k]) for k in flat.model.params)))
+    print('state elements {} vs {} per parameter'.format(flat_state, param_state))
+
+
+def optim_trust_ratio_test(num_steps=10):
+    # LARS is sgd_momentum with the learning rate scaled by the trust ratio on
+    # every step, and LAMB moves every parameter by learning_rate times its
+    # norm. A flat-params Solver must give every parameter its own trust
+    # ratio and so take the same steps as per-parameter updates.
+    from nndl import optim
+    rng = np.random.RandomState(0)
+    print('If lars and lamb are working, differences should be 0 and relative steps equal the learning rate:')
+    w = rng.randn(20, 30)
+    w_lars, w_sgd = w.copy(), w.copy()
+    config_lars = {'learning_rate': 0.1, 'trust_coefficient': 1e-2, 'weight_decay': 1e-3}
+    config_sgd = {'momentum': 0.9}
+    diff = 0
+    for _ in range(num_steps):
+        dw = rng.randn(20, 30)
+        g = dw + 1e-3 * w_sgd
+        trust = optim._trust_ratio(float(np.linalg.norm(w_sgd)), float(np.linalg.norm(g)), 1e-2)
+        config_sgd['learning_rate'] = 0.1 * trust
+        w_lars, config_lars = optim.lars(w_lars, dw, config_lars)
+        w_sgd, config_sgd = optim.sgd_momentum(w_sgd, g, config_sgd)
+        diff = max(diff, rel_error(w_lars, w_sgd))
+    print('lars vs sgd_momentum at learning_rate * trust ratio: {}'.format(diff))
+
+    # From zero weights the trust ratio is 1
+    dw = rng.randn(20, 30)
+    w_lars, _ = optim.lars(np.zeros((20, 30)), dw, {'learning_rate': 0.1})
+    w_sgd, _ = optim.sgd_momentum(np.zeros((20, 30)), dw, {'learning_rate': 0.1})
+    print('lars vs sgd_momentum with a trust ratio of 1: {}'.format(rel_error(w_lars, w_sgd)))
+
+    data = {'X_train': rng.randn(100, 20), 'y_train': rng.randint(10, size=100),
+            'X_val': rng.randn(10, 20), 'y_val': rng.randint(10, size=10)}
+    for rule, optim_config in [('lars', {'learning_rate': 1.0, 'trust_coefficient': 1e-2}),
+                               ('lamb', {'learning_rate': 1e-2})]:
+        solvers = []
+        for flat_params in [False, True]:
+            np.random.seed(0)
+            model = FullyConnectedNet([15], input_dim=20, weight_scale=1e-1, dtype=np.float64)
+            solver = Solver(model, data, update_rule=rule, flat_params=flat_params, batch_size=20,
+                            optim_config=dict(optim_config), verbose=False)
+            steps = []
+            for _ in range(50):
+                w = {k: v.copy() for k, v in model.params.items()}
+                solver._step()
+                steps.append({k: np.linalg.norm(model.params[k] - w[k]) / np.linalg.norm(w[k])
+                              for k in w if np.any(w[k])})
+            solvers.append((solver, steps))
+        (per_param, steps), (flat, _) = solvers
+        param_diff = max(rel_error(per_param.model.params[k], flat.model.params[k])
+                         for k in flat.model.params)
+        line = '{}: flat vs per-parameter {}, loss {:.3f} -> {:.3f}'.format(
+            rule, param_diff, np.mean(per_param.loss_history[:5]), np.mean(per_param.loss_history[-5:]))
+        if rule == 'lamb':
+            line += ', relative steps {:.6f} to {:.6f}'.format(
+                min(min(s.values()) for s in steps), max(max(s.values()) for s in steps))
+        print(line)
@@ -1,3 +1,5 @@
+import scipy.sparse as sp
+
 from .layers import *
 
 def affine_relu_forward(x, w, b):
@@ -18,13 +20,14 @@ def affine_relu_forward(x, w, b):
   return out, cache
 
 
-def affine_relu_backward(dout, cache):
+def affine_relu_backward(dout, cache, requires_grad=(True, True, True)):
   """
-  Backward pass for the affine-relu convenience layer
+  Backward pass for the affine-relu convenience layer. requires_grad is
+  passed on to affine_backward.
   """
   fc_cache, relu_cache = cache
   da = relu_backward(dout, relu_cache)
-  dx, dw, db = affine_backward(da, fc_cache)
+  dx, dw, db = affine_backward(da, fc_cache, requires_grad)
   return dx, dw, db
 
 
@@ -36,10 +39,66 @@ def affine_batchnorm_relu_forward(x, w, b, gamma, beta, bn_param):
   cache = (aff_cache, relu_cache, batch_cache)
   return out, cache
 
-def affine_batchnorm_relu_backward(dout, cache):
+def affine_batchnorm_relu_backward(dout, cache, requires_grad=(True, True, True)):
     
   aff_cache, relu_cache, batch_cache = cache
   dbatch = relu_backward(dout, relu_cache)
   daffine, dgamma, dbeta = batchnorm_backward(dbatch, batch_cache)
-  dx, dw, db = affine_backward(daffine, aff_cache)
-  return dx, dw, db, dgamma, dbeta
\ No newline at end of file
+  dx, dw, db = affine_backward(daffine, aff_cache, requires_grad)
+  return dx, dw, db, dgamma, dbeta
+
+def affine_inference(x, w, b):
+  """
+  Forward-only affine layer for test time. No cache is kept.
+
+  w is either a dense (D, M) array or a scipy.sparse matrix of the same
+  shape (see nndl/pruning.py). For a sparse w the output is computed as the
+  sparse-dense product w^T x^T, which is a CSR product when w is CSC.
+
+  Returns:
+  - out: Output, of shape (N, M)
+  """
+  x1 = x.reshape(x.shape[0], -1)
+  if sp.issparse(w):
+    out = np.asarray(w.T.dot(x1.T)).T
+  else:
+    out = x1.dot(w)
+  out += b
+  return out
+
+
+def affine_relu_inference(x, w, b):
+  """
+  Forward-only affine - relu for test time. No cache is kept, and the ReLU
+  is applied in place on the affine output. w may be sparse, as in
+  affine_inference.
+
+  Returns:
+  - out: Output from the ReLU
+  """
+  out = affine_inference(x, w, b)
+  np.maximum(out, 0, out=out)
+  return out
+
+
+def affine_batchnorm_relu_inference(x, w, b, gamma, beta, bn_param):
+  """
+  Forward-only affine - batchnorm - relu for test time. The running mean and
+  variance in bn_param are folded into a single per-feature scale and shift
+  that are applied in place, and no cache is kept. w may be sparse, as in
+  affine_inference.
+
+  Returns:
+  - out: Output from the ReLU
+  """
+  eps = bn_param.get('eps', 1e-5)
+  running_mean = bn_param.get('running_mean', 0)
+  running_var = bn_param.get('running_var', 0)
+  scale = gamma / np.sqrt(running_var + eps)
+  shift = beta - running_mean * scale
+
+  out = affine_inference(x, w, b)
+  out *= scale
+  out += shift
+  np.maximum(out, 0, out=out)
+  return out
@@ -29,6 +29,11 @@ def affine_forward(x, w, b):
   x1 = x.reshape(x.shape[0], -1)
   
   out =np.dot(x1,w) + b
+
+  # Mixed precision: float16 activations stay float16 even though the
+  # weights, and therefore the matrix multiply, are float32.
+  if x.dtype == np.float16:
+    out = out.astype(np.float16)
   
 
 
@@ -40,7 +45,7 @@ def affine_forward(x, w, b):
   return out, cache
 
 
-def affine_backward(dout, cache):
+def affine_backward(dout, cache, requires_grad=(True, True, True)):
   """
   Computes the backward pass for an affine layer.
 
@@ -50,6 +55,9 @@ def affine_backward(dout, cache):
     - x: A numpy array containing input data, of shape (N, d_1, ..., d_k)
     - w: A numpy array of weights, of shape (D, M)
     - b: A numpy array of biases, of shape (M,)
+  - requires_grad: Tuple of three booleans saying which of dx, dw and db
+    are needed; gradients that are not needed are not computed and are
+    returned as None.
 
   Returns a tuple of:
   - dx: Gradient with respect to x, of shape (N, d1, ..., d_k)
@@ -68,11 +76,21 @@ def affine_backward(dout, cache):
   #   dw should be D x M; it relates to dout through multiplication with x, which is N x D after reshaping
   #   db should be M; it is just the sum over dout examples
   # ================================================================ #
-  x1 = x.reshape(x.shape[0], -1) 
-  dw = np.dot(x1.T,dout)
-  dx = np.dot(dout,w.T)
-  dx = dx.reshape(x.shape)
-  db = np.sum(dout,axis=0)
+  # numpy has no BLAS path for float16, so keep the matrix multiplies
+  # in float32 and only store dx in the (float16) dtype of x.
+  if dout.dtype == np.float16:
+    dout = dout.astype(np.float32)
+  need_dx, need_dw, need_db = requires_grad
+  if need_dw:
+    x1 = x.reshape(x.shape[0], -1) 
+    dw = np.dot(x1.T,dout)
+  if need_dx:
+    dx = np.dot(dout,w.T)
+    dx = dx.reshape(x.shape)
+    if x.dtype == np.float16:
+      dx = dx.astype(np.float16)
+  if need_db:
+    db = np.sum(dout,axis=0)
   
 
   # ================================================================ #
@@ -451,6 +469,9 @@ def softmax_loss(x, y):
   - loss: Scalar giving the loss
   - dx: Gradient of the loss with respect to x
   """
+  # float16 scores are too coarse for the log-probabilities
+  if x.dtype == np.float16:
+    x = x.astype(np.float32)
 
   probs = np.exp(x - np.max(x, axis=1, keepdims=True))
   probs /= np.sum(probs, axis=1, keepdims=True)
@@ -0,0 +1,471 @@
+import copy
+import tracemalloc
+
+import numpy as np
+
+from nndl import optim
+from nndl.cnn import ThreeLayerConvNet
+from nndl.fc_net import FullyConnectedNet, TwoLayerNet
+from utils.fast_layers import conv_method
+from utils.solver import Solver
+
+
+# An update rule call allocates a few parameter-sized temporaries (e.g. the
+# scaled gradient and, for Adam, the squared gradient and its square root)
+# on top of its persistent state. This many are assumed when they cannot be
+# measured because tracemalloc is already running.
+UPDATE_TEMPORARIES = 3
+
+
+class MemoryPlanner(object):
+  """
+  Predicts the peak memory of a training step and of a test-time forward
+  pass as a function of the batch size, and picks the largest batch size
+  that fits a byte budget.
+
+  The model is described as a list of stages, one per layer, each a
+  sequence of steps that keep bytes alive (outputs and caches in the forward
+  pass, gradients in the backward pass), release them, or hold temporaries
+  while they run (e.g. the full-resolution conv output before pooling). A
+  training step is predicted by sweeping the steps forward and then
+  backward on top of the parameters, optimizer state, ConvWorkspace buffers
+  and the minibatch, which are held throughout.
+
+  Sizes follow the dtypes numpy actually produces. An update may promote
+  the parameters (Adam's bias correction turns float32 weights into
+  float64, as do the float64 gradients behind a dropout mask), which widens
+  the activations and gradients of every later step; the planner iterates
+  dry runs of the update rule until the dtypes settle and predicts that
+  steady state.
+
+  Example usage:
+
+  planner = MemoryPlanner(model, (3, 32, 32), update_rule='adam',
+                          optim_config={'learning_rate': 1e-3})
+  N = planner.max_batch_size(2 * 2 ** 30)
+  planner.validate(data, [25, 50, 100])
+
+  Supported models are ThreeLayerConvNet (NCHW, with the strided conv and
+  no conv_autotuner), TwoLayerNet and FullyConnectedNet, without mixed
+  precision.
+  """
+
+  def __init__(self, model, input_dim, update_rule='sgd', optim_config=None,
+               data_dtype=np.float32):
+    """
+    Inputs:
+    - model: A model object.
+    - input_dim: Shape of a single example, e.g. (3, 32, 32).
+    - update_rule: Name of an update rule in nndl/optim.py, or the function
+      itself, as passed to Solver.
+    - optim_config: Dictionary of hyperparameters of the update rule, as
+      passed to Solver. Options such as adam_compact's moment_dtype change
+      the size of the optimizer state.
+    - data_dtype: dtype of the training data.
+    """
+    if getattr(model, 'mixed_precision', False):
+      raise ValueError('Mixed precision models are not supported')
+    self.model = model
+    self.input_dim = tuple(input_dim)
+    self.update_rule = update_rule
+    self.optim_config = dict(optim_config or {})
+    self.data_dtype = np.dtype(data_dtype)
+    if isinstance(model, ThreeLayerConvNet):
+      self._check_conv()
+
+    self.dtypes = {k: w.dtype for k, w in model.params.items()}
+    self.max_param_bytes = max(w.nbytes for w in model.params.values())
+    # As in Solver, the optimizer state is created once, in the dtypes of the
+    # first step, and carried through every later one
+    configs = {k: dict(self.optim_config) for k in model.params}
+    for _ in range(4):
+      dtypes = self._dry_run(configs)
+      if dtypes == self.dtypes:
+        break
+      self.dtypes = dtypes
+
+
+  def _check_conv(self):
+    """
+    The conv stage below models conv_forward_strides; other methods keep
+    different caches. A ConvAutotuner picks the method per batch size, and
+    asking it would tune and cache every size the search visits, so tuned
+    models are refused. Without one the method does not depend on N.
+    """
+    model = self.model
+    if getattr(model, 'layout', 'NCHW') != 'NCHW':
+      raise ValueError('Only NCHW ThreeLayerConvNets are supported')
+    if model.conv_autotuner is not None:
+      raise ValueError('ThreeLayerConvNets with a conv_autotuner are not supported')
+    W1 = model.params['W1']
+    conv_param = {'stride': 1, 'pad': (W1.shape[2] - 1) // 2}
+    x = np.empty((1,) + self.input_dim, dtype=self.data_dtype)
+    method = conv_method(x, W1, conv_param)
+    if method != 'strides':
+      raise ValueError('Conv method "%s" is not supported' % method)
+
+
+  def _dry_run(self, configs):
+    """
+    Runs the update rule twice on zeros of every parameter's shape and
+    current dtype, with gradients of the dtype the backward pass produces,
+    continuing from the optimizer state in configs, which is updated in
+    place. Records the bytes of the parameters, their gradients, the
+    optimizer state and one update of the largest parameter, and returns
+    the dtypes of the updated parameters.
+    """
+    update_rule = self.update_rule
+    if isinstance(update_rule, str):
+      update_rule = getattr(optim, update_rule)
+    grad_sizes = self._walk(1)[3]
+
+    dtypes = {}
+    largest = None
+    self.param_bytes = self.state_bytes = self.max_param_bytes = 0
+    self.grad_bytes = 0
+    for k, w in self.model.params.items():
+      w = np.zeros(w.shape, dtype=self.dtypes[k])
+      dw = np.zeros(w.shape, dtype='f%d' % grad_sizes[k])
+      self.grad_bytes += dw.nbytes
+      w, config = update_rule(w, dw, configs[k])
+      w, config = update_rule(w, dw, config)
+      configs[k] = config
+      dtypes[k] = w.dtype
+      self.param_bytes += w.nbytes
+      self.state_bytes += sum(v.nbytes for v in config.values()
+                              if isinstance(v, np.ndarray))
+      if w.nbytes > self.max_param_bytes:
+        self.max_param_bytes = w.nbytes
+        largest = (w, dw, config)
+
+    # Bytes allocated by one update of the largest parameter on top of its
+    # parameter, gradient and state. The state is copied under tracing so
+    # that arrays the update replaces are seen to be freed.
+    self.update_bytes = UPDATE_TEMPORARIES * self.max_param_bytes
+    if largest is not None and not tracemalloc.is_tracing():
+      w, dw, config = largest
+      tracemalloc.start()
+      config = {k: v.copy() if isinstance(v, np.ndarray) else v
+                for k, v in config.items()}
+      w = w.copy()
+      start = tracemalloc.get_traced_memory()[0]
+      update_rule(w, dw, config)
+      self.update_bytes = tracemalloc.get_traced_memory()[1] - start
+      tracemalloc.stop()
+    return dtypes
+
+
+  def _affine_stages(self, N, layers, act, from_input):
+    """
+    Stages of a stack of affine layers followed by the softmax loss.
+
+    Inputs:
+    - N: Batch size.
+    - layers: List of (k, D_in, D_out, relu, batchnorm, dropout) tuples,
+      where k is the layer's number in the parameter names.
+    - act: Itemsize of the input activations.
+    - from_input: Whether the first layer reads the model input, which is
+      counted with the minibatch and needs no gradient.
+
+    Returns a tuple of:
+    - stages: As for stages().
+    - grad_sizes: Dictionary mapping parameter names to gradient itemsizes.
+    """
+    stages, acts = [], []
+    inf_act = act
+    for i, (k, D_in, D, relu, bn, dropout) in enumerate(layers):
+      w = self.dtypes['W%d' % k].itemsize
+      o = max(act, w)
+      ND = N * D * o
+      # np.dot, with a cast copy of the input if the weights are wider, then
+      # the bias add into a new array
+      cast = N * D_in * w if act < w else 0
+      fwd = [(0, cast + ND), (ND, ND)]
+      if bn:
+        # The variance pass and the centered input are temporaries; x_norm
+        # and the scaled output are cached
+        fwd += [(0, 2 * ND), (ND, ND), (ND, ND)]
+      if relu:
+        fwd.append((ND, 0))
+      if dropout:
+        # A float64 mask; the product is cast back to the input dtype, and
+        # the ReLU output is released once the dropout output replaces it
+        fwd += [(0, N * D * 9), (N * D * 8, N * D), (ND, N * D * 8), (-ND, 0)]
+
+      # At test time the ReLU runs in place and dropout is skipped
+      inf_out = max(inf_act, w)
+      inf_cast = N * D_in * w if inf_act < w else 0
+      inf = inf_cast + N * D * inf_out
+      if i > 0 or not from_input:
+        inf += N * D_in * inf_act
+      stages.append({'name': 'affine %d' % k, 'fwd': fwd, 'inf': inf})
+      acts.append(act)
+      act, inf_act = o, inf_out
+
+    # Softmax loss: the score gradient, with the probabilities and an L2
+    # regularization temporary of the largest weight
+    NC = N * layers[-1][2] * act
+    softmax = {
+      'name': 'softmax',
+      'fwd': [(NC, 2 * NC + self.max_param_bytes)],
+      'bwd': [(0, self.max_param_bytes)], 'inf': 0,
+    }
+
+    grad_sizes = {}
+    g = act
+    for i in reversed(range(len(layers))):
+      k, D_in, D, relu, bn, dropout = layers[i]
+      w = self.dtypes['W%d' % k].itemsize
+      # Bytes released when the layer returns: its internal gradients and,
+      # with dropout, the upstream gradient that the masked one replaced in
+      # loss()'s list, which a local holds until then
+      bwd = []
+      released = 0
+      if dropout:
+        # The float64 mask makes the upstream gradient float64
+        released = N * D * g
+        g = max(g, 8)
+        bwd.append((N * D * g, 0))
+      NDg = N * D * g
+      if relu:
+        bwd.append((NDg, N * D))
+        released += NDg
+      if bn:
+        bwd.append((NDg, 3 * NDg))
+        released += NDg
+
+      a_in = acts[i]
+      gw = max(a_in, g)
+      cast = N * D_in * g if a_in < g else 0
+      dx = N * D_in * max(g, w) if (i > 0 or not from_input) else 0
+      bwd += [((D_in * D + D) * gw, cast), (dx, 0), (-released, 0)]
+      names = ['W%d' % k, 'b%d' % k]
+      if bn:
+        bwd.append((2 * D * gw, 0))
+        names += ['gamma%d' % k, 'beta%d' % k]
+      for name in names:
+        grad_sizes[name] = gw
+      stages[i]['bwd'] = bwd
+      g = max(g, w)
+
+    return stages + [softmax], grad_sizes
+
+
+  def _conv_stages(self, N):
+    """
+    Stages of ThreeLayerConvNet. Returns the stages, the gradient itemsizes
+    and the bytes of its ConvWorkspace.
+    """
+    model = self.model
+    p = model.params
+    ai = np.result_type(self.dtypes['W1'], self.data_dtype).itemsize
+    xi = self.data_dtype.itemsize
+    C, H, W = self.input_dim
+    F, _, HH, WW = p['W1'].shape
+    pad = (HH - 1) // 2
+    K = C * HH * WW
+    M = N * H * W
+    A = N * F * H * W * ai
+    P = N * F * (H // 2) * (W // 2)
+    x_padded = N * C * (H + 2 * pad) * (W + 2 * pad) * xi
+
+    # The padded input, the columns, the GEMM output and the reordered
+    # output gradient live in the workspace. If the weights are wider than
+    # the data, np.dot casts the columns to the weight dtype.
+    workspace = x_padded + K * M * xi + 2 * F * M * ai
+    cast = K * M * ai if ai != xi else 0
+
+    # Buffers are keyed by dtype, so if the first update promotes the
+    # weights, those of the first step are kept alongside
+    ai0 = np.result_type(p['W1'], self.data_dtype).itemsize
+    if ai0 != ai:
+      workspace += 2 * F * M * ai0
+
+    # Forward: conv output, pooled output and uint8 argmax, release of the
+    # conv output, ReLU mask. Backward: masked and unpooled gradients, then
+    # the weight gradient.
+    stages = [{
+      'name': 'conv-relu-pool',
+      'fwd': [(0, cast), (A, 0), (P * (ai + 1), 0), (-A, 0), (P, 0)],
+      'bwd': [(P * ai, 0), (A, 0), ((F * K + F) * ai, cast), (-P * ai - A, 0)],
+      'inf': max(x_padded + K * M * xi, K * M * xi + cast + F * M * ai,
+                 F * M * ai + A, A * 3 // 2 + P * ai),
+    }]
+    D_in = P // N
+    if getattr(model, 'global_pool', False):
+      stages.append({
+        'name': 'global pool', 'fwd': [(N * F * ai, 0)],
+        'bwd': [(P * ai, 0)], 'inf': P * ai + N * F * ai,
+      })
+      D_in = F
+    hidden, num_classes = p['W3'].shape
+    layers = [(2, D_in, hidden, True, False, False),
+              (3, hidden, num_classes, False, False, False)]
+    affine, grad_sizes = self._affine_stages(N, layers, ai, False)
+    grad_sizes['W1'] = grad_sizes['b1'] = ai
+    return stages + affine, grad_sizes, workspace
+
+
+  def _walk(self, N):
+    """
+    Returns the stages, input bytes and workspace bytes as for stages(),
+    plus the gradient itemsize of every parameter.
+    """
+    model = self.model
+    D0 = int(np.prod(self.input_dim))
+    input_bytes = N * D0 * self.data_dtype.itemsize
+
+    if isinstance(model, ThreeLayerConvNet):
+      stages, grad_sizes, workspace = self._conv_stages(N)
+      return stages, input_bytes, workspace, grad_sizes
+
+    if isinstance(model, TwoLayerNet):
+      p = model.params
+      layers = [(1, D0, p['W1'].shape[1], True, False, False),
+                (2, p['W2'].shape[0], p['W2'].shape[1], False, False, False)]
+      act = self.data_dtype.itemsize
+      stages, grad_sizes = self._affine_stages(N, layers, act, True)
+      return stages, input_bytes, 0, grad_sizes
+
+    if isinstance(model, FullyConnectedNet):
+      layers = []
+      for k in range(1, model.num_layers + 1):
+        D_in, D = model.params['W%d' % k].shape
+        hidden = k < model.num_layers
+        layers.append((k, D_in, D, hidden, hidden and model.use_batchnorm,
+                       hidden and model.use_dropout))
+      # loss() casts X to the model dtype, which always copies
+      act = np.dtype(model.dtype).itemsize
+      input_bytes += N * D0 * act
+      stages, grad_sizes = self._affine_stages(N, layers, act, True)
+      return stages, input_bytes, 0, grad_sizes
+
+    raise ValueError('Unsupported model type "%s"' % type(model).__name__)
+
+
+  def stages(self, N):
+    """
+    Returns a tuple of:
+    - stages: List of per-layer dictionaries with keys:
+      - name
+      - fwd, bwd: Lists of (keep, tmp) steps of the training forward and
+        backward pass, where keep is the change in bytes held after the step
+        (negative for releases) and tmp the bytes held only during it
+      - inf: Bytes held at the layer's test-time peak
+    - input_bytes: Bytes of the minibatch as the model holds it
+    - workspace: Bytes of persistent conv scratch buffers
+    """
+    return self._walk(N)[:3]
+
+
+  def training_bytes(self, N):
+    """
+    Predicted peak bytes of one Solver step with batch size N.
+    """
+    stages, input_bytes, workspace = self.stages(N)
+    # The minibatch labels are int64
+    base = self.param_bytes + self.state_bytes + workspace + input_bytes + N * 8
+    running = peak = base
+    steps = [st for s in stages for st in s['fwd']]
+    steps += [st for s in reversed(stages) for st in s['bwd']]
+    for keep, tmp in steps:
+      peak = max(peak, running + max(keep, 0) + tmp)
+      running += keep
+
+    # Once loss() returns only the gradients survive for the update
+    update = base + self.grad_bytes + self.update_bytes
+    return max(peak, update)
+
+
+  def inference_bytes(self, N):
+    """
+    Predicted peak bytes of a test-time forward pass over N examples.
+    """
+    stages, input_bytes, _ = self.stages(N)
+    return self.param_bytes + input_bytes + max(s['inf'] for s in stages)
+
+
+  def max_batch_size(self, budget, mode='train', max_size=2 ** 20):
+    """
+    Largest batch size whose predicted peak fits in budget bytes.
+
+    Inputs:
+    - budget: Number of bytes available.
+    - mode: 'train' or 'test'.
+    - max_size: Upper bound of the search.
+
+    Returns:
+    - N: The batch size, or 0 if not even a single example fits.
+    """
+    predict = self.training_bytes if mode == 'train' else self.inference_bytes
+    lo, hi = 0, max_size
+    while lo < hi:
+      mid = (lo + hi + 1) // 2
+      if predict(mid) <= budget:
+        lo = mid
+      else:
+        hi = mid - 1
+    return lo
+
+
+  def report(self, batch_sizes):
+    """
+    Prints the predicted training and test-time peaks per batch size and
+    the fixed cost of the parameters and optimizer state.
+    """
+    print('params %.2f MB, optimizer state %.2f MB' % (
+          self.param_bytes / 2.0 ** 20, self.state_bytes / 2.0 ** 20))
+    print('%8s %12s %12s' % ('batch', 'train MB', 'test MB'))
+    for N in batch_sizes:
+      print('%8d %12.2f %12.2f' % (N, self.training_bytes(N) / 2.0 ** 20,
+                                   self.inference_bytes(N) / 2.0 ** 20))
+
+
+  def validate(self, data, batch_sizes, num_steps=3, **solver_kwargs):
+    """
+    Compares the predictions against tracemalloc peaks. Training is measured
+    over num_steps Solver steps on a deep copy of the model, so the copy's
+    parameters, optimizer state and workspace buffers are traced too. The
+    test-time pass then runs the trained copy on the first N validation
+    examples.
+
+    Inputs:
+    - data: Dictionary of data as passed to Solver.
+    - batch_sizes: Batch sizes to measure.
+    - num_steps: Number of training steps to trace per batch size.
+    - solver_kwargs: Passed on to Solver, e.g. lr_decay. The update rule
+      and optim_config are those the planner was created with.
+
+    Returns:
+    - results: List of (N, predicted_train, measured_train, predicted_test,
+      measured_test) tuples, in bytes.
+    """
+    results = []
+    print('%8s %12s %12s %12s %12s' % ('batch', 'train pred', 'train meas',
+                                       'test pred', 'test meas'))
+    for N in batch_sizes:
+      tracemalloc.start()
+      model = copy.deepcopy(self.model)
+      solver = Solver(model, data, batch_size=N, update_rule=self.update_rule,
+                      optim_config=dict(self.optim_config), verbose=False,
+                      **solver_kwargs)
+      for _ in range(num_steps):
+        solver._step()
+      train = tracemalloc.get_traced_memory()[1]
+      tracemalloc.stop()
+
+      # The test-time pass runs on the trained copy, whose parameters were
+      # allocated before tracing restarts
+      X = data['X_val'][:N].copy()
+      tracemalloc.start()
+      model.loss(X)
+      test = tracemalloc.get_traced_memory()[1] + X.nbytes
+      test += sum(w.nbytes for w in model.params.values())
+      tracemalloc.stop()
+      del model, solver, X
+
+      row = (N, self.training_bytes(N), train, self.inference_bytes(N), test)
+      results.append(row)
+      print('%8d %12.2f %12.2f %12.2f %12.2f' % ((N,) + tuple(
+            b / 2.0 ** 20 for b in row[1:])))
+    return results
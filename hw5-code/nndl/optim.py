@@ -204,3 +204,504 @@ def adam(w, dw, config=None):
   
   
 
+
+
+"""
+In-place variants of the update rules above. They compute the same
+expressions in the same order, so their results match the originals, but
+they update w and the optimizer state with out= ufuncs instead of
+allocating new arrays. The few temporaries each expression needs are kept
+in a small per-parameter scratch buffer, config['scratch'], and the update
+runs over blocks of INPLACE_BLOCK elements so that all the passes over a
+block hit the cache.
+
+w must be C-contiguous to be updated in place; otherwise a contiguous copy
+is updated and returned.
+"""
+
+# Elements per block of an in-place update. In float64, a block of every
+# array adam touches plus its two scratch rows take 768 KB, which stays in
+# L2 on current cores; smaller blocks pay more for Python overhead than they
+# gain in locality.
+INPLACE_BLOCK = 16384
+
+
+def _blocks(config, num_scratch, *arrays):
+  """
+  Yields matching flat blocks of the given arrays, each followed by
+  num_scratch scratch rows of the same length from config['scratch'],
+  which is created with the dtype of the first array on the first call.
+  """
+  n = arrays[0].size
+  scratch = config.get('scratch')
+  if (scratch is None or scratch.shape[0] < num_scratch
+      or scratch.dtype != arrays[0].dtype):
+    scratch = np.empty((num_scratch, min(n, INPLACE_BLOCK)), dtype=arrays[0].dtype)
+    config['scratch'] = scratch
+  flat = [a.reshape(-1) for a in arrays]
+  for i in range(0, n, INPLACE_BLOCK):
+    j = min(i + INPLACE_BLOCK, n)
+    yield [a[i:j] for a in flat] + [s[:j - i] for s in scratch[:num_scratch]]
+
+
+def sgd_momentum_inplace(w, dw, config=None):
+  """
+  sgd_momentum, updating w and config['velocity'] in place.
+  """
+  if config is None: config = {}
+  config.setdefault('learning_rate', 1e-2)
+  config.setdefault('momentum', 0.9)
+  w = np.ascontiguousarray(w)
+  if 'velocity' not in config:
+    config['velocity'] = np.zeros_like(w)
+  v = config['velocity']
+  mu, lr = config['momentum'], config['learning_rate']
+
+  for wb, dwb, vb, s in _blocks(config, 1, w, dw, v):
+    vb *= mu
+    np.multiply(dwb, lr, out=s)
+    vb -= s
+    wb += vb
+  return w, config
+
+
+def sgd_nesterov_momentum_inplace(w, dw, config=None):
+  """
+  sgd_nesterov_momentum, updating w and config['velocity'] in place.
+  """
+  if config is None: config = {}
+  config.setdefault('learning_rate', 1e-2)
+  config.setdefault('momentum', 0.9)
+  w = np.ascontiguousarray(w)
+  if 'velocity' not in config:
+    config['velocity'] = np.zeros_like(w)
+  v = config['velocity']
+  mu, lr = config['momentum'], config['learning_rate']
+
+  for wb, dwb, vb, s, v_old in _blocks(config, 2, w, dw, v):
+    v_old[...] = vb
+    vb *= mu
+    np.multiply(dwb, lr, out=s)
+    vb -= s
+    wb += vb
+    np.subtract(vb, v_old, out=s)
+    s *= mu
+    wb += s
+  return w, config
+
+
+def rmsprop_inplace(w, dw, config=None):
+  """
+  rmsprop, updating w and config['a'] in place.
+  """
+  if config is None: config = {}
+  config.setdefault('learning_rate', 1e-2)
+  config.setdefault('decay_rate', 0.99)
+  config.setdefault('epsilon', 1e-8)
+  w = np.ascontiguousarray(w)
+  if 'a' not in config:
+    config['a'] = np.zeros_like(w)
+  a = config['a']
+  decay, lr, eps = config['decay_rate'], config['learning_rate'], config['epsilon']
+
+  for wb, dwb, ab, s in _blocks(config, 1, w, dw, a):
+    np.multiply(dwb, 1 - decay, out=s)
+    s *= dwb
+    ab *= decay
+    ab += s
+    np.sqrt(ab, out=s)
+    s += eps
+    np.divide(lr, s, out=s)
+    s *= dwb
+    wb -= s
+  return w, config
+
+
+def adam_inplace(w, dw, config=None):
+  """
+  adam, updating w, config['v'] and config['a'] in place.
+
+  The bias corrections are computed once per step as Python floats. adam
+  multiplies by numpy float64 scalars instead, which promotes float32
+  parameters to float64; here they stay in their own dtype, so the two
+  rules match exactly for float64 parameters and to float32 rounding
+  otherwise.
+  """
+  if config is None: config = {}
+  config.setdefault('learning_rate', 1e-3)
+  config.setdefault('beta1', 0.9)
+  config.setdefault('beta2', 0.999)
+  config.setdefault('epsilon', 1e-8)
+  config.setdefault('t', 0)
+  w = np.ascontiguousarray(w)
+  if 'v' not in config:
+    config['v'] = np.zeros_like(w)
+    config['a'] = np.zeros_like(w)
+  v, a = config['v'], config['a']
+  beta1, beta2 = config['beta1'], config['beta2']
+  lr, eps = config['learning_rate'], config['epsilon']
+
+  config['t'] += 1
+  correct_v = float(1 / (1 - np.power(beta1, config['t'])))
+  correct_a = float(1 / (1 - np.power(beta2, config['t'])))
+
+  for wb, dwb, vb, ab, s, corrected_v in _blocks(config, 2, w, dw, v, a):
+    vb *= beta1
+    np.multiply(dwb, 1 - beta1, out=s)
+    vb += s
+    np.multiply(dwb, 1 - beta2, out=s)
+    s *= dwb
+    ab *= beta2
+    ab += s
+    np.multiply(ab, correct_a, out=s)
+    np.sqrt(s, out=s)
+    s += eps
+    np.divide(lr, s, out=s)
+    np.multiply(vb, correct_v, out=corrected_v)
+    s *= corrected_v
+    wb -= s
+  return w, config
+
+
+def _segmented(rule, w, dw, config):
+  """
+  Applies rule separately to every parameter packed into the flat vector w.
+  Solver(flat_params=True) passes the layout as config['segments'], a list
+  of (slice, shape) pairs (see FlatParams.segments). Each segment keeps its
+  own state in config['segment_configs'] and takes the current
+  hyperparameters, e.g. a decayed learning rate, from config on every step,
+  so the result is the same as updating each parameter on its own.
+  """
+  segments = config['segments']
+  if 'segment_configs' not in config:
+    config['segment_configs'] = [{} for _ in segments]
+  shared = {k: v for k, v in config.items()
+            if k not in ('segments', 'segment_configs')}
+  next_w = np.empty_like(w)
+  for (s, shape), segment_config in zip(segments, config['segment_configs']):
+    segment_config.update(shared)
+    next_segment, _ = rule(w[s].reshape(shape), dw[s].reshape(shape),
+                           segment_config)
+    next_w[s] = next_segment.reshape(-1)
+  return next_w, config
+
+
+def adafactor(w, dw, config=None):
+  """
+  Adafactor: an adaptive rule whose second-moment estimate for a weight
+  matrix is factored into running averages of the row and column means of
+  the squared gradient, so it keeps O(rows + cols) state instead of
+  O(rows * cols). Parameters with more than two dimensions are treated as
+  matrices with w.shape[0] rows; vectors keep a full second moment. With
+  config['segments'] from a flat-params Solver, each parameter is factored
+  on its own (see _segmented).
+
+  The update g / sqrt(v) is scaled down whenever its RMS exceeds
+  clip_threshold. Without a first moment (beta1 = 0, the default) no state
+  of the size of w is kept at all.
+
+  config format:
+  - learning_rate: Scalar learning rate.
+  - beta1: Decay rate for an optional moving average of the update.
+  - beta2: Decay rate for the moving averages of the squared gradient.
+  - epsilon: Small scalar added to the squared gradient.
+  - clip_threshold: Largest RMS of an update before it is scaled down.
+  - v_row, v_col: Row and column moving averages, for matrices.
+  - v: Moving average of the squared gradient, for vectors.
+  - m: Moving average of the update, if beta1 > 0.
+  - t: Iteration number.
+  """
+  if config is not None and 'segments' in config:
+    return _segmented(adafactor, w, dw, config)
+  if config is None: config = {}
+  config.setdefault('learning_rate', 1e-3)
+  config.setdefault('beta1', 0.0)
+  config.setdefault('beta2', 0.999)
+  config.setdefault('epsilon', 1e-30)
+  config.setdefault('clip_threshold', 1.0)
+  config.setdefault('t', 0)
+  beta1, beta2 = config['beta1'], config['beta2']
+  config['t'] += 1
+
+  g2 = dw * dw
+  g2 += config['epsilon']
+  if w.ndim >= 2:
+    g2 = g2.reshape(w.shape[0], -1)
+    if 'v_row' not in config:
+      config['v_row'] = np.zeros(g2.shape[0], dtype=w.dtype)
+      config['v_col'] = np.zeros(g2.shape[1], dtype=w.dtype)
+    v_row, v_col = config['v_row'], config['v_col']
+    v_row *= beta2
+    v_row += (1 - beta2) * g2.mean(axis=1)
+    v_col *= beta2
+    v_col += (1 - beta2) * g2.mean(axis=0)
+    # The rank-1 estimate v_row v_col^T / mean(v_row) has row means v_row
+    # and column means v_col
+    v = np.outer(v_row / v_row.mean(), v_col).reshape(w.shape)
+  else:
+    if 'v' not in config:
+      config['v'] = np.zeros_like(w)
+    v = config['v']
+    v *= beta2
+    v += (1 - beta2) * g2
+    v = v.copy()
+
+  v /= 1 - beta2 ** config['t']
+  u = dw / np.sqrt(v, out=v)
+  u /= max(1.0, np.sqrt(np.mean(u * u)) / config['clip_threshold'])
+  if beta1 > 0:
+    if 'm' not in config:
+      config['m'] = np.zeros_like(w)
+    config['m'] = beta1 * config['m'] + (1 - beta1) * u
+    u = config['m']
+
+  next_w = w - config['learning_rate'] * u
+  return next_w, config
+
+
+def _float8_map(exp_bits, man_bits):
+  """
+  Sorted nonnegative values of an 8-bit floating-point code with the given
+  numbers of exponent and mantissa bits, scaled so that the largest is 1.
+  Unlike a linear int8 grid the code spans several orders of magnitude,
+  which moments of very different sizes within one block need.
+  """
+  e = np.arange(2 ** exp_bits).reshape(-1, 1)
+  m = np.arange(2 ** man_bits) / 2.0 ** man_bits
+  values = np.where(e == 0, 2 * m, (1 + m) * 2.0 ** e).ravel()
+  values = np.unique(values / values.max())
+  return values.astype(np.float32)
+
+
+def _code_table(qmap):
+  """
+  Maps the top 16 bits of every float32 (sign, exponent and 7 mantissa
+  bits) to the index of the nearest entry of qmap, so that encoding is a
+  shift and a table lookup instead of a search.
+  """
+  values = (np.arange(2 ** 16, dtype=np.uint32) << 16).view(np.float32)
+  with np.errstate(invalid='ignore'):
+    return np.searchsorted((qmap[1:] + qmap[:-1]) / 2, values).astype(np.uint8)
+
+
+# 8-bit codes of adam_compact. The first moment is signed, with 4 exponent
+# and 3 mantissa bits; the root of the second moment is nonnegative and
+# spends the sign bit on a 4th mantissa bit.
+_positive = _float8_map(4, 3)
+_CODES = {
+  'signed': np.concatenate([-_positive[:0:-1], _positive]),
+  'unsigned': _float8_map(4, 4),
+}
+_CODE_TABLES = {k: _code_table(v) for k, v in _CODES.items()}
+
+
+def quantize_blockwise(x, block_size, code=None):
+  """
+  Blockwise compression of x: x is flattened and cut into blocks of
+  block_size elements, and each block is divided by its largest magnitude
+  before it is stored, so that small and large moments keep their relative
+  precision.
+
+  Inputs:
+  - x: Array to compress.
+  - block_size: Number of elements sharing one scale.
+  - code: None to store the scaled blocks as float16, or 'signed' or
+    'unsigned' to store each value as the uint8 index of the nearest value
+    of an 8-bit floating-point code.
+
+  Returns a tuple of:
+  - values: float16 or uint8 array of shape (num_blocks, block_size)
+  - scales: float32 array of shape (num_blocks,)
+  """
+  flat = x.reshape(-1)
+  num_blocks = -(-flat.size // block_size)
+  blocks = np.zeros((num_blocks, block_size), dtype=np.float32)
+  blocks.reshape(-1)[:flat.size] = flat
+  scales = np.max(np.abs(blocks), axis=1)
+  scales[scales == 0] = 1.0
+  blocks /= scales.reshape(-1, 1)
+  if code is None:
+    return blocks.astype(np.float16), scales
+  return _CODE_TABLES[code][blocks.view(np.uint32) >> 16], scales
+
+
+def dequantize_blockwise(values, scales, shape, code=None):
+  """
+  Inverse of quantize_blockwise; returns a float32 array of the given shape.
+  """
+  if code is None:
+    x = values.astype(np.float32)
+  else:
+    x = _CODES[code][values]
+  x *= scales.reshape(-1, 1)
+  return x.reshape(-1)[:int(np.prod(shape))].reshape(shape)
+
+
+def adam_compact(w, dw, config=None):
+  """
+  adam with its moments stored in 16 or 8 bits and all arithmetic done in
+  float32. Moments are stored blockwise with one float32 scale per block
+  (see quantize_blockwise), and the second moment is stored as its square
+  root, which has the magnitude of the gradient and so needs half the
+  dynamic range.
+
+  config format:
+  - learning_rate, beta1, beta2, epsilon, t: As for adam.
+  - moment_dtype: 'float16', or 'int8' for an 8-bit floating-point code.
+  - block_size: Number of elements sharing one scale.
+  - m, m_scales: The stored first moment.
+  - r, r_scales: The stored root of the second moment.
+  """
+  if config is None: config = {}
+  config.setdefault('learning_rate', 1e-3)
+  config.setdefault('beta1', 0.9)
+  config.setdefault('beta2', 0.999)
+  config.setdefault('epsilon', 1e-8)
+  config.setdefault('moment_dtype', 'float16')
+  config.setdefault('block_size', 256)
+  config.setdefault('t', 0)
+  beta1, beta2 = config['beta1'], config['beta2']
+  if config['moment_dtype'] not in ('float16', 'int8'):
+    raise ValueError('Unknown moment_dtype "%s"' % config['moment_dtype'])
+  int8 = config['moment_dtype'] == 'int8'
+
+  g = dw.astype(np.float32, copy=False)
+  if config['t'] == 0:
+    m = np.zeros(w.shape, dtype=np.float32)
+    r = np.zeros(w.shape, dtype=np.float32)
+  else:
+    m = dequantize_blockwise(config['m'], config['m_scales'], w.shape,
+                             'signed' if int8 else None)
+    r = dequantize_blockwise(config['r'], config['r_scales'], w.shape,
+                             'unsigned' if int8 else None)
+
+  m *= beta1
+  m += (1 - beta1) * g
+  v = r
+  v *= r
+  v *= beta2
+  v += (1 - beta2) * (g * g)
+  config['t'] += 1
+
+  step = v / (1 - beta2 ** config['t'])
+  np.sqrt(step, out=step)
+  step += config['epsilon']
+  np.divide(config['learning_rate'] / (1 - beta1 ** config['t']), step, out=step)
+  step *= m
+  next_w = w - step
+
+  r = np.sqrt(v, out=v)
+  config['m'], config['m_scales'] = quantize_blockwise(
+      m, config['block_size'], 'signed' if int8 else None)
+  config['r'], config['r_scales'] = quantize_blockwise(
+      r, config['block_size'], 'unsigned' if int8 else None)
+  return next_w, config
+
+
+def _trust_ratio(w_norm, u_norm, coefficient=1.0):
+  """
+  Layer-wise trust ratio coefficient * ||w|| / ||u||, or 1 when either
+  norm is zero, e.g. for biases initialized to zero.
+  """
+  if w_norm == 0 or u_norm == 0:
+    return 1.0
+  return coefficient * w_norm / u_norm
+
+
+def _warmup(config):
+  """
+  Learning rate of the current step, config['t'], ramped up linearly over
+  the first config['warmup_steps'] steps.
+  """
+  warmup = config['warmup_steps']
+  if warmup > 0 and config['t'] < warmup:
+    return config['learning_rate'] * config['t'] / warmup
+  return config['learning_rate']
+
+
+def lars(w, dw, config=None):
+  """
+  LARS: stochastic gradient descent with momentum in which each parameter
+  array scales its step by its own trust ratio
+  trust_coefficient * ||w|| / ||dw + weight_decay * w||, so that every layer
+  moves by a similar fraction of its norm however large the batch and the
+  global learning rate are. With config['segments'] from a flat-params
+  Solver, every parameter still gets its own trust ratio (see _segmented).
+
+  config format:
+  - learning_rate: Scalar global learning rate.
+  - momentum: Scalar between 0 and 1 giving the momentum value.
+  - weight_decay: Scalar L2 penalty added to the gradient.
+  - trust_coefficient: Scalar eta scaling the trust ratio.
+  - warmup_steps: Number of steps over which the learning rate is ramped
+    up linearly from zero.
+  - velocity: A numpy array of the same shape as w.
+  - t: Iteration number.
+  """
+  if config is not None and 'segments' in config:
+    return _segmented(lars, w, dw, config)
+  if config is None: config = {}
+  config.setdefault('learning_rate', 1e-1)
+  config.setdefault('momentum', 0.9)
+  config.setdefault('weight_decay', 0.0)
+  config.setdefault('trust_coefficient', 1e-3)
+  config.setdefault('warmup_steps', 0)
+  config.setdefault('t', 0)
+  v = config.get('velocity', np.zeros_like(w))
+  config['t'] += 1
+
+  g = dw + config['weight_decay'] * w if config['weight_decay'] else dw
+  trust = _trust_ratio(float(np.linalg.norm(w)), float(np.linalg.norm(g)),
+                       config['trust_coefficient'])
+  v = config['momentum'] * v - (_warmup(config) * trust) * g
+  next_w = w + v
+
+  config['velocity'] = v
+  return next_w, config
+
+
+def lamb(w, dw, config=None):
+  """
+  LAMB: the Adam step plus decoupled weight decay, scaled for each
+  parameter array by the trust ratio ||w|| / ||step||. With
+  config['segments'] from a flat-params Solver, every parameter still gets
+  its own trust ratio (see _segmented).
+
+  config format:
+  - learning_rate: Scalar global learning rate.
+  - beta1, beta2, epsilon: As for adam.
+  - weight_decay: Scalar decoupled weight decay.
+  - warmup_steps: Number of steps over which the learning rate is ramped
+    up linearly from zero.
+  - v: Moving average of gradient.
+  - a: Moving average of squared gradient.
+  - t: Iteration number.
+  """
+  if config is not None and 'segments' in config:
+    return _segmented(lamb, w, dw, config)
+  if config is None: config = {}
+  config.setdefault('learning_rate', 1e-3)
+  config.setdefault('beta1', 0.9)
+  config.setdefault('beta2', 0.999)
+  config.setdefault('epsilon', 1e-6)
+  config.setdefault('weight_decay', 0.0)
+  config.setdefault('warmup_steps', 0)
+  config.setdefault('v', np.zeros_like(w))
+  config.setdefault('a', np.zeros_like(w))
+  config.setdefault('t', 0)
+  beta1, beta2 = config['beta1'], config['beta2']
+
+  config['v'] = beta1 * config['v'] + (1 - beta1) * dw
+  config['a'] = beta2 * config['a'] + (1 - beta2) * dw * dw
+  config['t'] += 1
+
+  # Python float bias corrections keep float32 parameters in float32
+  corrected_v = config['v'] / (1 - beta1 ** config['t'])
+  corrected_a = config['a'] / (1 - beta2 ** config['t'])
+  step = corrected_v / (np.sqrt(corrected_a) + config['epsilon'])
+  if config['weight_decay']:
+    step += config['weight_decay'] * w
+  trust = _trust_ratio(float(np.linalg.norm(w)), float(np.linalg.norm(step)))
+
+  next_w = w - (_warmup(config) * trust) * step
+  return next_w, config
@@ -0,0 +1,92 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+def default_prune_keys(model):
+  """
+  Names of the parameters that are pruned by default: the weight matrices
+  of the affine layers, i.e. every 2-D parameter whose name starts with W.
+  """
+  return [k for k, v in model.params.items()
+          if k.startswith('W') and v.ndim == 2]
+
+
+def magnitude_prune(model, sparsity, keys=None):
+  """
+  Zeroes the smallest-magnitude weights of each selected layer so that a
+  fraction `sparsity` of its entries is zero.
+
+  The resulting masks are stored in model.prune_masks. The Solver keeps
+  masked weights at zero during further training, so fine-tuning a pruned
+  model only needs a Solver run on it afterwards. Any sparse copies made by
+  sparsify() are dropped, since they no longer match the weights.
+
+  Inputs:
+  - model: A model with a params dictionary.
+  - sparsity: Scalar in [0, 1), the fraction of weights to zero per layer.
+  - keys: Names of the parameters to prune; defaults to
+    default_prune_keys(model).
+
+  Returns:
+  - masks: Dictionary mapping each pruned parameter name to a boolean array
+    that is True for the weights that were kept.
+  """
+  if keys is None:
+    keys = default_prune_keys(model)
+
+  masks = {}
+  for k in keys:
+    w = model.params[k]
+    num_pruned = int(sparsity * w.size)
+    mask = np.ones(w.size, dtype=bool)
+    if num_pruned > 0:
+      smallest = np.argpartition(np.abs(w).ravel(), num_pruned - 1)[:num_pruned]
+      mask[smallest] = False
+    mask = mask.reshape(w.shape)
+    w *= mask
+    masks[k] = mask
+
+  model.prune_masks = masks
+  model.sparse_params = {}
+  return masks
+
+
+def apply_prune_masks(model):
+  """
+  Re-zeroes pruned weights in place after an update; a no-op for models
+  that have not been pruned.
+  """
+  for k, mask in getattr(model, 'prune_masks', {}).items():
+    model.params[k] *= mask
+
+
+def sparsify(model, keys=None):
+  """
+  Converts pruned affine weights to sparse matrices for inference.
+
+  Each weight W of shape (D, M) is stored in model.sparse_params[k] as a
+  scipy.sparse CSC matrix, i.e. W^T in CSR layout, so the test-time affine
+  layers compute W^T x^T as a CSR sparse-dense product. The dense params are
+  left untouched and are still used for training; call sparsify() again
+  after the weights change.
+
+  Inputs:
+  - model: A model with a params dictionary.
+  - keys: Names of the parameters to convert; defaults to those in
+    model.prune_masks, or default_prune_keys(model) if it was not pruned.
+
+  Returns:
+  - density: Dictionary mapping each converted name to its fraction of
+    nonzero entries.
+  """
+  if keys is None:
+    keys = list(getattr(model, 'prune_masks', {}).keys())
+    keys = keys or default_prune_keys(model)
+
+  density = {}
+  model.sparse_params = {}
+  for k in keys:
+    w = sp.csc_matrix(model.params[k])
+    model.sparse_params[k] = w
+    density[k] = w.nnz / float(np.prod(w.shape))
+  return density
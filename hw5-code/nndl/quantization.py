@@ -0,0 +1,239 @@
+import numpy as np
+
+from nndl.cnn import ThreeLayerConvNet
+from nndl.fc_net import FullyConnectedNet, TwoLayerNet
+from utils.fast_layers import im2col_strides, max_pool_forward_inference
+
+
+# Quantized values are clipped to [-127, 127] so that the int8 grid is
+# symmetric around zero.
+QMAX = 127
+
+# A sum of K products of two int8 values is at most K * 127**2 in magnitude,
+# which float32 represents exactly as long as it stays below 2**24. Blocks
+# of 1024 along K are therefore exact, and float32 BLAS can stand in for an
+# int8 x int8 -> int32 GEMM, which numpy does not provide.
+EXACT_BLOCK = 1024
+
+
+def int8_matmul(a, b):
+  """
+  Exact int32-accumulated product of two int8 matrices.
+
+  Inputs:
+  - a: int8 array of shape (M, K)
+  - b: int8 array of shape (K, N)
+
+  Returns:
+  - out: int32 array of shape (M, N) equal to a.dot(b) in integer arithmetic
+  """
+  K = a.shape[1]
+  out = np.zeros((a.shape[0], b.shape[1]), dtype=np.int32)
+  for k in range(0, K, EXACT_BLOCK):
+    a_blk = a[:, k:k + EXACT_BLOCK].astype(np.float32)
+    b_blk = b[k:k + EXACT_BLOCK].astype(np.float32)
+    out += a_blk.dot(b_blk).astype(np.int32)
+  return out
+
+
+def quantize(x, scale):
+  """
+  Symmetric linear quantization of x to int8 with the given scale, which
+  broadcasts against x.
+  """
+  q = np.rint(x / scale)
+  np.clip(q, -QMAX, QMAX, out=q)
+  return q.astype(np.int8)
+
+
+def channel_scales(w, axis):
+  """
+  Per-channel symmetric scales of w along the given output-channel axis.
+  """
+  reduce_axes = tuple(i for i in range(w.ndim) if i != axis)
+  amax = np.max(np.abs(w), axis=reduce_axes)
+  amax[amax == 0] = 1.0
+  return (amax / QMAX).astype(np.float32)
+
+
+def model_layers(model):
+  """
+  Describes a trained model as a list of layers that QuantizedModel can
+  run. Each layer is a dictionary with keys:
+  - kind: 'conv' or 'affine'
+  - w, b: Float weights; conv weights have shape (F, C, HH, WW) and affine
+    weights (D, M)
+  - relu: Whether a ReLU follows
+  - conv_param, pool_param: For conv layers; pool_param may be None
+
+  Test-time batchnorm in FullyConnectedNet is folded into the weights and
+  biases of the preceding affine layer, and dropout is dropped.
+  """
+  p = model.params
+  if isinstance(model, ThreeLayerConvNet):
+    if getattr(model, 'layout', 'NCHW') != 'NCHW':
+      raise ValueError('Only NCHW ThreeLayerConvNets can be quantized')
+    if getattr(model, 'global_pool', False):
+      raise ValueError('ThreeLayerConvNets with global_pool cannot be quantized')
+    filter_size = p['W1'].shape[2]
+    return [
+      {'kind': 'conv', 'w': p['W1'], 'b': p['b1'], 'relu': True,
+       'conv_param': {'stride': 1, 'pad': (filter_size - 1) // 2},
+       'pool_param': {'pool_height': 2, 'pool_width': 2, 'stride': 2}},
+      {'kind': 'affine', 'w': p['W2'], 'b': p['b2'], 'relu': True},
+      {'kind': 'affine', 'w': p['W3'], 'b': p['b3'], 'relu': False},
+    ]
+
+  if isinstance(model, TwoLayerNet):
+    return [
+      {'kind': 'affine', 'w': p['W1'], 'b': p['b1'], 'relu': True},
+      {'kind': 'affine', 'w': p['W2'], 'b': p['b2'], 'relu': False},
+    ]
+
+  if isinstance(model, FullyConnectedNet):
+    layers = []
+    for i in range(1, model.num_layers + 1):
+      w, b = p['W%d' % i], p['b%d' % i]
+      last = i == model.num_layers
+      if model.use_batchnorm and not last:
+        bn_param = model.bn_params[i - 1]
+        eps = bn_param.get('eps', 1e-5)
+        scale = p['gamma%d' % i] / np.sqrt(bn_param.get('running_var', 0) + eps)
+        w = w * scale
+        b = (b - bn_param.get('running_mean', 0)) * scale + p['beta%d' % i]
+      layers.append({'kind': 'affine', 'w': w, 'b': b, 'relu': not last})
+    return layers
+
+  raise ValueError('Unsupported model type "%s"' % type(model).__name__)
+
+
+class QuantizedModel(object):
+  """
+  Post-training int8 quantization of a trained FullyConnectedNet,
+  TwoLayerNet or ThreeLayerConvNet for inference.
+
+  Weights are quantized per output channel (per filter for conv layers, per
+  column for affine layers) and stored as int8. Each layer's input gets a
+  per-tensor scale calibrated on a sample of data (typically X_val), taken
+  as the largest magnitude that layer saw during a float forward pass.
+
+  At test time every conv (via im2col) and affine layer quantizes its input
+  to int8, multiplies with int32 accumulation, and rescales the result to
+  float with one per-channel factor before adding the float bias. ReLU and
+  max pooling run on the rescaled float activations.
+
+  The object exposes the test-time half of the model API, so
+  Solver.check_accuracy works on it; it cannot be trained.
+  """
+
+  def __init__(self, model, X_calib):
+    """
+    Inputs:
+    - model: A trained model.
+    - X_calib: Array of calibration inputs, e.g. a few hundred images from
+      X_val.
+    """
+    self.layers = model_layers(model)
+    self.input_scales = self._calibrate(X_calib)
+
+    self.params = {}
+    for i, layer in enumerate(self.layers):
+      w = layer['w']
+      if layer['kind'] == 'conv':
+        scales = channel_scales(w, axis=0)
+        w_q = quantize(w, scales.reshape(-1, 1, 1, 1)).reshape(w.shape[0], -1)
+      else:
+        scales = channel_scales(w, axis=1)
+        w_q = quantize(w, scales)
+      self.params['W%d' % (i + 1)] = w_q
+      layer['w_q'] = w_q
+      layer['w_shape'] = w.shape
+      layer['rescale'] = scales * self.input_scales[i]
+
+      # Only the int8 weights are kept
+      del layer['w']
+
+
+  def _calibrate(self, X):
+    """
+    Runs a float forward pass and returns the input scale of every layer.
+    """
+    scales = []
+    out = X
+    for layer in self.layers:
+      amax = np.max(np.abs(out))
+      scales.append(np.float32(amax / QMAX if amax > 0 else 1.0))
+      out = self._float_layer(layer, out)
+    return scales
+
+
+  def _float_layer(self, layer, x):
+    """
+    Float forward pass of a single layer, used during calibration.
+    """
+    w, b = layer['w'], layer['b']
+    if layer['kind'] == 'conv':
+      F, _, HH, WW = w.shape
+      conv_param = layer['conv_param']
+      x_cols, out_h, out_w = im2col_strides(x, HH, WW, conv_param['pad'],
+                                            conv_param['stride'])
+      out = w.reshape(F, -1).dot(x_cols) + b.reshape(-1, 1)
+      out = out.reshape(F, x.shape[0], out_h, out_w).transpose(1, 0, 2, 3)
+    else:
+      out = x.reshape(x.shape[0], -1).dot(w) + b
+    if layer['relu']:
+      out = np.maximum(out, 0)
+    if layer.get('pool_param') is not None:
+      out = max_pool_forward_inference(np.ascontiguousarray(out),
+                                       layer['pool_param'])
+    return out
+
+
+  def _int8_layer(self, i, x):
+    """
+    Integer forward pass of layer i with float rescale.
+    """
+    layer = self.layers[i]
+    x_q = quantize(x, self.input_scales[i])
+    if layer['kind'] == 'conv':
+      F = layer['w_q'].shape[0]
+      _, _, HH, WW = layer['w_shape']
+      conv_param = layer['conv_param']
+      x_cols, out_h, out_w = im2col_strides(x_q, HH, WW, conv_param['pad'],
+                                            conv_param['stride'])
+      acc = int8_matmul(layer['w_q'], x_cols)
+      del x_cols
+      out = acc.astype(np.float32)
+      out *= layer['rescale'].reshape(-1, 1)
+      out += layer['b'].reshape(-1, 1)
+      out = out.reshape(F, x.shape[0], out_h, out_w).transpose(1, 0, 2, 3)
+      out = np.ascontiguousarray(out)
+    else:
+      acc = int8_matmul(x_q.reshape(x.shape[0], -1), layer['w_q'])
+      out = acc.astype(np.float32)
+      out *= layer['rescale']
+      out += layer['b']
+    if layer['relu']:
+      np.maximum(out, 0, out=out)
+    if layer.get('pool_param') is not None:
+      out = max_pool_forward_inference(out, layer['pool_param'])
+    return out
+
+
+  def loss(self, X, y=None):
+    """
+    Test-time forward pass in int8.
+
+    Inputs:
+    - X: Array of input data of shape (N, d_1, ..., d_k)
+    - y: Must be None
+
+    Returns:
+    - scores: Array of shape (N, C) giving float classification scores.
+    """
+    if y is not None:
+      raise ValueError('QuantizedModel only supports inference')
+    out = X
+    for i in range(len(self.layers)):
+      out = self._int8_layer(i, out)
+    return out
@@ -0,0 +1,825 @@
+from __future__ import print_function, division
+import asyncio
+import copy
+import time
+import tracemalloc
+
+import numpy as np
+
+from nndl import optim
+from nndl.cnn import ThreeLayerConvNet
+from nndl.conv_layer_utils import (conv_relu_pool_forward, conv_relu_pool_backward,
+                                   conv_relu_pool_fused_forward,
+                                   conv_relu_pool_fused_backward)
+from nndl.conv_layers import spatial_batchnorm_forward, spatial_batchnorm_backward
+from nndl.layers import batchnorm_forward, batchnorm_backward
+from nndl.pruning import magnitude_prune, sparsify
+from nndl.quantization import QuantizedModel
+from utils.fast_layers import (conv_forward_strides, conv_backward_strides,
+                               conv_forward_fft, conv_backward_fft,
+                               conv_forward_auto, conv_backward_auto,
+                               conv_forward_chunked, conv_backward_chunked,
+                               max_pool_forward_fast, max_pool_backward_fast)
+from utils.inference_server import InferenceServer, generate_load
+from utils.solver import Solver
+from utils.parallel_solver import DataParallelSolver
+
+
+def data_parallel_scaling(model_fn, data, worker_counts, batch_size=256,
+                          num_steps=20, update_rule='sgd_momentum'):
+    """
+    Measures training throughput of DataParallelSolver for several worker
+    counts and prints a samples/sec scaling table against the single-process
+    Solver.
+
+    Inputs:
+    - model_fn: Function with no arguments returning a fresh model
+    - data: Data dictionary as passed to Solver
+    - worker_counts: List of worker counts to measure, e.g. [1, 2, 4, 8]
+    - batch_size: Minibatch size, split across the workers
+    - num_steps: Number of timed updates per setting
+
+    Returns a dictionary mapping worker count (0 for the plain Solver) to
+    samples/sec.
+    """
+    rates = {}
+    for num_workers in [0] + list(worker_counts):
+        kwargs = {'update_rule': update_rule, 'batch_size': batch_size,
+                  'verbose': False}
+        if num_workers == 0:
+            solver = Solver(model_fn(), data, **kwargs)
+        else:
+            solver = DataParallelSolver(model_fn(), data, num_workers=num_workers,
+                                        **kwargs)
+            solver._start_workers()
+        try:
+            solver._step()
+            tic = time.time()
+            for _ in range(num_steps):
+                solver._step()
+            rates[num_workers] = num_steps * batch_size / (time.time() - tic)
+        finally:
+            if num_workers > 0:
+                solver._stop_workers()
+
+    print('workers  samples/sec  speedup')
+    for num_workers in sorted(rates):
+        name = 'solver' if num_workers == 0 else num_workers
+        print('{:>7}  {:>11.1f}  {:>7.2f}'.format(name, rates[num_workers],
+                                                  rates[num_workers] / rates[0]))
+    return rates
+
+
+def mixed_precision_report(model_fn, data, num_steps=10, **solver_kwargs):
+    """
+    Trains the same model in float32 and in mixed precision and prints the
+    final validation accuracy, the peak memory of a training step (as traced
+    by tracemalloc) and the average step time for each.
+
+    Inputs:
+    - model_fn: Function taking mixed_precision=<bool> and returning a fresh
+      model, e.g. lambda mixed_precision: ThreeLayerConvNet(
+      mixed_precision=mixed_precision)
+    - data: Data dictionary as passed to Solver
+    - num_steps: Number of steps used for the memory and time measurements
+    - solver_kwargs: Passed on to Solver; these control the training run
+    """
+    print('mode     val acc  peak step MB  step ms')
+    for mixed in [False, True]:
+        np.random.seed(0)
+        model = model_fn(mixed_precision=mixed)
+        solver = Solver(model, data, verbose=False, **solver_kwargs)
+        solver.train()
+        val_acc = solver.check_accuracy(data['X_val'], data['y_val'])
+
+        solver._step()
+        tracemalloc.start()
+        solver._step()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        tic = time.time()
+        for _ in range(num_steps):
+            solver._step()
+        step_time = (time.time() - tic) / num_steps
+
+        name = 'mixed' if mixed else 'float32'
+        print('{:<7}  {:>7.3f}  {:>12.1f}  {:>7.1f}'.format(
+              name, val_acc, peak / 1e6, 1e3 * step_time))
+
+
+def pruning_report(model, data, sparsities, num_repeats=3, **finetune_kwargs):
+    """
+    Prunes copies of a trained model to several sparsity levels and prints,
+    for each, the validation accuracy and the inference time of
+    check_accuracy on X_val using dense and CSR sparse affine weights.
+
+    Inputs:
+    - model: A trained model; it is copied and left unchanged
+    - data: Data dictionary as passed to Solver
+    - sparsities: List of sparsity levels, e.g. [0.5, 0.8, 0.9, 0.95]
+    - num_repeats: Number of timed passes over X_val per setting
+    - finetune_kwargs: If given, each pruned copy is fine-tuned with a Solver
+      built from these arguments before it is measured
+    """
+    print('sparsity  val acc  dense ms  sparse ms  speedup')
+    for sparsity in [0.0] + list(sparsities):
+        pruned = copy.deepcopy(model)
+        if sparsity > 0:
+            magnitude_prune(pruned, sparsity)
+        if sparsity > 0 and finetune_kwargs:
+            Solver(pruned, data, verbose=False, **finetune_kwargs).train()
+
+        solver = Solver(pruned, data, verbose=False)
+        times = []
+        for use_sparse in [False, True]:
+            if use_sparse:
+                sparsify(pruned)
+            tic = time.time()
+            for _ in range(num_repeats):
+                val_acc = solver.check_accuracy(data['X_val'], data['y_val'])
+            times.append(1e3 * (time.time() - tic) / num_repeats)
+        print('{:>8.2f}  {:>7.3f}  {:>8.1f}  {:>9.1f}  {:>7.2f}'.format(
+              sparsity, val_acc, times[0], times[1], times[0] / times[1]))
+
+
+def quantization_report(model, data, num_calib=500, num_repeats=3):
+    """
+    Quantizes a trained model to int8 with QuantizedModel, calibrating on the
+    first num_calib images of X_val, and prints the validation accuracy,
+    inference time of check_accuracy on X_val and weight storage of the float
+    and int8 paths.
+    """
+    qmodel = QuantizedModel(model, data['X_val'][:num_calib])
+
+    print('path     val acc  time ms  weight MB')
+    for name, m in [('float', model), ('int8', qmodel)]:
+        solver = Solver(m, data, verbose=False)
+        tic = time.time()
+        for _ in range(num_repeats):
+            val_acc = solver.check_accuracy(data['X_val'], data['y_val'])
+        elapsed = 1e3 * (time.time() - tic) / num_repeats
+        nbytes = sum(v.nbytes for k, v in m.params.items() if k.startswith('W'))
+        print('{:<7}  {:>7.3f}  {:>7.1f}  {:>9.2f}'.format(
+              name, val_acc, elapsed, nbytes / 1e6))
+
+
+def conv_fft_crossover(filter_sizes, image_sizes, num_images=50,
+                       num_channels=3, num_filters=32, num_repeats=3,
+                       dtype=np.float32):
+    """
+    Times a forward and backward pass of conv_forward_strides (im2col) and
+    conv_forward_fft on random data for every combination of filter size and
+    image size, using stride 1 and 'same' padding, and prints a table of the
+    times and the speedup of the FFT path.
+
+    Inputs:
+    - filter_sizes: List of odd filter sizes, e.g. [3, 5, 7, 9, 11]
+    - image_sizes: List of square image sizes, e.g. [16, 32, 64]
+    - num_images, num_channels, num_filters: Layer dimensions N, C and F
+    - num_repeats: Number of timed passes per setting; the best is reported
+
+    Returns a dictionary mapping (filter_size, image_size) to the speedup of
+    the FFT path over im2col.
+    """
+    speedups = {}
+    print('filter  image  im2col ms  fft ms  speedup')
+    for filter_size in filter_sizes:
+        for image_size in image_sizes:
+            x = np.random.randn(num_images, num_channels, image_size, image_size)
+            w = np.random.randn(num_filters, num_channels, filter_size, filter_size)
+            x, w = x.astype(dtype), w.astype(dtype)
+            b = np.zeros(num_filters, dtype=dtype)
+            conv_param = {'stride': 1, 'pad': (filter_size - 1) // 2}
+
+            times = []
+            for forward, backward in [(conv_forward_strides, conv_backward_strides),
+                                      (conv_forward_fft, conv_backward_fft)]:
+                best = np.inf
+                for _ in range(num_repeats):
+                    tic = time.time()
+                    out, cache = forward(x, w, b, conv_param)
+                    backward(out, cache)
+                    best = min(best, time.time() - tic)
+                times.append(1e3 * best)
+
+            speedups[(filter_size, image_size)] = times[0] / times[1]
+            print('{:>6}  {:>5}  {:>9.1f}  {:>6.1f}  {:>7.2f}'.format(
+                  filter_size, image_size, times[0], times[1], times[0] / times[1]))
+    return speedups
+
+
+def _best_time(fn, num_repeats):
+    """
+    Best wall-clock time of fn() over num_repeats calls, in milliseconds.
+    """
+    best = np.inf
+    for _ in range(num_repeats):
+        tic = time.time()
+        fn()
+        best = min(best, time.time() - tic)
+    return 1e3 * best
+
+
+def layout_report(num_images=100, num_repeats=3, dtype=np.float32):
+    """
+    Compares the NCHW and NHWC layouts on CIFAR-10 shapes. Prints the forward
+    plus backward time of each layer type on its own and of a full
+    ThreeLayerConvNet loss and gradient evaluation with default sizes.
+    Per-layer timings exclude any layout conversion, as they would inside a
+    model; the model timings include the one conversion of the input.
+
+    Returns a dictionary mapping each benchmark name to a (NCHW ms, NHWC ms)
+    tuple.
+    """
+    N = num_images
+    pool_param = {'pool_height': 2, 'pool_width': 2, 'stride': 2}
+    benchmarks = [
+      ('conv 7x7 3->32', (N, 3, 32, 32), 'conv', (32, 3, 7, 7)),
+      ('conv 3x3 32->32', (N, 32, 16, 16), 'conv', (32, 32, 3, 3)),
+      ('maxpool 2x2', (N, 32, 32, 32), 'pool', None),
+      ('spatial bn', (N, 32, 32, 32), 'bn', None),
+    ]
+
+    results = {}
+    print('{:<18}  {:>8}  {:>8}  {:>7}'.format('', 'NCHW ms', 'NHWC ms', 'speedup'))
+    for name, x_shape, kind, w_shape in benchmarks + [('ThreeLayerConvNet', None, 'model', None)]:
+        times = []
+        for layout in ['NCHW', 'NHWC']:
+            if kind == 'model':
+                model = ThreeLayerConvNet(dtype=dtype, layout=layout)
+                X = np.random.randn(N, 3, 32, 32).astype(dtype)
+                y = np.random.randint(10, size=N)
+                fn = lambda: model.loss(X, y)
+                times.append(_best_time(fn, num_repeats))
+                continue
+
+            x = np.random.randn(*x_shape).astype(dtype)
+            if layout == 'NHWC':
+                x = np.ascontiguousarray(x.transpose(0, 2, 3, 1))
+            if kind == 'conv':
+                w = np.random.randn(*w_shape).astype(dtype)
+                b = np.zeros(w_shape[0], dtype=dtype)
+                conv_param = {'stride': 1, 'pad': (w_shape[2] - 1) // 2, 'layout': layout}
+                def fn():
+                    out, cache = conv_forward_auto(x, w, b, conv_param)
+                    conv_backward_auto(out, cache)
+            elif kind == 'pool':
+                param = dict(pool_param, layout=layout)
+                def fn():
+                    out, cache = max_pool_forward_fast(x, param)
+                    max_pool_backward_fast(out, cache)
+            else:
+                C = x_shape[1]
+                gamma, beta = np.ones(C, dtype=dtype), np.zeros(C, dtype=dtype)
+                def fn():
+                    bn_param = {'mode': 'train', 'layout': layout}
+                    out, cache = spatial_batchnorm_forward(x, gamma, beta, bn_param)
+                    spatial_batchnorm_backward(out, cache)
+            times.append(_best_time(fn, num_repeats))
+
+        results[name] = tuple(times)
+        print('{:<18}  {:>8.1f}  {:>8.1f}  {:>7.2f}'.format(
+              name, times[0], times[1], times[0] / times[1]))
+    return results
+
+
+def workspace_report(model_fn, data, num_steps=20, **solver_kwargs):
+    """
+    Times Solver steps of a model with and without its ConvWorkspace and
+    prints the average step time, the peak memory allocated during a step
+    (as traced by tracemalloc) and the memory held by the workspace.
+
+    Inputs:
+    - model_fn: Function with no arguments returning a fresh model with a
+      conv_workspace attribute, e.g. ThreeLayerConvNet
+    - data: Data dictionary as passed to Solver
+    - num_steps: Number of timed steps
+    - solver_kwargs: Passed on to Solver
+    """
+    print('workspace  step ms  peak step MB  held MB')
+    for use_workspace in [False, True]:
+        np.random.seed(0)
+        model = model_fn()
+        if not use_workspace:
+            model.conv_workspace = None
+        solver = Solver(model, data, verbose=False, **solver_kwargs)
+
+        solver._step()
+        tracemalloc.start()
+        solver._step()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        tic = time.time()
+        for _ in range(num_steps):
+            solver._step()
+        step_time = (time.time() - tic) / num_steps
+
+        held = model.conv_workspace.nbytes if use_workspace else 0
+        print('{:<9}  {:>7.1f}  {:>12.1f}  {:>7.1f}'.format(
+              'on' if use_workspace else 'off', 1e3 * step_time, peak / 1e6,
+              held / 1e6))
+
+
+def chunked_conv_report(budgets_mb, num_images=256, num_channels=64,
+                        num_filters=64, image_size=32, filter_size=3,
+                        num_repeats=2, dtype=np.float32):
+    """
+    Compares conv_forward_strides, which caches the full im2col matrix, with
+    conv_forward_chunked under several memory budgets. For each it prints the
+    peak memory traced by tracemalloc over a forward and backward pass,
+    including the cache held in between, and the best forward plus backward
+    time.
+
+    Inputs:
+    - budgets_mb: List of memory budgets for conv_forward_chunked, in MB
+    - num_images, num_channels, num_filters, image_size, filter_size: Layer
+      dimensions; stride 1 with 'same' padding
+    - num_repeats: Number of timed passes per setting
+    """
+    x = np.random.randn(num_images, num_channels, image_size, image_size)
+    w = np.random.randn(num_filters, num_channels, filter_size, filter_size)
+    x, w = x.astype(dtype), w.astype(dtype)
+    b = np.zeros(num_filters, dtype=dtype)
+
+    settings = [('strides', None)] + [('chunked', mb) for mb in budgets_mb]
+    print('method   budget MB  peak MB  fwd+bwd ms')
+    for method, budget in settings:
+        conv_param = {'stride': 1, 'pad': (filter_size - 1) // 2}
+        forward, backward = conv_forward_strides, conv_backward_strides
+        if method == 'chunked':
+            conv_param['memory_budget'] = int(budget * 2 ** 20)
+            forward, backward = conv_forward_chunked, conv_backward_chunked
+
+        def step():
+            out, cache = forward(x, w, b, conv_param)
+            backward(out, cache)
+
+        tracemalloc.start()
+        step()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        elapsed = _best_time(step, num_repeats)
+
+        print('{:<7}  {:>9}  {:>7.1f}  {:>10.1f}'.format(
+              method, '-' if budget is None else budget, peak / 1e6, elapsed))
+
+
+def fused_block_report(num_images=100, num_channels=3, num_filters=32,
+                       image_size=32, filter_size=7, num_repeats=3,
+                       layout='NCHW', dtype=np.float32):
+    """
+    Compares conv_relu_pool_forward with conv_relu_pool_fused_forward for one
+    conv - relu - 2x2 max pool block of the size ThreeLayerConvNet uses. For
+    each it prints the memory held between the forward and backward pass
+    (the output plus the cache), the peak memory traced by tracemalloc over a
+    forward and backward pass, and the best forward plus backward time.
+
+    Inputs:
+    - num_images, num_channels, num_filters, image_size, filter_size: Block
+      dimensions; stride 1 with 'same' padding
+    - num_repeats: Number of timed passes per block
+    - layout: 'NCHW' or 'NHWC'
+    - dtype: Datatype of the inputs and weights
+    """
+    x = np.random.randn(num_images, num_channels, image_size, image_size)
+    w = np.random.randn(num_filters, num_channels, filter_size, filter_size)
+    x, w = x.astype(dtype), w.astype(dtype)
+    b = np.zeros(num_filters, dtype=dtype)
+    if layout == 'NHWC':
+        x = np.ascontiguousarray(x.transpose(0, 2, 3, 1))
+    conv_param = {'stride': 1, 'pad': (filter_size - 1) // 2, 'layout': layout}
+    pool_param = {'pool_height': 2, 'pool_width': 2, 'stride': 2,
+                  'layout': layout}
+
+    blocks = [('unfused', conv_relu_pool_forward, conv_relu_pool_backward),
+              ('fused', conv_relu_pool_fused_forward,
+               conv_relu_pool_fused_backward)]
+    print('block    held MB  peak MB  fwd+bwd ms')
+    for name, forward, backward in blocks:
+        def step():
+            out, cache = forward(x, w, b, conv_param, pool_param)
+            backward(out, cache)
+
+        tracemalloc.start()
+        out, cache = forward(x, w, b, conv_param, pool_param)
+        held = tracemalloc.get_traced_memory()[0]
+        backward(out, cache)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        del out, cache
+        elapsed = _best_time(step, num_repeats)
+
+        print('{:<7}  {:>7.1f}  {:>7.1f}  {:>10.1f}'.format(
+              name, held / 1e6, peak / 1e6, elapsed))
+
+
+def spatial_batchnorm_report(shapes, num_repeats=5, dtype=np.float32):
+    """
+    Compares the native NCHW spatial batchnorm, which reduces over (N, H, W)
+    in place, with the transpose approach that copies the input to a
+    (N*H*W, C) matrix, runs batchnorm_forward and copies the result back,
+    and the mirror image in the backward pass. Prints the best training
+    forward plus backward time of each.
+
+    Inputs:
+    - shapes: List of (N, C, H, W) input shapes
+    - num_repeats: Number of timed passes per shape
+    """
+    print('shape                 transpose ms  native ms  speedup')
+    for shape in shapes:
+        N, C, H, W = shape
+        x = np.random.randn(*shape).astype(dtype)
+        gamma, beta = np.ones(C, dtype=dtype), np.zeros(C, dtype=dtype)
+
+        def transposed():
+            x_2d = x.transpose(0, 2, 3, 1).reshape(-1, C)
+            out, cache = batchnorm_forward(x_2d, gamma, beta, {'mode': 'train'})
+            out = out.reshape(N, H, W, C).transpose(0, 3, 1, 2).copy()
+            dout = out.transpose(0, 2, 3, 1).reshape(-1, C)
+            dx, _, _ = batchnorm_backward(dout, cache)
+            dx.reshape(N, H, W, C).transpose(0, 3, 1, 2).copy()
+
+        def native():
+            out, cache = spatial_batchnorm_forward(x, gamma, beta, {'mode': 'train'})
+            spatial_batchnorm_backward(out, cache)
+
+        t_transposed = _best_time(transposed, num_repeats)
+        t_native = _best_time(native, num_repeats)
+        print('{:<20}  {:>12.1f}  {:>9.1f}  {:>7.2f}'.format(
+              str(shape), t_transposed, t_native, t_transposed / t_native))
+
+
+def separable_conv_report(num_images=64, num_channels=64, num_filters=64,
+                          image_size=16, filter_size=3, groups=4,
+                          num_repeats=3, dtype=np.float32):
+    """
+    Compares a dense convolution with a grouped one and with a
+    depthwise-separable block (depthwise convolution followed by a pointwise
+    1x1 convolution) of the same input and output sizes. For each it prints
+    the number of weights, the forward FLOPs (two per multiply-add) and the
+    best forward plus backward time through conv_forward_auto.
+
+    Inputs:
+    - num_images, num_channels, num_filters, image_size, filter_size: Layer
+      dimensions; stride 1 with 'same' padding
+    - groups: Number of groups of the grouped convolution
+    - num_repeats: Number of timed passes per setting
+    """
+    N, C, F, S, K = num_images, num_channels, num_filters, image_size, filter_size
+    x = np.random.randn(N, C, S, S).astype(dtype)
+    pad = (K - 1) // 2
+
+    # Each setting is a list of (w shape, groups) convolutions applied in turn
+    settings = [
+      ('dense', [((F, C, K, K), 1)]),
+      ('grouped G=%d' % groups, [((F, C // groups, K, K), groups)]),
+      ('depthwise+pointwise', [((C, 1, K, K), C), ((F, C, 1, 1), 1)]),
+    ]
+
+    print('{:<20}  {:>8}  {:>8}  {:>10}'.format('', 'weights', 'MFLOPs', 'fwd+bwd ms'))
+    for name, convs in settings:
+        layers = []
+        num_weights, flops = 0, 0
+        for w_shape, G in convs:
+            w = (1e-2 * np.random.randn(*w_shape)).astype(dtype)
+            b = np.zeros(w_shape[0], dtype=dtype)
+            conv_param = {'stride': 1, 'pad': (w_shape[2] - 1) // 2, 'groups': G}
+            layers.append((w, b, conv_param))
+            num_weights += w.size
+            flops += 2 * N * S * S * w.size
+
+        def step():
+            out, caches = x, []
+            for w, b, conv_param in layers:
+                out, cache = conv_forward_auto(out, w, b, conv_param)
+                caches.append(cache)
+            dout = out
+            for cache in reversed(caches):
+                dout = conv_backward_auto(dout, cache)[0]
+
+        elapsed = _best_time(step, num_repeats)
+        print('{:<20}  {:>8}  {:>8.1f}  {:>10.1f}'.format(
+              name, num_weights, flops / 1e6, elapsed))
+
+
+def global_pool_report(data, num_steps=10, model_kwargs=None, **solver_kwargs):
+    """
+    Trains ThreeLayerConvNet with and without global average pooling before
+    the hidden affine layer and prints the number of parameters, the average
+    training step time and the final validation accuracy of each.
+
+    Inputs:
+    - data: Data dictionary as passed to Solver; the image size is taken
+      from X_train
+    - num_steps: Number of steps used for the time measurement
+    - model_kwargs: Optional dictionary of further ThreeLayerConvNet arguments
+    - solver_kwargs: Passed on to Solver; these control the training run
+    """
+    model_kwargs = model_kwargs or {}
+    input_dim = data['X_train'].shape[1:]
+    print('model       params  step ms  val acc')
+    for global_pool in [False, True]:
+        np.random.seed(0)
+        model = ThreeLayerConvNet(input_dim=input_dim, global_pool=global_pool,
+                                  **model_kwargs)
+        num_params = sum(v.size for v in model.params.values())
+        solver = Solver(model, data, verbose=False, **solver_kwargs)
+        solver.train()
+        val_acc = solver.check_accuracy(data['X_val'], data['y_val'])
+
+        tic = time.time()
+        for _ in range(num_steps):
+            solver._step()
+        step_time = (time.time() - tic) / num_steps
+
+        name = 'gap' if global_pool else 'flatten'
+        print('{:<8}  {:>9}  {:>7.1f}  {:>7.3f}'.format(
+              name, num_params, 1e3 * step_time, val_acc))
+
+
+def requires_grad_report(num_images=100, num_repeats=3, dtype=np.float32):
+    """
+    Measures what skipping the input gradient saves in the first conv layer
+    of ThreeLayerConvNet (3 -> 32 channels, 7x7 filters on 32x32 images). For
+    each conv method it prints the best backward time with all gradients and
+    with requires_grad=(False, True, True).
+    """
+    x = np.random.randn(num_images, 3, 32, 32).astype(dtype)
+    w = (1e-3 * np.random.randn(32, 3, 7, 7)).astype(dtype)
+    b = np.zeros(32, dtype=dtype)
+
+    print('method   all ms  no dx ms  saving')
+    for method in ['strides', 'fft', 'nhwc']:
+        conv_param = {'stride': 1, 'pad': 3, 'method': method}
+        x_in = x
+        if method == 'nhwc':
+            conv_param['layout'] = 'NHWC'
+            x_in = np.ascontiguousarray(x.transpose(0, 2, 3, 1))
+        out, cache = conv_forward_auto(x_in, w, b, conv_param)
+        t_all = _best_time(lambda: conv_backward_auto(out, cache), num_repeats)
+        t_skip = _best_time(lambda: conv_backward_auto(out, cache, (False, True, True)),
+                            num_repeats)
+        print('{:<7}  {:>6.1f}  {:>8.1f}  {:>5.0f}%'.format(
+              method, t_all, t_skip, 100 * (1 - t_skip / t_all)))
+
+
+def serving_report(model, X, settings, num_clients=32, num_requests=1000,
+                   unix_path=None, num_workers=1):
+    """
+    Load test of InferenceServer. For every (max_batch_size, max_wait)
+    setting a server is started on a free local port (or unix_path), and
+    num_clients closed-loop clients send single examples from X until
+    num_requests are answered. Prints the p50 and p99 latency, the
+    throughput and the mean micro-batch size. The clients share the
+    server's event loop, so on a single core their overhead is included in
+    the numbers.
+
+    Inputs:
+    - model: A trained model
+    - X: Array of examples to send, of shape (N, d_1, ..., d_k)
+    - settings: List of (max_batch_size, max_wait in seconds) tuples
+    - num_clients: Number of concurrent connections
+    - num_requests: Total number of requests per setting
+    - unix_path: Optional Unix socket path to serve on instead of TCP
+    - num_workers: Number of forward passes that may run at once
+    """
+    async def run(max_batch_size, max_wait):
+        server = InferenceServer(model, X.shape[1:], port=0, unix_path=unix_path,
+                                 max_batch_size=max_batch_size, max_wait=max_wait,
+                                 num_workers=num_workers)
+        await server.start()
+        try:
+            # Warm up the connections and the worker pool
+            await generate_load(X, num_clients, num_clients, server.port, unix_path)
+            server.batcher.batch_sizes = []
+            latencies, elapsed = await generate_load(X, num_clients, num_requests,
+                                                     server.port, unix_path)
+        finally:
+            await server.stop()
+        return latencies, elapsed, np.mean(server.batcher.batch_sizes)
+
+    print('batch  wait ms  p50 ms  p99 ms    req/s  mean batch')
+    for max_batch_size, max_wait in settings:
+        latencies, elapsed, mean_batch = asyncio.run(run(max_batch_size, max_wait))
+        p50, p99 = 1e3 * np.percentile(latencies, [50, 99])
+        print('{:>5}  {:>7.1f}  {:>6.1f}  {:>6.1f}  {:>7.0f}  {:>10.1f}'.format(
+              max_batch_size, 1e3 * max_wait, p50, p99, len(latencies) / elapsed,
+              mean_batch))
+
+
+# Cold-start scripts for export_report: each loads the model, classifies the
+# examples in argv[2] once, and prints its wall time and its peak RSS in KB
+# after loading and after the forward pass. The peak is read from VmHWM in
+# /proc, since ru_maxrss keeps the parent's peak across fork and exec.
+_COLD_START = {
+  'pickle': ('import pickle\n'
+             'with open(sys.argv[1], "rb") as f:\n'
+             '  model = pickle.load(f)["model"]\n'),
+  'runtime': ('from utils.runtime import Runtime\n'
+              'model = Runtime(sys.argv[1])\n'),
+  'runtime mmap': ('from utils.runtime import Runtime\n'
+                   'model = Runtime(sys.argv[1], mmap=True)\n'),
+}
+
+
+def export_report(model, X, directory, num_repeats=5):
+    """
+    Compares the cold start of a pickled checkpoint with that of the same
+    model exported by nndl.export and served by utils.runtime, with the
+    weights read or memory-mapped. Every start is a fresh Python process that
+    loads the model and classifies X once; prints the best wall time over
+    num_repeats processes, the peak resident set size once the model is
+    loaded and after the forward pass (which includes BLAS buffers), and the
+    size on disk.
+
+    Inputs:
+    - model: A trained model
+    - X: Array of examples of shape (N, d_1, ..., d_k)
+    - directory: Where to write the checkpoint, the export and X
+    - num_repeats: Number of processes per variant
+    """
+    import os
+    import pickle
+    import subprocess
+    import sys
+    from nndl.export import export_model
+
+    checkpoint = os.path.join(directory, 'model.pkl')
+    graph = os.path.join(directory, 'model.json')
+    inputs = os.path.join(directory, 'X.npy')
+    with open(checkpoint, 'wb') as f:
+        pickle.dump({'model': model}, f)
+    export_model(model, graph, X.shape[1:])
+    np.save(inputs, X)
+    sizes = {
+      'pickle': os.path.getsize(checkpoint),
+      'runtime': os.path.getsize(graph) + os.path.getsize(graph[:-5] + '.npz'),
+    }
+    sizes['runtime mmap'] = sizes['runtime']
+
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env = dict(os.environ, PYTHONPATH=root)
+    print('variant         start ms  loaded RSS MB  peak RSS MB  disk MB')
+    for name, load in _COLD_START.items():
+        script = ('import sys, time\nstart = time.time()\n' + load +
+                  'def peak():\n'
+                  '  for line in open("/proc/self/status"):\n'
+                  '    if line.startswith("VmHWM:"):\n'
+                  '      return int(line.split()[1])\n'
+                  'loaded = peak()\n'
+                  'import numpy as np\n'
+                  'model.loss(np.load(sys.argv[2]))\n'
+                  'print(time.time() - start, loaded, peak())\n')
+        times, loaded, peak = [], [], []
+        for _ in range(num_repeats):
+            out = subprocess.check_output([sys.executable, '-c', script,
+                                           graph if 'runtime' in name else checkpoint,
+                                           inputs], env=env, cwd=root)
+            t, l, r = out.split()
+            times.append(float(t))
+            loaded.append(int(l))
+            peak.append(int(r))
+        print('{:<14}  {:>8.1f}  {:>13.1f}  {:>11.1f}  {:>7.1f}'.format(
+              name, 1e3 * min(times), min(loaded) / 1024, min(peak) / 1024,
+              sizes[name] / 2**20))
+
+
+def inplace_update_report(shape=(3072, 1024), num_repeats=10, dtype=np.float32,
+                          rules=('sgd_momentum', 'sgd_nesterov_momentum',
+                                 'rmsprop', 'adam')):
+    """
+    Compares each update rule in optim.py with its in-place variant on one
+    parameter of the given shape, by default the first layer of a
+    FullyConnectedNet with 1024 hidden units on CIFAR-10. Prints the best
+    time of a steady-state update, the bytes it allocates, and the largest
+    difference between the weights the two rules reach after num_repeats
+    identical steps.
+    """
+    print('rule                     orig ms  alloc MB  inplace ms  alloc MB  max diff')
+    for name in rules:
+        row = []
+        ws = []
+        for fn in (getattr(optim, name), getattr(optim, name + '_inplace')):
+            rng = np.random.RandomState(0)
+            state = [rng.randn(*shape).astype(dtype), {}]
+            dw = 1e-3 * rng.randn(*shape).astype(dtype)
+            def step():
+                state[0], state[1] = fn(state[0], dw, state[1])
+            step()
+            row.append(_best_time(step, num_repeats))
+            tracemalloc.start()
+            start = tracemalloc.get_traced_memory()[0]
+            step()
+            row.append((tracemalloc.get_traced_memory()[1] - start) / 2**20)
+            tracemalloc.stop()
+            ws.append(state[0])
+        print('{:<22}  {:>8.1f}  {:>8.1f}  {:>10.1f}  {:>8.1f}  {:>8.1e}'.format(
+              name, *(row + [np.max(np.abs(ws[0] - ws[1]))])))
+
+
+def optimizer_state_report(models, rules):
+    """
+    Prints the optimizer state each update rule keeps for each model, in MB
+    and as a multiple of the parameter memory. The state is measured after
+    two updates with random gradients in the dtype of the current weights,
+    as a model's backward pass would produce, so that dtype promotions are
+    included: adam turns float32 weights, and with them the gradients and
+    its state, into float64.
+
+    Inputs:
+    - models: List of (name, model) pairs
+    - rules: List of (name, update rule name, optim_config) triples
+    """
+    print('{:<28}'.format('model') + ''.join('{:>16}'.format(name)
+                                            for name, _, _ in rules))
+    for model_name, model in models:
+        param_bytes = sum(w.nbytes for w in model.params.values())
+        row = '{:<28}'.format('%s (%.1f MB)' % (model_name, param_bytes / 2**20))
+        for _, rule, optim_config in rules:
+            update = getattr(optim, rule)
+            rng = np.random.RandomState(0)
+            state_bytes = 0
+            for w in model.params.values():
+                config = dict(optim_config)
+                dw = 1e-3 * rng.randn(*w.shape).astype(w.dtype)
+                next_w, config = update(w.copy(), dw, config)
+                next_w, config = update(next_w, dw.astype(next_w.dtype), config)
+                state_bytes += sum(v.nbytes for v in config.values()
+                                   if isinstance(v, np.ndarray))
+            row += '{:>9.1f} {:>5.2f}x'.format(state_bytes / 2**20,
+                                              state_bytes / param_bytes)
+        print(row)
+
+
+class _TimedSolver(Solver):
+    """
+    A Solver that records the wall-clock time of every validation check.
+    """
+
+    def check_accuracy(self, X, y, num_samples=None, batch_size=100):
+        acc = Solver.check_accuracy(self, X, y, num_samples, batch_size)
+        if X is self.X_val:
+            self.val_times.append(time.time() - self.start_time)
+        return acc
+
+
+def large_batch_report(model_fn, data, batch_sizes, settings, target_acc,
+                       num_epochs=10, base_batch_size=128):
+    """
+    Time-to-accuracy of several update rules across batch sizes. Every
+    learning rate of a setting is scaled by sqrt(batch_size / base_batch_size)
+    and tried in turn; prints, for each batch size and setting, the shortest
+    wall-clock time until the validation accuracy at the end of an epoch
+    reached target_acc, with the learning rate that achieved it, or the best
+    accuracy reached if none did.
+
+    Inputs:
+    - model_fn: Function with no arguments returning a fresh model
+    - data: Data dictionary as passed to Solver
+    - batch_sizes: List of batch sizes
+    - settings: List of (name, update rule name, optim_config, learning rates)
+      tuples. A 'warmup_epochs' entry of optim_config is converted to the
+      rule's warmup_steps for each batch size.
+    - target_acc: Validation accuracy to reach
+    - num_epochs: Epochs per run
+
+    Returns a dictionary mapping (name, batch_size) to the time in seconds,
+    or None if the target was not reached.
+    """
+    num_train = data['X_train'].shape[0]
+    results = {}
+    print('batch  ' + ''.join('{:>22}'.format(name) for name, _, _, _ in settings))
+    for batch_size in batch_sizes:
+        row = '{:>5}  '.format(batch_size)
+        for name, update_rule, optim_config, learning_rates in settings:
+            best_time, best_lr, best_acc = None, None, 0.0
+            for learning_rate in learning_rates:
+                config = dict(optim_config)
+                warmup_epochs = config.pop('warmup_epochs', 0)
+                if warmup_epochs:
+                    iterations_per_epoch = max(num_train // batch_size, 1)
+                    config['warmup_steps'] = int(round(warmup_epochs * iterations_per_epoch))
+                config['learning_rate'] = (learning_rate *
+                                           np.sqrt(batch_size / base_batch_size))
+                np.random.seed(0)
+                solver = _TimedSolver(model_fn(), data, update_rule=update_rule,
+                                      optim_config=config, batch_size=batch_size,
+                                      num_epochs=num_epochs, verbose=False)
+                solver.val_times = []
+                solver.start_time = time.time()
+                solver.train()
+                best_acc = max(best_acc, max(solver.val_acc_history))
+                for acc, elapsed in zip(solver.val_acc_history, solver.val_times):
+                    if acc >= target_acc:
+                        if best_time is None or elapsed < best_time:
+                            best_time, best_lr = elapsed, learning_rate
+                        break
+            results[(name, batch_size)] = best_time
+            if best_time is None:
+                row += '{:>22}'.format('- (best %.3f)' % best_acc)
+            else:
+                row += '{:>22}'.format('%.1fs (lr %g)' % (best_time, best_lr))
+        print(row)
+    return results
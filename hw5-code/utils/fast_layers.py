@@ -1,4 +1,10 @@
 from __future__ import print_function
+from collections import OrderedDict
+import json
+import os
+import tempfile
+import time
+
 import numpy as np
 try:
     from utils.im2col_cython import col2im_cython, im2col_cython
@@ -8,6 +14,29 @@ except ImportError:
     print('python setup.py build_ext --inplace')
     print('You may also need to restart your iPython kernel')
 
+try:
+    from utils.im2col_cython import im2col_cython_parallel, col2im_cython_parallel
+    from utils.im2col_cython import col2im_6d_cython_parallel
+    from utils.im2col_cython import col2im_nhwc_cython
+    from utils.im2col_cython import max_pool_forward_cython, max_pool_backward_cython
+    from utils.im2col_cython import set_num_threads, get_num_threads
+except ImportError:
+    # Extension built before the multithreaded kernels were added
+    im2col_cython_parallel = im2col_cython
+    col2im_cython_parallel = col2im_cython
+    col2im_nhwc_cython = None
+    max_pool_forward_cython = max_pool_backward_cython = None
+
+    def col2im_6d_cython_parallel(cols, N, C, H, W, HH, WW, pad, stride,
+                                  x_padded=None):
+        return col2im_6d_cython(cols, N, C, H, W, HH, WW, pad, stride)
+
+    def set_num_threads(num_threads):
+        print('rebuild utils/im2col_cython to use multiple threads')
+
+    def get_num_threads():
+        return 1
+
 from utils.im2col import *
 
 
@@ -18,7 +47,7 @@ def conv_forward_im2col(x, w, b, conv_param):
     """
     N, C, H, W = x.shape
     num_filters, _, filter_height, filter_width = w.shape
-    stride, pad = conv_param['stride'], conv_param['pad']
+    stride, pad = conv_param['stride'], int(conv_param['pad'])
 
     # Check dimensions
     assert (W + 2 * pad - filter_width) % stride == 0, 'width does not work'
@@ -30,7 +59,7 @@ def conv_forward_im2col(x, w, b, conv_param):
     out = np.zeros((N, num_filters, out_height, out_width), dtype=x.dtype)
 
     # x_cols = im2col_indices(x, w.shape[2], w.shape[3], pad, stride)
-    x_cols = im2col_cython(x, w.shape[2], w.shape[3], pad, stride)
+    x_cols = im2col_cython_parallel(x, w.shape[2], w.shape[3], pad, stride)
     res = w.reshape((w.shape[0], -1)).dot(x_cols) + b.reshape(-1, 1)
 
     out = res.reshape(w.shape[0], out.shape[2], out.shape[3], x.shape[0])
@@ -40,18 +69,92 @@ def conv_forward_im2col(x, w, b, conv_param):
     return out, cache
 
 
-def conv_forward_strides(x, w, b, conv_param):
-    N, C, H, W = x.shape
-    F, _, HH, WW = w.shape
-    stride, pad = conv_param['stride'], conv_param['pad']
+class ConvWorkspace(object):
+    """
+    Reusable scratch buffers for one convolutional layer.
 
-    # Check dimensions
-    #assert (W + 2 * pad - WW) % stride == 0, 'width does not work'
-    #assert (H + 2 * pad - HH) % stride == 0, 'height does not work'
+    Passing a workspace as conv_param['workspace'] makes conv_forward_strides
+    and conv_backward_strides write the padded input, the im2col columns,
+    the GEMM output and the backward temporaries into buffers kept here
+    instead of allocating them on every call. Buffers are keyed by name,
+    shape and dtype, so a Solver replaying the same minibatch shape reuses
+    them on every iteration. Once their total size exceeds max_bytes, the
+    least recently used ones are dropped.
+
+    The column matrix stored in the forward cache is one of these buffers,
+    so a workspace must only be shared by calls whose backward pass runs
+    before the next forward pass, i.e. one workspace per layer. Copying or
+    pickling a workspace (e.g. with the model) gives an empty one.
+    """
+
+    def __init__(self, max_bytes=512 * 2 ** 20):
+        """
+        Inputs:
+        - max_bytes: Upper bound on the total size of the retained buffers.
+        """
+        self.max_bytes = max_bytes
+        self.clear()
+
+    def clear(self):
+        """
+        Releases all buffers.
+        """
+        self.buffers = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, shape, dtype, zero=False):
+        """
+        Returns the buffer stored under (key, shape, dtype), allocating it on
+        a miss. Newly allocated buffers are zeroed if zero is True; reused
+        buffers keep their previous contents.
+        """
+        full_key = (key, tuple(int(d) for d in shape), np.dtype(dtype))
+        buf = self.buffers.pop(full_key, None)
+        if buf is not None:
+            self.hits += 1
+            self.buffers[full_key] = buf
+            return buf
+
+        self.misses += 1
+        buf = np.zeros(full_key[1], dtype) if zero else np.empty(full_key[1], dtype)
+        if buf.nbytes <= self.max_bytes:
+            self.buffers[full_key] = buf
+            self.nbytes += buf.nbytes
+            while self.nbytes > self.max_bytes:
+                _, old = self.buffers.popitem(last=False)
+                self.nbytes -= old.nbytes
+        return buf
+
+    def __getstate__(self):
+        return {'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def im2col_strides(x, HH, WW, pad, stride, workspace=None):
+    """
+    An im2col over a padded copy of x that works by picking clever strides.
+    With a ConvWorkspace, the padded copy and the columns are written into
+    its buffers.
+
+    Returns a tuple of:
+    - x_cols: Array of shape (C * HH * WW, N * out_h * out_w)
+    - out_h, out_w: Spatial size of the convolution output
+    """
+    N, C, H, W = x.shape
 
-    # Pad the input
+    # Pad the input; a reused padded buffer keeps its zero border, so only
+    # the interior is rewritten
     p = int(pad)
-    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+    if workspace is None:
+        x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+    else:
+        x_padded = workspace.get(('x_padded', p), (N, C, H + 2 * p, W + 2 * p),
+                                 x.dtype, zero=True)
+        x_padded[:, :, p:p + H, p:p + W] = x
 
     # Figure out output dimensions
     H += 2 * pad
@@ -67,80 +170,1146 @@ def conv_forward_strides(x, w, b, conv_param):
     strides = [int(x_) for x_ in strides]
     x_stride = np.lib.stride_tricks.as_strided(x_padded,
                   shape=shape, strides=strides)
-    x_cols = np.ascontiguousarray(x_stride)
-    x_cols.shape = (int(C * HH * WW), int(N * out_h * out_w))
+    if workspace is None:
+        x_cols = np.ascontiguousarray(x_stride)
+    else:
+        x_cols = workspace.get('x_cols', shape, x.dtype)
+        np.copyto(x_cols, x_stride)
+    x_cols = x_cols.reshape(int(C * HH * WW), int(N * out_h * out_w))
+    return x_cols, int(out_h), int(out_w)
+
+
+def conv_forward_strides(x, w, b, conv_param):
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+
+    # Check dimensions
+    #assert (W + 2 * pad - WW) % stride == 0, 'width does not work'
+    #assert (H + 2 * pad - HH) % stride == 0, 'height does not work'
+
+    workspace = conv_param.get('workspace')
+    x_cols, out_h, out_w = im2col_strides(x, HH, WW, pad, stride, workspace)
 
     # Now all our convolutions are a big matrix multiply
-    res = w.reshape(F, -1).dot(x_cols) + b.reshape(-1, 1)
+    w_mat = w.reshape(F, -1)
+    if workspace is None:
+        res = w_mat.dot(x_cols)
+    else:
+        res = workspace.get('res', (F, x_cols.shape[1]),
+                            np.result_type(w_mat, x_cols))
+        np.dot(w_mat, x_cols, out=res)
+    res += b.reshape(-1, 1)
 
     # Reshape the output
-    res.shape = (F, N, int(out_h), int(out_w))
+    res = res.reshape(F, N, int(out_h), int(out_w))
     out = res.transpose(1, 0, 2, 3)
 
     # Be nice and return a contiguous array
     # The old version of conv_forward_fast doesn't do this, so for a fair
-    # comparison we won't either
-    out = np.ascontiguousarray(out)
+    # comparison we won't either. With mixed precision, float16 inputs give
+    # float16 activations even though the weights, and therefore the matrix
+    # multiply, are float32.
+    out_dtype = np.float16 if x.dtype == np.float16 else res.dtype
+    if workspace is None:
+        out = np.ascontiguousarray(out, dtype=out_dtype)
+    else:
+        # With N == 1 or F == 1 the transpose is already contiguous, and
+        # ascontiguousarray would hand back the workspace buffer itself for
+        # the next call to overwrite
+        out = np.array(out, dtype=out_dtype, copy=True)
 
     cache = (x, w, b, conv_param, x_cols)
     return out, cache
 
 
-def conv_backward_strides(dout, cache):
+def conv_forward_inference(x, w, b, conv_param):
+    """
+    A forward-only convolution for test time. Uses the same strided im2col as
+    conv_forward_strides but keeps no cache, and releases the column matrix
+    as soon as the matrix multiply has consumed it.
+
+    Returns:
+    - out: Output data, of shape (N, F, H', W'), or (N, H', W', F) for
+      conv_param['layout'] == 'NHWC'
+    """
+    N = x.shape[0]
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+
+    if conv_param.get('layout', 'NCHW') == 'NHWC':
+        x_cols, out_h, out_w = im2col_nhwc(x, HH, WW, pad, stride)
+        res = x_cols.dot(_nhwc_filters(w))
+        del x_cols
+        res += b
+        res.shape = (N, out_h, out_w, F)
+        return res.astype(np.float16) if x.dtype == np.float16 else res
+
+    x_cols, out_h, out_w = im2col_strides(x, HH, WW, pad, stride)
+    res = w.reshape(F, -1).dot(x_cols)
+    del x_cols
+    res += b.reshape(-1, 1)
+
+    res.shape = (F, N, out_h, out_w)
+    out_dtype = np.float16 if x.dtype == np.float16 else res.dtype
+    return np.ascontiguousarray(res.transpose(1, 0, 2, 3), dtype=out_dtype)
+
+
+def conv_backward_strides(dout, cache, requires_grad=(True, True, True)):
     x, w, b, conv_param, x_cols = cache
+    need_dx, need_dw, need_db = requires_grad
     stride, pad = conv_param['stride'], conv_param['pad']
 
     N, C, H, W = x.shape
     F, _, HH, WW = w.shape
     _, _, out_h, out_w = dout.shape
 
-    db = np.sum(dout, axis=(0, 2, 3))
+    # numpy has no BLAS path for float16, so the matrix multiplies and the
+    # col2im run in float32; only dx is stored in the (float16) dtype of x
+    if dout.dtype == np.float16:
+        dout = dout.astype(np.float32)
 
-    dout_reshaped = dout.transpose(1, 0, 2, 3).reshape(F, -1)
-    dw = dout_reshaped.dot(x_cols.T).reshape(w.shape)
+    db = np.sum(dout, axis=(0, 2, 3)) if need_db else None
+    if not (need_dx or need_dw):
+        return None, None, db
 
-    dx_cols = w.reshape(F, -1).T.dot(dout_reshaped)
-    dx_cols.shape = (C, HH, WW, N, out_h, out_w)
-    dx = col2im_6d_cython(dx_cols, N, C, H, W, HH, WW, pad, stride)
+    workspace = conv_param.get('workspace')
+    if workspace is None:
+        dout_reshaped = dout.transpose(1, 0, 2, 3).reshape(F, -1)
+    else:
+        dout_reshaped = workspace.get('dout', (F, N, out_h, out_w), dout.dtype)
+        np.copyto(dout_reshaped, dout.transpose(1, 0, 2, 3))
+        dout_reshaped = dout_reshaped.reshape(F, -1)
+    dw = dout_reshaped.dot(x_cols.T).reshape(w.shape) if need_dw else None
+
+    # The col2im is the most expensive part, and the input gradient of the
+    # first layer is usually not needed
+    if not need_dx:
+        return None, dw, db
+
+    w_mat_t = w.reshape(F, -1).T
+    if workspace is None:
+        dx_cols = w_mat_t.dot(dout_reshaped)
+        dx_padded = None
+    else:
+        dx_cols = workspace.get('dx_cols', (C * HH * WW, N * out_h * out_w),
+                                np.result_type(w_mat_t, dout_reshaped))
+        np.dot(w_mat_t, dout_reshaped, out=dx_cols)
+        p = int(pad)
+        dx_padded = workspace.get(('dx_padded', p), (N, C, H + 2 * p, W + 2 * p),
+                                  dx_cols.dtype)
+        dx_padded.fill(0)
+    dx_cols = dx_cols.reshape(C, HH, WW, N, out_h, out_w)
+    dx = col2im_6d_cython_parallel(dx_cols, N, C, H, W, HH, WW, pad, stride,
+                                   dx_padded)
+    if x.dtype == np.float16:
+        dx = dx.astype(np.float16)
+    elif dx_padded is not None:
+        # dx must not alias the workspace
+        dx = np.array(dx)
 
     return dx, dw, db
 
 
-def conv_backward_im2col(dout, cache):
+# Default memory budget, in bytes, for the column matrix of one batch slice
+# in conv_forward_chunked.
+CHUNK_MEMORY_BUDGET = 64 * 2 ** 20
+
+
+def _chunk_size(x, w, conv_param):
+    """
+    Number of images per slice so that one slice's im2col columns fit in
+    conv_param['memory_budget'] (default CHUNK_MEMORY_BUDGET) bytes.
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], int(conv_param['pad'])
+    out_h = (H + 2 * pad - HH) // stride + 1
+    out_w = (W + 2 * pad - WW) // stride + 1
+    bytes_per_image = C * HH * WW * out_h * out_w * x.itemsize
+    budget = conv_param.get('memory_budget', CHUNK_MEMORY_BUDGET)
+    return int(min(N, max(1, budget // bytes_per_image)))
+
+
+def conv_forward_chunked(x, w, b, conv_param):
+    """
+    A convolution forward pass that runs the strided im2col and the GEMM on
+    slices of the minibatch, sized so that each slice's column matrix fits
+    in conv_param['memory_budget'] bytes. The columns are not cached; the
+    backward pass recomputes them slice by slice, so peak memory is bounded
+    by the budget rather than growing with the batch size.
+
+    Inputs and outputs are as for conv_forward_strides, except that the
+    cache is (x, w, b, conv_param). A ConvWorkspace in conv_param['workspace']
+    is used for the per-slice buffers.
+    """
+    N = x.shape[0]
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    workspace = conv_param.get('workspace')
+    chunk = _chunk_size(x, w, conv_param)
+    w_mat = w.reshape(F, -1)
+
+    out = None
+    for start in range(0, N, chunk):
+        x_chunk = x[start:start + chunk]
+        n = x_chunk.shape[0]
+        x_cols, out_h, out_w = im2col_strides(x_chunk, HH, WW, pad, stride,
+                                              workspace)
+        res = w_mat.dot(x_cols)
+        res += b.reshape(-1, 1)
+        if out is None:
+            out_dtype = np.float16 if x.dtype == np.float16 else res.dtype
+            out = np.empty((N, F, out_h, out_w), dtype=out_dtype)
+        out[start:start + n] = res.reshape(F, n, out_h, out_w).transpose(1, 0, 2, 3)
+
+    cache = (x, w, b, conv_param)
+    return out, cache
+
+
+def conv_backward_chunked(dout, cache, requires_grad=(True, True, True)):
+    """
+    Backward pass for conv_forward_chunked, recomputing the im2col columns
+    of one batch slice at a time.
+    """
+    x, w, b, conv_param = cache
+    need_dx, need_dw, need_db = requires_grad
+    stride, pad = conv_param['stride'], conv_param['pad']
+    workspace = conv_param.get('workspace')
+
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    _, _, out_h, out_w = dout.shape
+    chunk = _chunk_size(x, w, conv_param)
+
+    # As in conv_backward_strides, float16 gradients are multiplied in float32
+    if dout.dtype == np.float16:
+        dout = dout.astype(np.float32)
+
+    db = np.sum(dout, axis=(0, 2, 3)) if need_db else None
+    dw = np.zeros((F, C * HH * WW), dtype=np.result_type(dout, w)) if need_dw else None
+    dx = np.empty(x.shape, dtype=x.dtype) if need_dx else None
+    w_mat_t = w.reshape(F, -1).T
+
+    for start in range(0, N, chunk):
+        if not (need_dx or need_dw):
+            break
+        n = x[start:start + chunk].shape[0]
+        dout_reshaped = dout[start:start + n].transpose(1, 0, 2, 3).reshape(F, -1)
+        if need_dw:
+            x_cols, _, _ = im2col_strides(x[start:start + n], HH, WW, pad, stride,
+                                          workspace)
+            dw += dout_reshaped.dot(x_cols.T)
+
+        if need_dx:
+            dx_cols = w_mat_t.dot(dout_reshaped)
+            dx_cols.shape = (C, HH, WW, n, out_h, out_w)
+            dx[start:start + n] = col2im_6d_cython_parallel(dx_cols, n, C, H, W,
+                                                            HH, WW, pad, stride)
+
+    if need_dw:
+        dw = dw.reshape(w.shape)
+    return dx, dw, db
+
+
+def conv_backward_im2col(dout, cache, requires_grad=(True, True, True)):
     """
     A fast implementation of the backward pass for a convolutional layer
     based on im2col and col2im.
     """
     x, w, b, conv_param, x_cols = cache
-    stride, pad = conv_param['stride'], conv_param['pad']
+    stride, pad = conv_param['stride'], int(conv_param['pad'])
+    need_dx, need_dw, need_db = requires_grad
 
-    db = np.sum(dout, axis=(0, 2, 3))
+    db = np.sum(dout, axis=(0, 2, 3)) if need_db else None
 
     num_filters, _, filter_height, filter_width = w.shape
     dout_reshaped = dout.transpose(1, 2, 3, 0).reshape(num_filters, -1)
-    dw = dout_reshaped.dot(x_cols.T).reshape(w.shape)
+    dw = dout_reshaped.dot(x_cols.T).reshape(w.shape) if need_dw else None
+    if not need_dx:
+        return None, dw, db
 
     dx_cols = w.reshape(num_filters, -1).T.dot(dout_reshaped)
     # dx = col2im_indices(dx_cols, x.shape, filter_height, filter_width, pad, stride)
-    dx = col2im_cython(dx_cols, x.shape[0], x.shape[1], x.shape[2], x.shape[3],
-                       filter_height, filter_width, pad, stride)
+    dx = col2im_cython_parallel(dx_cols, x.shape[0], x.shape[1], x.shape[2],
+                                x.shape[3], filter_height, filter_width, pad,
+                                stride)
+
+    return dx, dw, db
+
+
+def im2col_nhwc(x, HH, WW, pad, stride):
+    """
+    The channels-last counterpart of im2col_strides, for x of shape
+    (N, H, W, C). Each row of the result holds one receptive field in
+    (HH, WW, C) order; since C is innermost in both x and the rows, the copy
+    reads whole contiguous runs of channels.
+
+    Returns a tuple of:
+    - x_cols: Array of shape (N * out_h * out_w, HH * WW * C)
+    - out_h, out_w: Spatial size of the convolution output
+    """
+    N, H, W, C = x.shape
+    p = int(pad)
+    x_padded = np.pad(x, ((0, 0), (p, p), (p, p), (0, 0)), mode='constant')
+
+    out_h = (H + 2 * p - HH) // stride + 1
+    out_w = (W + 2 * p - WW) // stride + 1
+
+    s = x_padded.strides
+    x_stride = np.lib.stride_tricks.as_strided(
+        x_padded, shape=(N, out_h, out_w, HH, WW, C),
+        strides=(s[0], stride * s[1], stride * s[2], s[1], s[2], s[3]))
+    x_cols = np.ascontiguousarray(x_stride)
+    x_cols.shape = (N * out_h * out_w, HH * WW * C)
+    return x_cols, out_h, out_w
+
+
+def _nhwc_filters(w):
+    """
+    Filters of shape (F, C, HH, WW) as an (HH * WW * C, F) matrix matching
+    the rows of im2col_nhwc. Weights keep the same shape in either layout.
+    """
+    F = w.shape[0]
+    return w.transpose(2, 3, 1, 0).reshape(-1, F)
+
+
+def conv_forward_nhwc(x, w, b, conv_param):
+    """
+    Forward pass for a convolutional layer on channels-last data.
+
+    Inputs:
+    - x: Input data of shape (N, H, W, C)
+    - w: Filter weights of shape (F, C, HH, WW), as for the NCHW layers
+    - b: Biases, of shape (F,)
+    - conv_param: As for conv_forward_strides
+
+    Returns a tuple of:
+    - out: Output data, of shape (N, H', W', F). The matrix multiply yields
+      this layout directly, so no transpose is needed.
+    - cache: (x, w, b, conv_param, x_cols)
+    """
+    N = x.shape[0]
+    F, _, HH, WW = w.shape
+    x_cols, out_h, out_w = im2col_nhwc(x, HH, WW, conv_param['pad'],
+                                       conv_param['stride'])
+
+    res = x_cols.dot(_nhwc_filters(w))
+    res += b
+    res.shape = (N, out_h, out_w, F)
+    if x.dtype == np.float16:
+        res = res.astype(np.float16)
+
+    cache = (x, w, b, conv_param, x_cols)
+    return res, cache
+
+
+def conv_backward_nhwc(dout, cache, requires_grad=(True, True, True)):
+    """
+    Backward pass for a convolutional layer on channels-last data.
+
+    Inputs:
+    - dout: Upstream derivatives, of shape (N, H', W', F)
+    - cache: As returned by conv_forward_nhwc
+    - requires_grad: Which of dx, dw and db to compute, as for
+      conv_backward_auto
+
+    Returns a tuple of:
+    - dx: Gradient with respect to x, of shape (N, H, W, C)
+    - dw: Gradient with respect to w, of shape (F, C, HH, WW)
+    - db: Gradient with respect to b, of shape (F,)
+    """
+    x, w, b, conv_param, x_cols = cache
+    stride, pad = conv_param['stride'], int(conv_param['pad'])
+    N, H, W, C = x.shape
+    F, _, HH, WW = w.shape
+    _, out_h, out_w, _ = dout.shape
+
+    # As in conv_backward_strides, float16 gradients are multiplied in float32
+    if dout.dtype == np.float16:
+        dout = dout.astype(np.float32)
+
+    need_dx, need_dw, need_db = requires_grad
+    dout_reshaped = dout.reshape(-1, F)
+    db = np.sum(dout_reshaped, axis=0) if need_db else None
+    dw = None
+    if need_dw:
+        dw = x_cols.T.dot(dout_reshaped).reshape(HH, WW, C, F).transpose(3, 2, 0, 1)
+        dw = np.ascontiguousarray(dw)
+    if not need_dx:
+        return None, dw, db
+
+    dx_cols = dout_reshaped.dot(_nhwc_filters(w).T)
+    dx_cols.shape = (N, out_h, out_w, HH, WW, C)
+    if col2im_nhwc_cython is not None:
+        dx = col2im_nhwc_cython(dx_cols, N, H, W, C, pad, stride)
+    else:
+        dx = np.zeros((N, H + 2 * pad, W + 2 * pad, C), dtype=dx_cols.dtype)
+        for i in range(HH):
+            for j in range(WW):
+                dx[:, i:i + stride * out_h:stride,
+                   j:j + stride * out_w:stride] += dx_cols[:, :, :, i, j]
+        dx = dx[:, pad:pad + H, pad:pad + W]
+    dx = np.ascontiguousarray(dx)
+    if x.dtype == np.float16:
+        dx = dx.astype(np.float16)
 
     return dx, dw, db
 
 
-conv_forward_fast = conv_forward_strides
-conv_backward_fast = conv_backward_strides
+# Transform matrices of the Winograd minimal filtering algorithm F(2x2, 3x3)
+# (Lavin & Gray, 2015): a 2x2 output tile Y of a 3x3 filter g over a 4x4
+# input tile d is Y = A^T [(G g G^T) * (B^T d B)] A.
+WINOGRAD_BT = np.array([[1, 0, -1, 0],
+                        [0, 1, 1, 0],
+                        [0, -1, 1, 0],
+                        [0, 1, 0, -1]], dtype=np.float64)
+WINOGRAD_G = np.array([[1, 0, 0],
+                       [0.5, 0.5, 0.5],
+                       [0.5, -0.5, 0.5],
+                       [0, 0, 1]], dtype=np.float64)
+WINOGRAD_AT = np.array([[1, 1, 1, 0],
+                        [0, 1, -1, -1]], dtype=np.float64)
+
+# Below this many input channels the tile transforms cost more than the
+# multiplies they save, and conv_forward_strides is faster.
+WINOGRAD_MIN_CHANNELS = 16
+
+
+def winograd_applicable(x, w, conv_param):
+    """
+    Whether conv_forward_winograd can be used for this layer: 3x3 filters,
+    stride 1 and a float32 or float64 input.
+    """
+    HH, WW = w.shape[2], w.shape[3]
+    return (HH == 3 and WW == 3 and conv_param['stride'] == 1 and
+            x.dtype in (np.float32, np.float64))
+
+
+def _winograd_matrices(dtype):
+    """
+    The 2-D transforms as Kronecker products, so that for a tile flattened in
+    row-major order, vec(T X T^T) = kron(T, T) vec(X).
+    """
+    BT = np.kron(WINOGRAD_BT, WINOGRAD_BT).astype(dtype)
+    G = np.kron(WINOGRAD_G, WINOGRAD_G).astype(dtype)
+    AT = np.kron(WINOGRAD_AT, WINOGRAD_AT).astype(dtype)
+    return BT, G, AT
+
+
+def _winograd_tiles(xp, size, th, tw):
+    """
+    Strided view of shape (size, size, C, N, th, tw) over the padded input
+    xp of shape (C, N, H', W'); entry [i, j, c, n, r, s] is element (i, j)
+    of the tile whose top-left corner is at (2r, 2s).
+    """
+    s = xp.strides
+    C, N = xp.shape[:2]
+    return np.lib.stride_tricks.as_strided(
+        xp, shape=(size, size, C, N, th, tw),
+        strides=(s[2], s[3], s[0], s[1], 2 * s[2], 2 * s[3]))
+
+
+def conv_forward_winograd(x, w, b, conv_param):
+    """
+    A fast implementation of the forward pass for a stride-1 convolutional
+    layer with 3x3 filters, based on Winograd F(2x2, 3x3).
+
+    The padded input is cut into overlapping 4x4 tiles that each produce a
+    2x2 output tile. Once filters and tiles are transformed, the reduction
+    over input channels becomes 16 independent (F, C) x (C, tiles) matrix
+    multiplies, using 16 multiplies per output tile and channel instead of 36.
+
+    Inputs and outputs are as for conv_forward_strides; the cache is
+    (x, w, b, conv_param, V) where V holds the transformed input tiles.
+    """
+    N, C, H, W = x.shape
+    F = w.shape[0]
+    assert winograd_applicable(x, w, conv_param), 'Invalid conv params'
+    pad = int(conv_param['pad'])
+    BT, G, AT = _winograd_matrices(x.dtype)
+
+    out_h = H + 2 * pad - 2
+    out_w = W + 2 * pad - 2
+    th, tw = (out_h + 1) // 2, (out_w + 1) // 2
+
+    # Zero-pad, including any extra row / column needed to complete the last
+    # tile, with the channel axis first so that V is laid out as (C, tiles)
+    xp = np.zeros((C, N, 2 * th + 2, 2 * tw + 2), dtype=x.dtype)
+    xp[:, :, pad:pad + H, pad:pad + W] = x.transpose(1, 0, 2, 3)
+    d = np.ascontiguousarray(_winograd_tiles(xp, 4, th, tw)).reshape(16, -1)
+
+    V = BT.dot(d).reshape(16, C, -1)
+    U = G.dot(w.reshape(F * C, 9).T).reshape(16, F, C)
+    M = np.matmul(U, V)
+    Y = AT.dot(M.reshape(16, -1)).reshape(2, 2, F, N, th, tw)
+
+    out = Y.transpose(3, 2, 4, 0, 5, 1).reshape(N, F, 2 * th, 2 * tw)
+    out = np.ascontiguousarray(out[:, :, :out_h, :out_w])
+    out += b.reshape(1, -1, 1, 1)
+
+    cache = (x, w, b, conv_param, V)
+    return out, cache
+
+
+def conv_backward_winograd(dout, cache, requires_grad=(True, True, True)):
+    """
+    A fast implementation of the backward pass for a convolutional layer
+    based on Winograd F(2x2, 3x3), for caches from conv_forward_winograd.
+    """
+    x, w, b, conv_param, V = cache
+    need_dx, need_dw, need_db = requires_grad
+    N, C, H, W = x.shape
+    F = w.shape[0]
+    pad = int(conv_param['pad'])
+    BT, G, AT = _winograd_matrices(V.dtype)
+    _, _, out_h, out_w = dout.shape
+    th, tw = (out_h + 1) // 2, (out_w + 1) // 2
+
+    db = np.sum(dout, axis=(0, 2, 3)) if need_db else None
+    if not (need_dx or need_dw):
+        return None, None, db
+
+    # Y = A^T M A, so dM = A dY A^T
+    dY = np.zeros((F, N, 2 * th, 2 * tw), dtype=V.dtype)
+    dY[:, :, :out_h, :out_w] = dout.transpose(1, 0, 2, 3)
+    dY = dY.reshape(F, N, th, 2, tw, 2).transpose(3, 5, 0, 1, 2, 4)
+    dM = AT.T.dot(dY.reshape(4, -1)).reshape(16, F, -1)
+
+    # M = U V for each of the 16 tile positions; U = G g G^T, so dg = G^T dU G
+    dw = None
+    if need_dw:
+        dU = np.matmul(dM, V.transpose(0, 2, 1))
+        dw = G.T.dot(dU.reshape(16, -1)).T.reshape(w.shape)
+    if not need_dx:
+        return None, dw, db
+    U = G.dot(w.reshape(F * C, 9).T).reshape(16, F, C)
+    dV = np.matmul(U.transpose(0, 2, 1), dM)
+
+    # V = B^T d B, so dd = B dV B^T; overlapping tiles are then summed back
+    # into the padded input
+    dd = BT.T.dot(dV.reshape(16, -1)).reshape(4, 4, C, N, th, tw)
+    dxp = np.zeros((C, N, 2 * th + 2, 2 * tw + 2), dtype=V.dtype)
+    for i in range(4):
+        for j in range(4):
+            dxp[:, :, i:i + 2 * th:2, j:j + 2 * tw:2] += dd[i, j]
+    dx = dxp[:, :, pad:pad + H, pad:pad + W].transpose(1, 0, 2, 3)
+    dx = np.ascontiguousarray(dx)
+
+    return dx, dw, db
+
+
+# FFT convolution costs the same for any filter size, so it overtakes im2col
+# once each output pixel needs enough multiplies; see conv_fft_crossover in
+# utils/benchmarks.py.
+FFT_MIN_FILTER_VOLUME = 200
+
+
+def _fft_shape(H, W):
+    """
+    FFT sizes for an H x W padded input. Since a valid correlation over the
+    padded input never wraps around, no further padding is needed; the width
+    is rounded up to an even number so that irfft2 recovers it exactly.
+    """
+    return H, W + (W % 2)
+
+
+def conv_forward_fft(x, w, b, conv_param):
+    """
+    A fast implementation of the forward pass for a convolutional layer with
+    large filters, computed in the frequency domain with numpy.fft.rfft2.
+
+    The spectrum of each filter is computed once per call and shared by
+    every image of the minibatch. The channel reduction then happens
+    independently at every frequency as an (N, C) x (C, F) complex matrix
+    multiply, so the cost does not depend on the filter size. Strided
+    convolutions compute the stride-1 output and subsample it.
+
+    Inputs and outputs are as for conv_forward_strides; the cache is
+    (x, w, b, conv_param, x_hat, w_hat), where x_hat and w_hat hold the
+    spectra of the padded input and of the filters.
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], int(conv_param['pad'])
+
+    assert (W + 2 * pad - WW) % stride == 0, 'width does not work'
+    assert (H + 2 * pad - HH) % stride == 0, 'height does not work'
+    out_h = (H + 2 * pad - HH) // stride + 1
+    out_w = (W + 2 * pad - WW) // stride + 1
+
+    s = _fft_shape(H + 2 * pad, W + 2 * pad)
+    xp = np.zeros((N, C) + s, dtype=x.dtype)
+    xp[:, :, pad:pad + H, pad:pad + W] = x
+
+    # Frequencies first, so that each frequency is one matrix multiply
+    x_hat = np.fft.rfft2(xp).transpose(2, 3, 0, 1)
+    w_hat = np.fft.rfft2(w, s=s).transpose(2, 3, 1, 0)
+    del xp
+
+    # Cross-correlation is a product with the conjugate filter spectrum
+    out_hat = np.matmul(x_hat, w_hat.conj()).transpose(2, 3, 0, 1)
+    out = np.fft.irfft2(out_hat, s=s)
+    out = out[:, :, :(out_h - 1) * stride + 1:stride,
+              :(out_w - 1) * stride + 1:stride]
+    out = out.astype(x.dtype)
+    out += b.reshape(1, -1, 1, 1)
+
+    cache = (x, w, b, conv_param, x_hat, w_hat)
+    return out, cache
+
+
+def conv_backward_fft(dout, cache, requires_grad=(True, True, True)):
+    """
+    A fast implementation of the backward pass for a convolutional layer
+    computed in the frequency domain, for caches from conv_forward_fft.
+    """
+    x, w, b, conv_param, x_hat, w_hat = cache
+    need_dx, need_dw, need_db = requires_grad
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], int(conv_param['pad'])
+    _, _, out_h, out_w = dout.shape
+    s = _fft_shape(H + 2 * pad, W + 2 * pad)
+
+    db = np.sum(dout, axis=(0, 2, 3)) if need_db else None
+    if not (need_dx or need_dw):
+        return None, None, db
+
+    # Scatter dout onto the stride-1 output grid
+    dout_full = np.zeros((N, F) + s, dtype=dout.dtype)
+    dout_full[:, :, :(out_h - 1) * stride + 1:stride,
+              :(out_w - 1) * stride + 1:stride] = dout
+    dout_hat = np.fft.rfft2(dout_full).transpose(2, 3, 0, 1)
+    del dout_full
+
+    # The input gradient is a full convolution of dout with the filters, and
+    # the filter gradient a correlation of the input with dout
+    dx, dw = None, None
+    if need_dx:
+        dx_hat = np.matmul(dout_hat, w_hat.transpose(0, 1, 3, 2))
+        dx = np.fft.irfft2(dx_hat.transpose(2, 3, 0, 1), s=s)
+        dx = dx[:, :, pad:pad + H, pad:pad + W].astype(x.dtype)
+
+    if need_dw:
+        dw_hat = np.matmul(dout_hat.conj().transpose(0, 1, 3, 2), x_hat)
+        dw = np.fft.irfft2(dw_hat.transpose(2, 3, 0, 1), s=s)
+        dw = dw[:, :, :HH, :WW].astype(w.dtype)
+
+    return dx, dw, db
+
+
+def _groups(x, w, conv_param):
+    """
+    Number of groups of a grouped convolution, checked against the shapes.
+    With G groups, x has C channels and w has shape (F, C // G, HH, WW); the
+    filters of group g see only channels g * C // G to (g + 1) * C // G - 1.
+    """
+    G = conv_param.get('groups', 1)
+    C, F = x.shape[1], w.shape[0]
+    if C % G != 0 or F % G != 0 or w.shape[1] * G != C:
+        raise ValueError('Filters of shape %s do not split %d channels into %d groups'
+                         % (w.shape, C, G))
+    return G
+
+
+def conv_forward_grouped(x, w, b, conv_param):
+    """
+    Grouped convolution as one batched matrix multiply. The im2col columns
+    of x are ordered by channel, so the rows of each group are a contiguous
+    block and np.matmul multiplies every group's filters with its block.
+
+    Inputs:
+    - x: Input data of shape (N, C, H, W)
+    - w: Filter weights of shape (F, C // G, HH, WW)
+    - b: Biases, of shape (F,)
+    - conv_param: As for conv_forward_naive, plus 'groups' (G, default 1)
+
+    Returns a tuple of:
+    - out: Output data, of shape (N, F, H', W')
+    - cache: (x, w, b, conv_param, x_cols)
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], conv_param['pad']
+    G = _groups(x, w, conv_param)
+
+    x_cols, out_h, out_w = im2col_strides(x, HH, WW, pad, stride)
+    res = np.matmul(w.reshape(G, F // G, -1), x_cols.reshape(G, -1, x_cols.shape[1]))
+    res = res.reshape(F, -1)
+    res += b.reshape(-1, 1)
+
+    out = res.reshape(F, N, out_h, out_w).transpose(1, 0, 2, 3)
+    out_dtype = np.float16 if x.dtype == np.float16 else res.dtype
+    out = np.ascontiguousarray(out, dtype=out_dtype)
+    cache = (x, w, b, conv_param, x_cols)
+    return out, cache
+
+
+def conv_backward_grouped(dout, cache, requires_grad=(True, True, True)):
+    """
+    Backward pass for conv_forward_grouped.
+    """
+    x, w, b, conv_param, x_cols = cache
+    need_dx, need_dw, need_db = requires_grad
+    stride, pad = conv_param['stride'], conv_param['pad']
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    _, _, out_h, out_w = dout.shape
+    G = _groups(x, w, conv_param)
+
+    if dout.dtype == np.float16:
+        dout = dout.astype(np.float32)
+    db = np.sum(dout, axis=(0, 2, 3)) if need_db else None
+
+    dout_reshaped = dout.transpose(1, 0, 2, 3).reshape(G, F // G, -1)
+    dw = None
+    if need_dw:
+        cols = x_cols.reshape(G, -1, x_cols.shape[1])
+        dw = np.matmul(dout_reshaped, cols.transpose(0, 2, 1)).reshape(w.shape)
+    if not need_dx:
+        return None, dw, db
+
+    w_mat = w.reshape(G, F // G, -1)
+    dx_cols = np.matmul(w_mat.transpose(0, 2, 1), dout_reshaped)
+    dx_cols = dx_cols.reshape(C, HH, WW, N, out_h, out_w)
+    dx = col2im_6d_cython_parallel(dx_cols, N, C, H, W, HH, WW, pad, stride)
+    if x.dtype == np.float16:
+        dx = dx.astype(np.float16)
+    return dx, dw, db
+
+
+def conv_forward_depthwise(x, w, b, conv_param):
+    """
+    Depthwise convolution, i.e. a grouped convolution with one group per
+    input channel, so w has shape (C * K, 1, HH, WW) for a channel
+    multiplier K. Instead of an im2col, whose columns would be as large as
+    for a dense layer while each filter uses only one channel, the output is
+    accumulated over the HH * WW filter taps from strided views of the
+    padded input.
+
+    Returns a tuple of:
+    - out: Output data, of shape (N, C * K, H', W')
+    - cache: (x_padded, w, b, conv_param)
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], int(conv_param['pad'])
+    if conv_param.get('groups', 1) != C or w.shape[1] != 1 or F % C != 0:
+        raise ValueError('Depthwise convolution needs groups == C and w of shape (C * K, 1, HH, WW)')
+    K = F // C
+
+    x_padded = np.pad(x, ((0, 0), (0, 0), (pad, pad), (pad, pad)), mode='constant')
+    out_h = (H + 2 * pad - HH) // stride + 1
+    out_w = (W + 2 * pad - WW) // stride + 1
+    w_taps = w.reshape(C, K, HH, WW)
+
+    out_dtype = np.result_type(np.float32 if x.dtype == np.float16 else x.dtype, w.dtype)
+    out = np.zeros((N, C, K, out_h, out_w), dtype=out_dtype)
+    for i in range(HH):
+        for j in range(WW):
+            window = x_padded[:, :, i:i + stride * out_h:stride, j:j + stride * out_w:stride]
+            out += window[:, :, None] * w_taps[:, :, i, j][None, :, :, None, None]
+    out = out.reshape(N, F, out_h, out_w)
+    out += b.reshape(1, F, 1, 1)
+    if x.dtype == np.float16:
+        out = out.astype(np.float16)
+
+    cache = (x_padded, w, b, conv_param)
+    return out, cache
+
+
+def conv_backward_depthwise(dout, cache, requires_grad=(True, True, True)):
+    """
+    Backward pass for conv_forward_depthwise.
+    """
+    x_padded, w, b, conv_param = cache
+    need_dx, need_dw, need_db = requires_grad
+    stride, pad = conv_param['stride'], int(conv_param['pad'])
+    N, C, Hp, Wp = x_padded.shape
+    F, _, HH, WW = w.shape
+    _, _, out_h, out_w = dout.shape
+    K = F // C
+
+    if dout.dtype == np.float16:
+        dout = dout.astype(np.float32)
+    db = np.sum(dout, axis=(0, 2, 3)) if need_db else None
+
+    dout_k = dout.reshape(N, C, K, out_h, out_w)
+    w_taps = w.reshape(C, K, HH, WW)
+    grad_dtype = np.result_type(dout, w)
+    dw = np.zeros((C, K, HH, WW), dtype=grad_dtype) if need_dw else None
+    dx_padded = np.zeros((N, C, Hp, Wp), dtype=grad_dtype) if need_dx else None
+    for i in range(HH):
+        for j in range(WW):
+            if not (need_dx or need_dw):
+                break
+            rows = slice(i, i + stride * out_h, stride)
+            cols = slice(j, j + stride * out_w, stride)
+            window = x_padded[:, :, rows, cols]
+            if K == 1:
+                if need_dw:
+                    dw[:, 0, i, j] = np.einsum('nchw,nchw->c', dout, window)
+                if need_dx:
+                    dx_padded[:, :, rows, cols] += dout * w_taps[:, 0, i, j].reshape(1, C, 1, 1)
+            else:
+                if need_dw:
+                    dw[:, :, i, j] = np.einsum('nckhw,nchw->ck', dout_k, window)
+                if need_dx:
+                    dx_padded[:, :, rows, cols] += np.einsum('nckhw,ck->nchw', dout_k,
+                                                             w_taps[:, :, i, j])
+
+    dx = None
+    if need_dx:
+        dx = dx_padded[:, :, pad:Hp - pad, pad:Wp - pad]
+        dx = np.ascontiguousarray(dx, dtype=x_padded.dtype)
+    if need_dw:
+        dw = dw.reshape(w.shape)
+    return dx, dw, db
+
+
+def conv_forward_pointwise(x, w, b, conv_param):
+    """
+    Pointwise (1x1) convolution as one matrix multiply per image over the
+    channels of x, with no im2col. For stride 1 and no padding the columns
+    are x itself.
+
+    Returns a tuple of:
+    - out: Output data, of shape (N, F, H', W')
+    - cache: (x, w, b, conv_param, x_mat), where x_mat has shape
+      (N, C, H' * W')
+    """
+    N, C, H, W = x.shape
+    F, _, HH, WW = w.shape
+    stride, pad = conv_param['stride'], int(conv_param['pad'])
+    if HH != 1 or WW != 1 or conv_param.get('groups', 1) != 1:
+        raise ValueError('Pointwise convolution needs ungrouped 1x1 filters')
+
+    x_sub = x
+    if pad > 0:
+        x_sub = np.pad(x, ((0, 0), (0, 0), (pad, pad), (pad, pad)), mode='constant')
+    x_sub = x_sub[:, :, ::stride, ::stride]
+    out_h, out_w = x_sub.shape[2], x_sub.shape[3]
+    x_mat = np.ascontiguousarray(x_sub).reshape(N, C, -1)
+
+    out = np.matmul(w.reshape(F, C), x_mat)
+    out += b.reshape(1, F, 1)
+    out = out.reshape(N, F, out_h, out_w)
+    if x.dtype == np.float16:
+        out = out.astype(np.float16)
+
+    cache = (x, w, b, conv_param, x_mat)
+    return out, cache
+
+
+def conv_backward_pointwise(dout, cache, requires_grad=(True, True, True)):
+    """
+    Backward pass for conv_forward_pointwise.
+    """
+    x, w, b, conv_param, x_mat = cache
+    need_dx, need_dw, need_db = requires_grad
+    stride, pad = conv_param['stride'], int(conv_param['pad'])
+    N, C, H, W = x.shape
+    F = w.shape[0]
+    _, _, out_h, out_w = dout.shape
+
+    if dout.dtype == np.float16:
+        dout = dout.astype(np.float32)
+    db = np.sum(dout, axis=(0, 2, 3)) if need_db else None
+
+    dout_mat = dout.reshape(N, F, -1)
+    dw = None
+    if need_dw:
+        dw = np.tensordot(dout_mat, x_mat, axes=([0, 2], [0, 2])).reshape(w.shape)
+    if not need_dx:
+        return None, dw, db
+    dx_mat = np.matmul(w.reshape(F, C).T, dout_mat)
+
+    if stride == 1 and pad == 0:
+        dx = dx_mat.reshape(N, C, H, W)
+    else:
+        dx_padded = np.zeros((N, C, H + 2 * pad, W + 2 * pad), dtype=dx_mat.dtype)
+        dx_padded[:, :, ::stride, ::stride][:, :, :out_h, :out_w] = \
+            dx_mat.reshape(N, C, out_h, out_w)
+        dx = dx_padded[:, :, pad:pad + H, pad:pad + W]
+    dx = np.ascontiguousarray(dx, dtype=x.dtype)
+    return dx, dw, db
+
+
+# Forward / backward pairs that conv_forward_auto can dispatch to. Every
+# backward takes an optional requires_grad; see conv_backward_auto.
+CONV_METHODS = {
+    'strides': (conv_forward_strides, conv_backward_strides),
+    'im2col': (conv_forward_im2col, conv_backward_im2col),
+    'winograd': (conv_forward_winograd, conv_backward_winograd),
+    'fft': (conv_forward_fft, conv_backward_fft),
+    'nhwc': (conv_forward_nhwc, conv_backward_nhwc),
+    'chunked': (conv_forward_chunked, conv_backward_chunked),
+    'grouped': (conv_forward_grouped, conv_backward_grouped),
+    'depthwise': (conv_forward_depthwise, conv_backward_depthwise),
+    'pointwise': (conv_forward_pointwise, conv_backward_pointwise),
+}
+
+# Methods that implement conv_param['groups'] > 1
+GROUPED_METHODS = ('grouped', 'depthwise')
+
+
+def conv_method(x, w, conv_param):
+    """
+    Chooses the convolution method used by conv_forward_auto. Channels-last
+    layers (conv_param['layout'] == 'NHWC') always use 'nhwc'. Grouped
+    layers (conv_param['groups'] > 1) use 'depthwise' when there is one
+    group per input channel and 'grouped' otherwise, unless one of these is
+    given explicitly. Otherwise an explicit conv_param['method'] (a key of
+    CONV_METHODS) wins, then a ConvAutotuner given as
+    conv_param['autotuner'], or else
+    - 'pointwise' for 1x1 filters;
+    - 'winograd' for layers that qualify (see winograd_applicable) with at
+      least WINOGRAD_MIN_CHANNELS input channels;
+    - 'fft' for float32 / float64 layers whose filters span at least
+      FFT_MIN_FILTER_VOLUME weights (C * HH * WW);
+    - 'strides' otherwise.
+    """
+    groups = conv_param.get('groups', 1)
+    if conv_param.get('layout', 'NCHW') == 'NHWC':
+        if groups != 1:
+            raise ValueError('Grouped convolutions only support the NCHW layout')
+        return 'nhwc'
+    method = conv_param.get('method')
+    if groups != 1:
+        if method in GROUPED_METHODS:
+            return method
+        if conv_param.get('autotuner') is not None:
+            return conv_param['autotuner'].choose(x, w, conv_param)
+        return 'depthwise' if groups == x.shape[1] else 'grouped'
+    if method is not None:
+        return method
+    autotuner = conv_param.get('autotuner')
+    if autotuner is not None:
+        return autotuner.choose(x, w, conv_param)
+    F, C, HH, WW = w.shape
+    if HH == 1 and WW == 1:
+        return 'pointwise'
+    if C >= WINOGRAD_MIN_CHANNELS and winograd_applicable(x, w, conv_param):
+        return 'winograd'
+    if (C * HH * WW >= FFT_MIN_FILTER_VOLUME and
+            x.dtype in (np.float32, np.float64)):
+        return 'fft'
+    return 'strides'
+
+
+def conv_forward_auto(x, w, b, conv_param):
+    """
+    Convolution forward pass using the method picked by conv_method. The
+    method is recorded in the cache for conv_backward_auto.
+    """
+    method = conv_method(x, w, conv_param)
+    if method not in CONV_METHODS:
+        raise ValueError('Unrecognized method "%s"' % method)
+    out, real_cache = CONV_METHODS[method][0](x, w, b, conv_param)
+    cache = (method, real_cache)
+    return out, cache
+
+
+def conv_backward_auto(dout, cache, requires_grad=(True, True, True)):
+    """
+    Backward pass for conv_forward_auto.
+
+    requires_grad is a tuple of three booleans saying which of dx, dw and db
+    are needed, e.g. (False, True, True) for a first layer whose input
+    gradient would be discarded, or (True, False, False) for a frozen layer.
+    Gradients that are not needed are not computed and are returned as None.
+    """
+    method, real_cache = cache
+    if method not in CONV_METHODS:
+        raise ValueError('Unrecognized method "%s"' % method)
+    return CONV_METHODS[method][1](dout, real_cache, requires_grad)
+
+
+class ConvAutotuner(object):
+    """
+    Picks the fastest convolution method for each layer shape by measuring.
+
+    Passing an autotuner as conv_param['autotuner'] makes conv_method ask it
+    for the method whenever conv_param does not name one. The first time
+    the tuner sees a signature (N, C, H, W, F, HH, WW, stride, pad, groups,
+    dtype), it times a forward and backward pass of every applicable method
+    of CONV_METHODS on the actual inputs and keeps the fastest. Later calls
+    with the same signature dispatch straight to it. Decisions, together with
+    the measured times, are kept in memory and, if a path is given, in a
+    JSON file that is read back when a new tuner is created on it.
+
+    An explicit conv_param['method'] always wins over the tuner, so a
+    specific algorithm can still be forced per layer; force() does the same
+    for every layer with a given signature. 'chunked' is never picked, since
+    it trades speed for memory.
+    """
+
+    def __init__(self, path=None, num_repeats=3):
+        """
+        Inputs:
+        - path: Optional JSON file in which decisions are stored.
+        - num_repeats: Number of timed passes per candidate method; the best
+          one counts.
+        """
+        self.path = path
+        self.num_repeats = num_repeats
+        self.decisions = {}
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self.decisions = json.load(f)
+
+    @staticmethod
+    def signature(x, w, conv_param):
+        """
+        The string key under which decisions for this layer are stored.
+        """
+        N, C, H, W = x.shape
+        F, _, HH, WW = w.shape
+        fields = (N, C, H, W, F, HH, WW, conv_param['stride'],
+                  int(conv_param['pad']), conv_param.get('groups', 1),
+                  np.dtype(x.dtype).name)
+        return ','.join(str(f) for f in fields)
+
+    @staticmethod
+    def candidates(x, w, conv_param):
+        """
+        Names of the methods of CONV_METHODS that can run this layer.
+        """
+        C = x.shape[1]
+        groups = conv_param.get('groups', 1)
+        if groups != 1:
+            return ['grouped', 'depthwise'] if groups == C else ['grouped']
+        if x.dtype not in (np.float32, np.float64):
+            return ['strides']
+        methods = ['strides', 'im2col', 'fft']
+        if winograd_applicable(x, w, conv_param):
+            methods.append('winograd')
+        if w.shape[2] == 1 and w.shape[3] == 1:
+            methods.append('pointwise')
+        return methods
+
+    def choose(self, x, w, conv_param):
+        """
+        Returns the method to use for this layer, tuning it on first sight.
+        """
+        key = self.signature(x, w, conv_param)
+        if key not in self.decisions:
+            self.decisions[key] = self.tune(x, w, conv_param)
+            self.save()
+        return self.decisions[key]['method']
+
+    def tune(self, x, w, conv_param):
+        """
+        Times every candidate method on x and w and returns a decision
+        dictionary with the fastest 'method' and the 'times' in ms of all
+        methods that ran. If none of them ran, 'strides' ('grouped' for
+        grouped layers) is recorded with empty times.
+        """
+        b = np.zeros(w.shape[0], dtype=w.dtype)
+        times = {}
+        for method in self.candidates(x, w, conv_param):
+            param = dict(conv_param, method=method)
+            param.pop('autotuner', None)
+            forward, backward = CONV_METHODS[method]
+            try:
+                # One untimed pass to warm up caches and workspaces
+                out, cache = forward(x, w, b, param)
+                backward(out, cache)
+                best = float('inf')
+                for _ in range(self.num_repeats):
+                    tic = time.perf_counter()
+                    out, cache = forward(x, w, b, param)
+                    backward(out, cache)
+                    best = min(best, time.perf_counter() - tic)
+            except (AssertionError, ValueError, MemoryError):
+                # Shapes the method does not support
+                continue
+            times[method] = 1e3 * best
+        if not times:
+            grouped = conv_param.get('groups', 1) != 1
+            return {'method': 'grouped' if grouped else 'strides', 'times': {}}
+        method = min(times, key=times.get)
+        return {'method': method, 'times': times}
+
+    def force(self, x, w, conv_param, method):
+        """
+        Records method as the decision for this layer's signature without
+        measuring.
+        """
+        if method not in CONV_METHODS:
+            raise ValueError('Unrecognized method "%s"' % method)
+        key = self.signature(x, w, conv_param)
+        self.decisions[key] = {'method': method, 'times': {}}
+        self.save()
+
+    def save(self):
+        """
+        Writes the decisions to the JSON file, if there is one.
+        """
+        if self.path is None:
+            return
+        # Write to a private file next to the cache and rename it into place,
+        # so that concurrent tuners never interleave or read partial JSON
+        directory, name = os.path.split(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=name + '.', suffix='.tmp',
+                                        dir=directory, text=True)
+        try:
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.decisions, f, indent=2, sort_keys=True)
+            os.replace(tmp_path, self.path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def report(self):
+        """
+        Prints the chosen method and the measured times of every signature.
+        """
+        print('{:<40}  {:<9}  {}'.format(
+              'N,C,H,W,F,HH,WW,stride,pad,groups,dtype', 'method', 'times ms'))
+        for key in sorted(self.decisions):
+            decision = self.decisions[key]
+            times = ', '.join('%s %.1f' % (m, t) for m, t in
+                              sorted(decision['times'].items(), key=lambda mt: mt[1]))
+            print('{:<40}  {:<9}  {}'.format(key, decision['method'], times or 'forced'))
+
+
+# Tuner that conv_forward_fast consults for layers whose conv_param names
+# neither a method nor an autotuner. Its decisions are kept in memory only.
+default_autotuner = ConvAutotuner()
+
+
+def conv_forward_fast(x, w, b, conv_param):
+    """
+    conv_forward_auto with default_autotuner standing in for a missing
+    conv_param['autotuner'], so every layer shape runs on the fastest method
+    measured for it. Use conv_backward_fast for the backward pass.
+    """
+    if conv_param.get('autotuner') is None:
+        conv_param = dict(conv_param, autotuner=default_autotuner)
+    return conv_forward_auto(x, w, b, conv_param)
+
+
+conv_backward_fast = conv_backward_auto
 
 
 def max_pool_forward_fast(x, pool_param):
     """
     A fast implementation of the forward pass for a max pooling layer.
 
-    This chooses between the reshape method and the im2col method. If the pooling
-    regions are square and tile the input image, then we can use the reshape
-    method which is very fast. Otherwise we fall back on the im2col method, which
-    is not much faster than the naive method.
+    This chooses between the reshape method and the window method. If the
+    pooling regions are square and tile the input image, then we can use the
+    reshape method which is very fast. Otherwise we use max_pool_forward_window,
+    which handles any window and stride and caches only uint8 argmax offsets;
+    the im2col method remains as a last resort for windows of more than 256
+    elements. Channels-last inputs (pool_param['layout'] == 'NHWC') use
+    max_pool_forward_nhwc.
     """
+    if pool_param.get('layout', 'NCHW') == 'NHWC':
+        out, nhwc_cache = max_pool_forward_nhwc(x, pool_param)
+        return out, ('nhwc', nhwc_cache)
+
     N, C, H, W = x.shape
     pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
     stride = pool_param['stride']
@@ -150,6 +1319,9 @@ def max_pool_forward_fast(x, pool_param):
     if same_size and tiles:
         out, reshape_cache = max_pool_forward_reshape(x, pool_param)
         cache = ('reshape', reshape_cache)
+    elif pool_height * pool_width <= 256:
+        out, window_cache = max_pool_forward_window(x, pool_param)
+        cache = ('window', window_cache)
     else:
         out, im2col_cache = max_pool_forward_im2col(x, pool_param)
         cache = ('im2col', im2col_cache)
@@ -168,10 +1340,40 @@ def max_pool_backward_fast(dout, cache):
         return max_pool_backward_reshape(dout, real_cache)
     elif method == 'im2col':
         return max_pool_backward_im2col(dout, real_cache)
+    elif method == 'window':
+        return max_pool_backward_window(dout, real_cache)
+    elif method == 'nhwc':
+        return max_pool_backward_nhwc(dout, real_cache)
     else:
         raise ValueError('Unrecognized method "%s"' % method)
 
 
+def max_pool_forward_inference(x, pool_param):
+    """
+    A forward-only max pooling layer for test time that keeps no cache.
+
+    Uses the reshape method when the pooling regions tile the input and
+    otherwise falls back on the window method, discarding its argmax.
+    """
+    if pool_param.get('layout', 'NCHW') == 'NHWC':
+        return _max_pool_nhwc(x, pool_param)[0]
+
+    N, C, H, W = x.shape
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    stride = pool_param['stride']
+
+    same_size = pool_height == pool_width == stride
+    tiles = H % pool_height == 0 and W % pool_width == 0
+    if same_size and tiles:
+        x_reshaped = x.reshape(N, C, H // pool_height, pool_height,
+                               W // pool_width, pool_width)
+        return x_reshaped.max(axis=3).max(axis=4)
+    if pool_height * pool_width <= 256:
+        return max_pool_forward_window(x, pool_param)[0]
+    out, _ = max_pool_forward_im2col(x, pool_param)
+    return out
+
+
 def max_pool_forward_reshape(x, pool_param):
     """
     A fast implementation of the forward pass for the max pooling layer that uses
@@ -224,6 +1426,65 @@ def max_pool_backward_reshape(dout, cache):
     return dx
 
 
+def max_pool_forward_window(x, pool_param):
+    """
+    Max pooling for any window size and stride that caches, per output
+    element, only the uint8 offset i * pool_width + j of the maximum within
+    its window; windows may therefore hold at most 256 elements. Runs as a
+    Cython kernel for float32 / float64 inputs and otherwise through a
+    strided view of the windows.
+
+    Returns a tuple of:
+    - out: Output data, of shape (N, C, H', W')
+    - cache: (x.shape, argmax, pool_param)
+    """
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    stride = pool_param['stride']
+    assert pool_height * pool_width <= 256, 'Invalid pool params'
+
+    if (max_pool_forward_cython is not None and
+            x.dtype in (np.float32, np.float64)):
+        out, argmax = max_pool_forward_cython(x, pool_height, pool_width, stride)
+    else:
+        N, C, H, W = x.shape
+        out_h = (H - pool_height) // stride + 1
+        out_w = (W - pool_width) // stride + 1
+        s = x.strides
+        windows = np.lib.stride_tricks.as_strided(
+            x, shape=(N, C, out_h, out_w, pool_height, pool_width),
+            strides=(s[0], s[1], stride * s[2], stride * s[3], s[2], s[3]))
+        windows = windows.reshape(N, C, out_h, out_w, -1)
+        argmax = np.argmax(windows, axis=4).astype(np.uint8)
+        out = np.take_along_axis(windows, argmax[..., np.newaxis], axis=4)[..., 0]
+
+    cache = (x.shape, argmax, pool_param)
+    return out, cache
+
+
+def max_pool_backward_window(dout, cache):
+    """
+    Backward pass for max_pool_forward_window, scattering dout directly to
+    the cached argmax offsets. Ties go to the first maximum in each window.
+    """
+    x_shape, argmax, pool_param = cache
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    stride = pool_param['stride']
+    N, C, H, W = x_shape
+
+    if (max_pool_backward_cython is not None and
+            dout.dtype in (np.float32, np.float64)):
+        return max_pool_backward_cython(dout, argmax, H, W, pool_width, stride)
+
+    _, _, out_h, out_w = dout.shape
+    dx = np.zeros(x_shape, dtype=dout.dtype)
+    for i in range(pool_height):
+        for j in range(pool_width):
+            mask = argmax == i * pool_width + j
+            dx[:, :, i:i + stride * out_h:stride,
+               j:j + stride * out_w:stride] += dout * mask
+    return dx
+
+
 def max_pool_forward_im2col(x, pool_param):
     """
     An implementation of the forward pass for max pooling based on im2col.
@@ -271,3 +1532,187 @@ def max_pool_backward_im2col(dout, cache):
     dx = dx.reshape(x.shape)
 
     return dx
+
+
+def _max_pool_nhwc(x, pool_param):
+    """
+    Max pooling over channels-last data through a strided view of the
+    pooling windows. Returns the output and, for every output element, the
+    index of the maximum within its flattened window.
+    """
+    N, H, W, C = x.shape
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    stride = pool_param['stride']
+    out_h = (H - pool_height) // stride + 1
+    out_w = (W - pool_width) // stride + 1
+
+    s = x.strides
+    windows = np.lib.stride_tricks.as_strided(
+        x, shape=(N, out_h, out_w, pool_height, pool_width, C),
+        strides=(s[0], stride * s[1], stride * s[2], s[1], s[2], s[3]))
+    windows = windows.reshape(N, out_h, out_w, pool_height * pool_width, C)
+    argmax = np.argmax(windows, axis=3)
+    if pool_height * pool_width <= 256:
+        argmax = argmax.astype(np.uint8)
+    out = np.take_along_axis(windows, argmax[:, :, :, np.newaxis], axis=3)
+    return out[:, :, :, 0], argmax
+
+
+def max_pool_forward_nhwc(x, pool_param):
+    """
+    Forward pass for a max pooling layer on channels-last data of shape
+    (N, H, W, C); any pool size and stride is supported.
+
+    Returns a tuple of:
+    - out: Output data, of shape (N, H', W', C)
+    - cache: (x.shape, argmax, pool_param)
+    """
+    out, argmax = _max_pool_nhwc(x, pool_param)
+    cache = (x.shape, argmax, pool_param)
+    return out, cache
+
+
+def max_pool_backward_nhwc(dout, cache):
+    """
+    Backward pass for max_pool_forward_nhwc. Ties go to the first maximum in
+    each window, as in max_pool_backward_im2col.
+    """
+    x_shape, argmax, pool_param = cache
+    pool_height, pool_width = pool_param['pool_height'], pool_param['pool_width']
+    stride = pool_param['stride']
+    _, out_h, out_w, _ = dout.shape
+
+    dx = np.zeros(x_shape, dtype=dout.dtype)
+    for i in range(pool_height):
+        for j in range(pool_width):
+            mask = argmax == i * pool_width + j
+            dx[:, i:i + stride * out_h:stride,
+               j:j + stride * out_w:stride] += dout * mask
+    return dx
+
+
+def _pool_windows(x_shape, pool_param):
+    """
+    Yields every (i, j) offset of a pooling window together with the index
+    tuple that selects, for all windows at once, their elements at that
+    offset. Works for both layouts given by pool_param['layout'].
+    """
+    ph, pw = pool_param['pool_height'], pool_param['pool_width']
+    stride = pool_param['stride']
+    nhwc = pool_param.get('layout', 'NCHW') == 'NHWC'
+    H, W = x_shape[1:3] if nhwc else x_shape[2:4]
+    out_h = (H - ph) // stride + 1
+    out_w = (W - pw) // stride + 1
+    for i in range(ph):
+        for j in range(pw):
+            rows = slice(i, i + stride * out_h, stride)
+            cols = slice(j, j + stride * out_w, stride)
+            if nhwc:
+                yield (slice(None), rows, cols, slice(None))
+            else:
+                yield (slice(None), slice(None), rows, cols)
+
+
+def avg_pool_forward_fast(x, pool_param):
+    """
+    A fast implementation of the forward pass for an average pooling layer.
+    Windows that tile the input are averaged with a reshape; other windows
+    and strides are summed over the ph * pw offsets from strided views of x.
+    Only the input shape is cached.
+
+    Inputs:
+    - x: Input data of shape (N, C, H, W), or (N, H, W, C) if
+      pool_param['layout'] is 'NHWC'
+    - pool_param: dictionary with 'pool_height', 'pool_width', 'stride' and
+      optionally 'layout'
+
+    Returns a tuple of:
+    - out: Output data
+    - cache: (x.shape, pool_param)
+    """
+    ph, pw = pool_param['pool_height'], pool_param['pool_width']
+    stride = pool_param['stride']
+    nhwc = pool_param.get('layout', 'NCHW') == 'NHWC'
+    if nhwc:
+        N, H, W, C = x.shape
+    else:
+        N, C, H, W = x.shape
+    # A float16 sum over a window loses precision and can overflow, so
+    # accumulate in at least float32 and cast back
+    out_dtype = np.result_type(x.dtype, np.float16)
+    acc_dtype = np.result_type(x.dtype, np.float32)
+
+    if ph == pw == stride and H % ph == 0 and W % pw == 0:
+        if nhwc:
+            x_reshaped = x.reshape(N, H // ph, ph, W // pw, pw, C)
+            out = x_reshaped.mean(axis=(2, 4), dtype=acc_dtype)
+        else:
+            x_reshaped = x.reshape(N, C, H // ph, ph, W // pw, pw)
+            out = x_reshaped.mean(axis=(3, 5), dtype=acc_dtype)
+    else:
+        out = None
+        for idx in _pool_windows(x.shape, pool_param):
+            if out is None:
+                out = x[idx].astype(acc_dtype)
+            else:
+                out += x[idx]
+        out /= ph * pw
+    out = out.astype(out_dtype, copy=False)
+
+    cache = (x.shape, pool_param)
+    return out, cache
+
+
+def avg_pool_backward_fast(dout, cache):
+    """
+    Backward pass for avg_pool_forward_fast.
+    """
+    x_shape, pool_param = cache
+    ph, pw = pool_param['pool_height'], pool_param['pool_width']
+    dout = dout / (ph * pw)
+
+    dx = np.zeros(x_shape, dtype=dout.dtype)
+    for idx in _pool_windows(x_shape, pool_param):
+        dx[idx] += dout
+    return dx
+
+
+def global_avg_pool_forward(x, pool_param=None):
+    """
+    Global average pooling: averages every channel over all spatial
+    positions, e.g. to replace flattening before a classifier.
+
+    Inputs:
+    - x: Input data of shape (N, C, H, W), or (N, H, W, C) if
+      pool_param['layout'] is 'NHWC'
+    - pool_param: Optional dictionary; only 'layout' is read
+
+    Returns a tuple of:
+    - out: Output data of shape (N, C)
+    - cache: (x.shape, layout)
+    """
+    layout = (pool_param or {}).get('layout', 'NCHW')
+    axes = (1, 2) if layout == 'NHWC' else (2, 3)
+    # A float16 sum over all positions loses precision and can overflow, so
+    # accumulate in at least float32 and cast back
+    out = x.mean(axis=axes, dtype=np.result_type(x.dtype, np.float32))
+    out = out.astype(x.dtype, copy=False)
+    cache = (x.shape, layout)
+    return out, cache
+
+
+def global_avg_pool_backward(dout, cache):
+    """
+    Backward pass for global_avg_pool_forward.
+    """
+    x_shape, layout = cache
+    N = x_shape[0]
+    if layout == 'NHWC':
+        _, H, W, C = x_shape
+        dout = dout.reshape(N, 1, 1, C)
+    else:
+        _, C, H, W = x_shape
+        dout = dout.reshape(N, C, 1, 1)
+    dx = np.empty(x_shape, dtype=dout.dtype)
+    np.copyto(dx, dout / (H * W))
+    return dx
@@ -119,3 +119,304 @@ def col2im_6d_cython(np.ndarray[DTYPE_t, ndim=6] cols, int N, int C, int H, int
     if pad > 0:
         return x_padded[:, :, pad:-pad, pad:-pad]
     return x_padded 
+
+
+# Multithreaded variants of the kernels above. They take typed memoryviews so
+# that the loops can run without the GIL. The col2im kernels split the work
+# over the N * C image planes with prange: each (n, c) plane of x_padded is
+# written by exactly one thread, so the accumulations cannot race. Without
+# OpenMP (see setup.py) they still run, on a single thread.
+
+from cython.parallel cimport prange
+import os
+
+cdef int _num_threads = int(os.environ.get('OMP_NUM_THREADS', 0)) or (
+    len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity')
+    else os.cpu_count() or 1)
+
+
+def set_num_threads(int num_threads):
+    """
+    Sets the number of threads used by the *_parallel kernels.
+    """
+    global _num_threads
+    if num_threads < 1:
+        raise ValueError('num_threads must be positive')
+    _num_threads = num_threads
+
+
+def get_num_threads():
+    """
+    Returns the number of threads used by the *_parallel kernels.
+    """
+    return _num_threads
+
+
+def im2col_cython_parallel(np.ndarray[DTYPE_t, ndim=4] x, int field_height,
+                           int field_width, int padding, int stride):
+    cdef int N = x.shape[0]
+    cdef int C = x.shape[1]
+    cdef int H = x.shape[2]
+    cdef int W = x.shape[3]
+
+    cdef int HH = (H + 2 * padding - field_height) / stride + 1
+    cdef int WW = (W + 2 * padding - field_width) / stride + 1
+
+    cdef int p = padding
+    x_padded = np.pad(x, ((0, 0), (0, 0), (p, p), (p, p)), mode='constant')
+    cols = np.empty((C * field_height * field_width, N * HH * WW), dtype=x.dtype)
+
+    cdef DTYPE_t[:, :, :, ::1] x_view = x_padded
+    cdef DTYPE_t[:, ::1] cols_view = cols
+    with nogil:
+        im2col_parallel_inner(cols_view, x_view, N, C, HH, WW,
+                              field_height, field_width, stride)
+    return cols
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void im2col_parallel_inner(DTYPE_t[:, ::1] cols,
+                                DTYPE_t[:, :, :, ::1] x_padded,
+                                int N, int C, int HH, int WW,
+                                int field_height, int field_width,
+                                int stride) nogil:
+    cdef int row, c, ii, jj, yy, xx, n, col
+
+    # Rows of cols are disjoint, so im2col is split over rows instead, which
+    # keeps every thread's writes contiguous
+    for row in prange(C * field_height * field_width,
+                      num_threads=_num_threads, schedule='static'):
+        c = row / (field_height * field_width)
+        ii = (row / field_width) % field_height
+        jj = row % field_width
+        col = 0
+        for yy in range(HH):
+            for xx in range(WW):
+                for n in range(N):
+                    cols[row, col] = x_padded[n, c, stride * yy + ii, stride * xx + jj]
+                    col = col + 1
+
+
+def col2im_cython_parallel(np.ndarray[DTYPE_t, ndim=2] cols, int N, int C,
+                           int H, int W, int field_height, int field_width,
+                           int padding, int stride):
+    cdef int HH = (H + 2 * padding - field_height) / stride + 1
+    cdef int WW = (W + 2 * padding - field_width) / stride + 1
+    x_padded = np.zeros((N, C, H + 2 * padding, W + 2 * padding), dtype=cols.dtype)
+
+    cdef DTYPE_t[:, ::1] cols_view = np.ascontiguousarray(cols)
+    cdef DTYPE_t[:, :, :, ::1] x_view = x_padded
+    with nogil:
+        col2im_parallel_inner(cols_view, x_view, N, C, HH, WW,
+                              field_height, field_width, stride)
+    if padding > 0:
+        return x_padded[:, :, padding:-padding, padding:-padding]
+    return x_padded
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void col2im_parallel_inner(DTYPE_t[:, ::1] cols,
+                                DTYPE_t[:, :, :, ::1] x_padded,
+                                int N, int C, int HH, int WW,
+                                int field_height, int field_width,
+                                int stride) nogil:
+    cdef int nc, n, c, ii, jj, row, yy, xx
+
+    for nc in prange(N * C, num_threads=_num_threads, schedule='static'):
+        n = nc % N
+        c = nc / N
+        for ii in range(field_height):
+            for jj in range(field_width):
+                row = (c * field_height + ii) * field_width + jj
+                for yy in range(HH):
+                    for xx in range(WW):
+                        x_padded[n, c, stride * yy + ii, stride * xx + jj] += \
+                            cols[row, (yy * WW + xx) * N + n]
+
+
+def col2im_6d_cython_parallel(np.ndarray[DTYPE_t, ndim=6] cols, int N, int C,
+                              int H, int W, int HH, int WW, int pad, int stride,
+                              x_padded=None):
+    """
+    The result is accumulated into x_padded, of shape (N, C, H + 2 * pad,
+    W + 2 * pad), if given; it must be zeroed. The returned array is then a
+    view into it.
+    """
+    cdef int out_h = (H + 2 * pad - HH) / stride + 1
+    cdef int out_w = (W + 2 * pad - WW) / stride + 1
+    if x_padded is None:
+        x_padded = np.zeros((N, C, H + 2 * pad, W + 2 * pad), dtype=cols.dtype)
+
+    cdef DTYPE_t[:, :, :, :, :, ::1] cols_view = np.ascontiguousarray(cols)
+    cdef DTYPE_t[:, :, :, ::1] x_view = x_padded
+    with nogil:
+        col2im_6d_parallel_inner(cols_view, x_view, N, C, HH, WW, out_h, out_w, stride)
+
+    if pad > 0:
+        return x_padded[:, :, pad:-pad, pad:-pad]
+    return x_padded
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void col2im_6d_parallel_inner(DTYPE_t[:, :, :, :, :, ::1] cols,
+                                   DTYPE_t[:, :, :, ::1] x_padded,
+                                   int N, int C, int HH, int WW,
+                                   int out_h, int out_w, int stride) nogil:
+    cdef int nc, n, c, hh, ww, h, w
+
+    for nc in prange(N * C, num_threads=_num_threads, schedule='static'):
+        n = nc / C
+        c = nc % C
+        for hh in range(HH):
+            for ww in range(WW):
+                for h in range(out_h):
+                    for w in range(out_w):
+                        x_padded[n, c, stride * h + hh, stride * w + ww] += \
+                            cols[c, hh, ww, n, h, w]
+
+
+def col2im_nhwc_cython(np.ndarray[DTYPE_t, ndim=6] cols, int N, int H, int W,
+                       int C, int pad, int stride):
+    """
+    col2im for channels-last data: cols has shape (N, out_h, out_w, HH, WW, C)
+    and the result shape (N, H, W, C). Both are walked in memory order, and
+    the images are split across threads.
+    """
+    cdef int out_h = cols.shape[1]
+    cdef int out_w = cols.shape[2]
+    cdef int HH = cols.shape[3]
+    cdef int WW = cols.shape[4]
+    x_padded = np.zeros((N, H + 2 * pad, W + 2 * pad, C), dtype=cols.dtype)
+
+    cdef DTYPE_t[:, :, :, :, :, ::1] cols_view = np.ascontiguousarray(cols)
+    cdef DTYPE_t[:, :, :, ::1] x_view = x_padded
+    with nogil:
+        col2im_nhwc_inner(cols_view, x_view, N, out_h, out_w, HH, WW, C, stride)
+
+    if pad > 0:
+        return x_padded[:, pad:-pad, pad:-pad, :]
+    return x_padded
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void col2im_nhwc_inner(DTYPE_t[:, :, :, :, :, ::1] cols,
+                            DTYPE_t[:, :, :, ::1] x_padded,
+                            int N, int out_h, int out_w, int HH, int WW, int C,
+                            int stride) nogil:
+    cdef int n, h, w, hh, ww, c
+
+    for n in prange(N, num_threads=_num_threads, schedule='static'):
+        for h in range(out_h):
+            for w in range(out_w):
+                for hh in range(HH):
+                    for ww in range(WW):
+                        for c in range(C):
+                            x_padded[n, stride * h + hh, stride * w + ww, c] += \
+                                cols[n, h, w, hh, ww, c]
+
+
+def max_pool_forward_cython(np.ndarray[DTYPE_t, ndim=4] x, int pool_height,
+                            int pool_width, int stride):
+    """
+    Max pooling with any window size and stride. Returns the output and, for
+    every output element, the offset i * pool_width + j of its maximum within
+    the window as a uint8, so pool_height * pool_width must be at most 256.
+    """
+    cdef int N = x.shape[0]
+    cdef int C = x.shape[1]
+    cdef int H = x.shape[2]
+    cdef int W = x.shape[3]
+    cdef int out_h = (H - pool_height) / stride + 1
+    cdef int out_w = (W - pool_width) / stride + 1
+    if pool_height * pool_width > 256:
+        raise ValueError('pooling window too large for uint8 offsets')
+
+    out = np.empty((N, C, out_h, out_w), dtype=x.dtype)
+    argmax = np.empty((N, C, out_h, out_w), dtype=np.uint8)
+
+    cdef DTYPE_t[:, :, :, ::1] x_view = np.ascontiguousarray(x)
+    cdef DTYPE_t[:, :, :, ::1] out_view = out
+    cdef np.uint8_t[:, :, :, ::1] argmax_view = argmax
+    with nogil:
+        max_pool_forward_inner(x_view, out_view, argmax_view, N, C, out_h, out_w,
+                               pool_height, pool_width, stride)
+    return out, argmax
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void max_pool_forward_inner(DTYPE_t[:, :, :, ::1] x,
+                                 DTYPE_t[:, :, :, ::1] out,
+                                 np.uint8_t[:, :, :, ::1] argmax,
+                                 int N, int C, int out_h, int out_w,
+                                 int pool_height, int pool_width,
+                                 int stride) nogil:
+    cdef int nc, n, c, h, w, i, j, best
+    cdef DTYPE_t m, v
+
+    for nc in prange(N * C, num_threads=_num_threads, schedule='static'):
+        n = nc / C
+        c = nc % C
+        for h in range(out_h):
+            for w in range(out_w):
+                m = x[n, c, stride * h, stride * w]
+                best = 0
+                for i in range(pool_height):
+                    for j in range(pool_width):
+                        v = x[n, c, stride * h + i, stride * w + j]
+                        if v > m:
+                            m = v
+                            best = i * pool_width + j
+                out[n, c, h, w] = m
+                argmax[n, c, h, w] = best
+
+
+def max_pool_backward_cython(np.ndarray[DTYPE_t, ndim=4] dout,
+                             np.ndarray[np.uint8_t, ndim=4] argmax,
+                             int H, int W, int pool_width, int stride):
+    """
+    Backward pass for max_pool_forward_cython: scatters dout to the input
+    positions recorded in argmax. Overlapping windows accumulate.
+    """
+    cdef int N = dout.shape[0]
+    cdef int C = dout.shape[1]
+    cdef int out_h = dout.shape[2]
+    cdef int out_w = dout.shape[3]
+    dx = np.zeros((N, C, H, W), dtype=dout.dtype)
+
+    cdef DTYPE_t[:, :, :, ::1] dout_view = np.ascontiguousarray(dout)
+    cdef np.uint8_t[:, :, :, ::1] argmax_view = np.ascontiguousarray(argmax)
+    cdef DTYPE_t[:, :, :, ::1] dx_view = dx
+    with nogil:
+        max_pool_backward_inner(dout_view, argmax_view, dx_view, N, C, out_h,
+                                out_w, pool_width, stride)
+    return dx
+
+
+@cython.boundscheck(False)
+@cython.wraparound(False)
+@cython.cdivision(True)
+cdef void max_pool_backward_inner(DTYPE_t[:, :, :, ::1] dout,
+                                  np.uint8_t[:, :, :, ::1] argmax,
+                                  DTYPE_t[:, :, :, ::1] dx,
+                                  int N, int C, int out_h, int out_w,
+                                  int pool_width, int stride) nogil:
+    cdef int nc, n, c, h, w, k
+
+    for nc in prange(N * C, num_threads=_num_threads, schedule='static'):
+        n = nc / C
+        c = nc % C
+        for h in range(out_h):
+            for w in range(out_w):
+                k = argmax[n, c, h, w]
+                dx[n, c, stride * h + k / pool_width, stride * w + k % pool_width] += \
+                    dout[n, c, h, w]
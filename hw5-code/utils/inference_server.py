@@ -0,0 +1,402 @@
+from __future__ import print_function, division
+import argparse
+import asyncio
+import json
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+
+def load_model(filename):
+    """
+    Loads the model from a checkpoint written by Solver._save_checkpoint.
+    """
+    with open(filename, 'rb') as f:
+        checkpoint = pickle.load(f)
+    return checkpoint['model']
+
+
+def top_k(scores, k):
+    """
+    Softmax probabilities of the k highest-scoring classes of each row.
+
+    Returns a tuple of:
+    - classes: Integer array of shape (N, k), best class first
+    - probs: Array of shape (N, k) of the matching probabilities
+    """
+    k = min(k, scores.shape[1])
+    classes = np.argsort(-scores, axis=1)[:, :k]
+    probs = np.exp(scores - np.max(scores, axis=1, keepdims=True))
+    probs /= np.sum(probs, axis=1, keepdims=True)
+    return classes, np.take_along_axis(probs, classes, axis=1)
+
+
+class MicroBatcher(object):
+    """
+    Coalesces single-example requests into micro-batches for a model's
+    test-time forward pass.
+
+    Requests wait in a queue. A batch is closed as soon as it holds
+    max_batch_size examples or max_wait seconds have passed since its first
+    example arrived, whichever comes first, and is run on a thread pool so
+    that the event loop keeps accepting requests meanwhile. numpy releases
+    the GIL inside its BLAS calls, so num_workers batches can run at once;
+    further batches queue until a worker is free.
+
+    Example usage:
+
+    batcher = MicroBatcher(model, max_batch_size=32, max_wait=0.005)
+    classes, probs = await batcher.predict(x, k=5)
+
+    The model's test-time forward pass must be safe to call from several
+    threads, which holds for ThreeLayerConvNet and FullyConnectedNet.
+    """
+
+    def __init__(self, model, max_batch_size=32, max_wait=0.005, num_workers=1):
+        """
+        Inputs:
+        - model: A trained model, called as model.loss(X).
+        - max_batch_size: Largest number of examples per forward pass.
+        - max_wait: Seconds a request may wait for a batch to fill up.
+        - num_workers: Number of forward passes that may run at once.
+        """
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.num_workers = num_workers
+        self.executor = None
+        self.batch_sizes = []
+
+    async def start(self):
+        """
+        Starts the batching task; must be called from the running loop.
+        """
+        self.queue = asyncio.Queue()
+        self.slots = asyncio.Semaphore(self.num_workers)
+        self.executor = ThreadPoolExecutor(self.num_workers)
+        self.task = asyncio.ensure_future(self._collect())
+
+    async def stop(self):
+        """
+        Cancels the batching task and shuts the worker pool down.
+        """
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.executor.shutdown(wait=True)
+
+    async def predict(self, x, k=5):
+        """
+        Classifies a single example.
+
+        Inputs:
+        - x: Array of shape (d_1, ..., d_k)
+        - k: Number of classes to return.
+
+        Returns a tuple of:
+        - classes: Integer array of shape (k,), best class first
+        - probs: Array of shape (k,) of their probabilities
+        """
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((x, k, future))
+        return await future
+
+    async def _collect(self):
+        """
+        Forms batches from the queue and hands each to a free worker.
+        """
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self.slots.acquire()
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch):
+        """
+        Runs one batch on the worker pool and resolves its futures.
+        """
+        try:
+            X = np.stack([x for x, _, _ in batch])
+            k = max(k for _, k, _ in batch)
+            loop = asyncio.get_running_loop()
+            scores = await loop.run_in_executor(self.executor, self.model.loss, X)
+            classes, probs = top_k(scores, k)
+            self.batch_sizes.append(len(batch))
+            for i, (_, k_i, future) in enumerate(batch):
+                if not future.done():
+                    future.set_result((classes[i, :k_i], probs[i, :k_i]))
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.slots.release()
+
+
+class InferenceServer(object):
+    """
+    A minimal HTTP/1.1 server in front of a MicroBatcher, listening on TCP
+    or on a Unix socket. Connections are kept alive between requests.
+
+    Endpoints:
+    - POST /predict?k=5: The body is one example, either as JSON
+      {"x": nested list, "k": 5} or, with Content-Type
+      application/octet-stream, as the raw bytes of a float32 array of the
+      model's input shape. The response is JSON {"classes": [...],
+      "probs": [...]}, best class first.
+    - GET /health: Returns {"status": "ok"}.
+
+    Malformed requests and invalid examples or k get a 400 response, and an
+    error in the model's forward pass a 500. After a request whose framing
+    cannot be parsed, the connection is closed.
+
+    Example usage:
+
+    server = InferenceServer(model, (3, 32, 32), port=8000)
+    asyncio.run(server.serve_forever())
+
+    or from the command line:
+
+    python -m utils.inference_server model_epoch_10.pkl --input-dim 3 32 32
+    """
+
+    def __init__(self, model, input_dim, host='127.0.0.1', port=8000,
+                 unix_path=None, **batcher_kwargs):
+        """
+        Inputs:
+        - model: A trained model.
+        - input_dim: Shape of one example, e.g. (3, 32, 32).
+        - host, port: TCP address to listen on; port 0 picks a free one.
+        - unix_path: If given, listen on this Unix socket instead of TCP.
+        - batcher_kwargs: Passed on to MicroBatcher.
+        """
+        self.input_dim = tuple(input_dim)
+        self.host = host
+        self.port = port
+        self.unix_path = unix_path
+        self.batcher = MicroBatcher(model, **batcher_kwargs)
+        self.server = None
+
+        # One forward pass to learn the number of classes, for checking k
+        x = np.zeros((1,) + self.input_dim, dtype=np.float32)
+        self.num_classes = model.loss(x).shape[1]
+
+    async def start(self):
+        """
+        Starts listening; with port 0, self.port is set to the chosen port.
+        """
+        await self.batcher.start()
+        if self.unix_path is not None:
+            self.server = await asyncio.start_unix_server(self._handle,
+                                                          path=self.unix_path)
+        else:
+            self.server = await asyncio.start_server(self._handle, self.host,
+                                                     self.port)
+            self.port = self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        """
+        Stops listening and shuts the batcher down.
+        """
+        self.server.close()
+        await self.server.wait_closed()
+        await self.batcher.stop()
+
+    async def serve_forever(self):
+        """
+        Starts the server and serves until cancelled.
+        """
+        await self.start()
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.stop()
+
+    def _parse(self, body, content_type, query):
+        """
+        Decodes a /predict body into an example and the number of classes.
+        """
+        k = int(query.get('k', ['5'])[0])
+        if content_type == 'application/octet-stream':
+            x = np.frombuffer(body, dtype=np.float32)
+        else:
+            request = json.loads(body)
+            x = np.asarray(request['x'], dtype=np.float32)
+            k = int(request.get('k', k))
+        if not 1 <= k <= self.num_classes:
+            raise ValueError('k must be between 1 and %d' % self.num_classes)
+        return x.reshape(self.input_dim), k
+
+    async def _predict(self, body, content_type, query):
+        """
+        Answers a /predict request. Returns the status line and the payload.
+        """
+        try:
+            x, k = self._parse(body, content_type, query)
+        except (ValueError, KeyError, TypeError) as e:
+            return '400 Bad Request', {'error': str(e)}
+        try:
+            classes, probs = await self.batcher.predict(x, k)
+        except Exception as e:
+            return '500 Internal Server Error', {'error': str(e)}
+        return '200 OK', {'classes': classes.tolist(), 'probs': probs.tolist()}
+
+    async def _respond(self, writer, status, payload):
+        body = json.dumps(payload).encode()
+        writer.write(('HTTP/1.1 %s\r\nContent-Type: application/json\r\n'
+                      'Content-Length: %d\r\n\r\n' % (status, len(body))).encode())
+        writer.write(body)
+        await writer.drain()
+
+    async def _read_request(self, reader):
+        """
+        Reads one request from a connection. Returns (method, target,
+        headers, body), or None once the client has closed the connection.
+        Raises ValueError if the request line, a header line or the
+        Content-Length is malformed, or if they are not valid UTF-8.
+        """
+        request_line = await reader.readline()
+        if not request_line:
+            return None
+        parts = request_line.decode().split()
+        if len(parts) != 3:
+            raise ValueError('malformed request line')
+        method, target, _ = parts
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, sep, value = line.decode().partition(':')
+            if not sep:
+                raise ValueError('malformed header line')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', 0))
+        if length < 0:
+            raise ValueError('negative Content-Length')
+        body = await reader.readexactly(length)
+        return method, target, headers, body
+
+    async def _handle(self, reader, writer):
+        """
+        Serves the requests of one connection until the client closes it.
+        """
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except ValueError as e:
+                    # The rest of the stream cannot be framed, so give up on it
+                    await self._respond(writer, '400 Bad Request', {'error': str(e)})
+                    break
+                if request is None:
+                    break
+                method, target, headers, body = request
+
+                url = urlsplit(target)
+                if method == 'GET' and url.path == '/health':
+                    await self._respond(writer, '200 OK', {'status': 'ok'})
+                elif method == 'POST' and url.path == '/predict':
+                    status, payload = await self._predict(
+                        body, headers.get('content-type'), parse_qs(url.query))
+                    await self._respond(writer, status, payload)
+                else:
+                    await self._respond(writer, '404 Not Found',
+                                        {'error': 'unknown endpoint'})
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _request(reader, writer, body, k):
+    """
+    Sends one octet-stream /predict request on an open connection and
+    returns the decoded response.
+    """
+    writer.write(('POST /predict?k=%d HTTP/1.1\r\nHost: localhost\r\n'
+                  'Content-Type: application/octet-stream\r\n'
+                  'Content-Length: %d\r\n\r\n' % (k, len(body))).encode())
+    writer.write(body)
+    await writer.drain()
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        if line.lower().startswith(b'content-length:'):
+            length = int(line.split(b':')[1])
+    return json.loads(await reader.readexactly(length))
+
+
+async def generate_load(X, num_clients, num_requests, port=None, unix_path=None,
+                        host='127.0.0.1', k=5):
+    """
+    A closed-loop load generator: num_clients concurrent clients, each on its
+    own keep-alive connection, send single examples from X back to back until
+    num_requests have been answered in total.
+
+    Returns a tuple of:
+    - latencies: Array of per-request latencies in seconds
+    - elapsed: Wall-clock seconds for all requests
+    """
+    loop = asyncio.get_running_loop()
+    bodies = [np.ascontiguousarray(x, dtype=np.float32).tobytes() for x in X]
+    latencies = []
+    counter = iter(range(num_requests))
+
+    async def client():
+        if unix_path is not None:
+            reader, writer = await asyncio.open_unix_connection(unix_path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        for i in counter:
+            start = loop.time()
+            await _request(reader, writer, bodies[i % len(bodies)], k)
+            latencies.append(loop.time() - start)
+        writer.close()
+
+    start = loop.time()
+    await asyncio.gather(*[client() for _ in range(num_clients)])
+    return np.array(latencies), loop.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Serve a Solver checkpoint with micro-batched inference.')
+    parser.add_argument('checkpoint', help='checkpoint written by Solver')
+    parser.add_argument('--input-dim', type=int, nargs='+', default=[3, 32, 32])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--unix', default=None, help='Unix socket path')
+    parser.add_argument('--max-batch-size', type=int, default=32)
+    parser.add_argument('--max-wait-ms', type=float, default=5.0)
+    parser.add_argument('--workers', type=int, default=1)
+    args = parser.parse_args()
+
+    server = InferenceServer(load_model(args.checkpoint), args.input_dim,
+                             host=args.host, port=args.port, unix_path=args.unix,
+                             max_batch_size=args.max_batch_size,
+                             max_wait=args.max_wait_ms / 1000.0,
+                             num_workers=args.workers)
+    print('Serving on %s' % (args.unix or '%s:%d' % (args.host, args.port)))
+    asyncio.run(server.serve_forever())
+
+
+if __name__ == '__main__':
+    main()
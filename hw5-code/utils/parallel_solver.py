@@ -0,0 +1,248 @@
+from __future__ import print_function, division
+from builtins import range
+import multiprocessing as mp
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from nndl.flat_params import FlatParams
+from nndl.pruning import apply_prune_masks
+from utils.solver import Solver
+
+
+def _attach_array(spec):
+    """
+    Maps a (name, shape, dtype) spec onto an existing block of shared memory.
+    Returns the SharedMemory handle (which must be kept alive) and the array.
+    """
+    name, shape, dtype = spec
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _bn_stats(model):
+    """
+    Running batchnorm statistics of a model, if it keeps any.
+    """
+    return [(p.get('running_mean'), p.get('running_var'))
+            for p in getattr(model, 'bn_params', [])]
+
+
+def _worker_loop(rank, model, specs, conn, seed):
+    """
+    Body of a worker process. The worker holds a replica of the model whose
+    parameters are views into the shared parameter buffer, so it always sees
+    the latest update without any copying. For every (start, end, loss_scale)
+    message it receives, it computes the loss on that slice of the shared
+    minibatch with the given loss scale and writes its gradients into row
+    `rank` of the shared gradient buffer.
+
+    A forked worker inherits the parent's np.random state, so every worker is
+    reseeded with seed + rank to draw its own dropout masks.
+    """
+    np.random.seed(seed + rank)
+    handles, arrays = zip(*[_attach_array(s) for s in specs])
+    w, grads, X, y = arrays
+
+    flat = FlatParams(model)
+    flat.attach(w, grads[rank], copy=False)
+    conn.send('ready')
+
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+        start, end, loss_scale = msg
+        model.loss_scale = loss_scale
+        loss, g = model.loss(X[start:end], y[start:end])
+        flat.load_grads(g)
+        conn.send((loss, _bn_stats(model)))
+
+    del flat, w, grads, X, y, arrays
+    for shm in handles:
+        shm.close()
+    conn.close()
+
+
+class DataParallelSolver(Solver):
+    """
+    A Solver that splits every minibatch across several worker processes.
+
+    Each worker holds a replica of the model and computes the loss and
+    gradient on its share of the minibatch. The parameters, the minibatch
+    and one gradient row per worker live in multiprocessing.shared_memory.
+    After all workers finish, the solver reduces the gradient rows with a
+    single weighted sum and applies one update over the flat parameter vector
+    (as with flat_params=True), which every replica sees immediately.
+
+    Since the minibatch loss is an average over examples, weighting each
+    worker's gradient by its share of the batch gives the same gradient as
+    single-process training, up to floating point summation order.
+    Minibatches are drawn in the parent with np.random exactly as Solver does,
+    so seeding np.random reproduces the single-process batch sequence.
+    Batchnorm layers normalize over each worker's share of the batch, so
+    models using batchnorm only match single-process training exactly with
+    num_workers=1; their running statistics are averaged back into the parent
+    model after every step. Worker `rank` seeds np.random with seed + rank,
+    so dropout masks are drawn independently in each worker (unless the model
+    fixes a dropout seed, which reseeds on every forward pass).
+
+    Loss scaling works as in Solver: the current scale is sent to the workers
+    with every slice, and the reduced gradient is unscaled (and checked for
+    overflow with dynamic scaling) before the update.
+
+    Usage is the same as Solver, with two extra optional arguments:
+    - num_workers: Number of worker processes; default is os.cpu_count().
+    - seed: Base seed for the workers' random number generators; default is 0.
+
+    Workers are started at the beginning of train() and shut down when it
+    returns, after which model.params is back in ordinary memory.
+    """
+
+    def __init__(self, model, data, **kwargs):
+        self.num_workers = kwargs.pop('num_workers', None) or os.cpu_count()
+        self.seed = kwargs.pop('seed', 0)
+        kwargs['flat_params'] = True
+        super(DataParallelSolver, self).__init__(model, data, **kwargs)
+        if self.batch_size < self.num_workers:
+            raise ValueError('batch_size %d is smaller than num_workers %d' % (
+                             self.batch_size, self.num_workers))
+        self.workers = []
+        self.shms = []
+
+
+    def _shared_array(self, shape, dtype):
+        """
+        Allocates an array in a new block of shared memory and returns the
+        array along with the spec the workers use to attach to it.
+        """
+        dtype = np.dtype(dtype)
+        nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+        shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        self.shms.append(shm)
+        arr = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        return arr, (shm.name, shape, dtype)
+
+
+    def _start_workers(self):
+        """
+        Moves the parameters into shared memory and starts the workers.
+        """
+        self.shms = []
+        P = self.flat.w.size
+        w, w_spec = self._shared_array((P,), self.flat.w.dtype)
+        grads, g_spec = self._shared_array((self.num_workers, P), self.flat.dw.dtype)
+        X_shape = (self.batch_size,) + self.X_train.shape[1:]
+        self.X_batch, X_spec = self._shared_array(X_shape, self.X_train.dtype)
+        self.y_batch, y_spec = self._shared_array((self.batch_size,), self.y_train.dtype)
+        self.shared_grads = grads
+        self.flat.attach(w, np.empty_like(self.flat.dw))
+
+        # Slice boundaries of the minibatch and each worker's weight in the
+        # reduction
+        self.bounds = np.linspace(0, self.batch_size, self.num_workers + 1).astype(int)
+        self.weights = np.diff(self.bounds) / float(self.batch_size)
+        self.weights = self.weights.astype(self.flat.dw.dtype)
+
+        specs = (w_spec, g_spec, X_spec, y_spec)
+        self.workers = []
+        for rank in range(self.num_workers):
+            parent_conn, child_conn = mp.Pipe()
+            proc = mp.Process(target=_worker_loop,
+                              args=(rank, self.model, specs, child_conn, self.seed))
+            proc.daemon = True
+            proc.start()
+            # Only the worker may hold the child end open, so that a worker
+            # dying shows up as EOF in the parent instead of a hang
+            child_conn.close()
+            self.workers.append((proc, parent_conn))
+        for rank in range(self.num_workers):
+            self._recv(rank)
+
+
+    def _recv(self, rank):
+        """
+        Receives the next message from worker `rank`, raising a RuntimeError
+        if the worker has exited.
+        """
+        proc, conn = self.workers[rank]
+        try:
+            return conn.recv()
+        except EOFError:
+            proc.join()
+            raise RuntimeError('Worker %d exited unexpectedly with exit code %s' % (
+                               rank, proc.exitcode))
+
+
+    def _stop_workers(self):
+        """
+        Shuts the workers down and moves the parameters back into private
+        memory before releasing the shared blocks.
+        """
+        for proc, conn in self.workers:
+            if proc.is_alive():
+                try:
+                    conn.send(None)
+                except (BrokenPipeError, OSError):
+                    pass
+        for proc, conn in self.workers:
+            proc.join()
+            conn.close()
+        self.workers = []
+
+        if not self.shms:
+            return
+        self.flat.attach(self.flat.w.copy(), np.zeros_like(self.flat.dw), copy=False)
+        del self.shared_grads, self.X_batch, self.y_batch
+        for shm in self.shms:
+            shm.close()
+            shm.unlink()
+        self.shms = []
+
+
+    def _step(self):
+        """
+        Make a single synchronized gradient update across all workers.
+        """
+        # Make a minibatch of training data directly in shared memory
+        num_train = self.X_train.shape[0]
+        batch_mask = np.random.choice(num_train, self.batch_size)
+        np.take(self.X_train, batch_mask, axis=0, out=self.X_batch)
+        np.take(self.y_train, batch_mask, axis=0, out=self.y_batch)
+
+        for rank, (proc, conn) in enumerate(self.workers):
+            conn.send((self.bounds[rank], self.bounds[rank + 1], self.loss_scale))
+        results = [self._recv(rank) for rank in range(self.num_workers)]
+
+        loss = sum(wt * res[0] for wt, res in zip(self.weights, results))
+        self.loss_history.append(loss)
+
+        bn_params = getattr(self.model, 'bn_params', [])
+        for i, bn_param in enumerate(bn_params):
+            for j, key in enumerate(('running_mean', 'running_var')):
+                stats = [res[1][i][j] for res in results]
+                if stats[0] is not None:
+                    bn_param[key] = sum(wt * s for wt, s in zip(self.weights, stats))
+
+        # Reduce the gradients and perform a single parameter update
+        np.dot(self.weights, self.shared_grads, out=self.flat.dw)
+        scaled = self.dynamic_loss_scale or self.loss_scale != 1.0
+        if scaled and not self._unscale_grads(None):
+            return
+        config = self.optim_configs['flat']
+        next_w, next_config = self.update_rule(self.flat.w, self.flat.dw, config)
+        self.flat.set(next_w)
+        self.optim_configs['flat'] = next_config
+        apply_prune_masks(self.model)
+
+
+    def train(self):
+        """
+        Run optimization to train the model across the worker processes.
+        """
+        try:
+            self._start_workers()
+            super(DataParallelSolver, self).train()
+        finally:
+            self._stop_workers()
@@ -0,0 +1,186 @@
+# A standalone inference runtime for models exported with nndl.export. It
+# imports nothing but NumPy and the standard library, so that serving a
+# model does not pull in the training code.
+import json
+import mmap
+import os
+import zipfile
+
+import numpy as np
+
+
+FORMAT = 'nndl-model'
+
+# Exports with a higher version may use operations this runtime does
+# not know
+FORMAT_VERSION = 1
+
+
+def _npz_mmap(filename):
+    """
+    Memory-maps every array of an uncompressed .npz file. Arrays stored in
+    a zip archive without compression are contiguous .npy files, so each one
+    is a read-only view of the mapped file at the offset of its data.
+    """
+    arrays = {}
+    with open(filename, 'rb') as f:
+        buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with zipfile.ZipFile(f) as zf:
+            infos = zf.infolist()
+        for info in infos:
+            if info.compress_type != zipfile.ZIP_STORED:
+                raise ValueError('%s is compressed and cannot be mapped' % filename)
+            # Local file header: 30 bytes, then the name and the extra field
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = np.frombuffer(f.read(4), dtype='<u2')
+            f.seek(info.header_offset + 30 + int(name_len) + int(extra_len))
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran, dtype = np.lib.format.read_array_header_2_0(f)
+            arrays[info.filename[:-len('.npy')]] = np.ndarray(
+                shape, dtype=dtype, buffer=buf, offset=f.tell(),
+                order='F' if fortran else 'C')
+    return arrays
+
+
+def _im2col(x, HH, WW, pad, stride):
+    """
+    Column matrix of shape (C * HH * WW, N * out_h * out_w) of a padded
+    copy of x, built from a strided view.
+    """
+    N, C, H, W = x.shape
+    x_padded = np.pad(x, ((0, 0), (0, 0), (pad, pad), (pad, pad)), mode='constant')
+    H += 2 * pad
+    W += 2 * pad
+    out_h = (H - HH) // stride + 1
+    out_w = (W - WW) // stride + 1
+    s = x_padded.strides
+    cols = np.lib.stride_tricks.as_strided(
+        x_padded, shape=(C, HH, WW, N, out_h, out_w),
+        strides=(s[1], s[2], s[3], s[0], stride * s[2], stride * s[3]))
+    return np.ascontiguousarray(cols).reshape(C * HH * WW, -1), out_h, out_w
+
+
+def conv(x, w, b, stride, pad):
+    """
+    Convolution of x of shape (N, C, H, W) with filters w of shape
+    (F, C, HH, WW).
+    """
+    N = x.shape[0]
+    F, _, HH, WW = w.shape
+    cols, out_h, out_w = _im2col(x, HH, WW, pad, stride)
+    out = w.reshape(F, -1).dot(cols)
+    del cols
+    out += b.reshape(-1, 1)
+    out.shape = (F, N, out_h, out_w)
+    return np.ascontiguousarray(out.transpose(1, 0, 2, 3))
+
+
+def max_pool(x, pool_height, pool_width, stride):
+    """
+    Max pooling of x of shape (N, C, H, W).
+    """
+    N, C, H, W = x.shape
+    if (pool_height == pool_width == stride and H % pool_height == 0
+            and W % pool_width == 0):
+        x = x.reshape(N, C, H // pool_height, pool_height, W // pool_width, pool_width)
+        return x.max(axis=3).max(axis=4)
+    out_h = (H - pool_height) // stride + 1
+    out_w = (W - pool_width) // stride + 1
+    s = x.strides
+    windows = np.lib.stride_tricks.as_strided(
+        x, shape=(N, C, out_h, out_w, pool_height, pool_width),
+        strides=(s[0], s[1], stride * s[2], stride * s[3], s[2], s[3]))
+    return windows.max(axis=(4, 5))
+
+
+def affine(x, w, b):
+    """
+    Affine layer on x flattened to shape (N, D).
+    """
+    out = x.reshape(x.shape[0], -1).dot(w)
+    out += b
+    return out
+
+
+class Runtime(object):
+    """
+    Runs the test-time forward pass of an exported model.
+
+    Example usage:
+
+    model = Runtime('cnn.json', mmap=True)
+    scores = model.loss(X)
+
+    The object exposes the test-time half of the model API, so
+    Solver.check_accuracy works on it.
+    """
+
+    def __init__(self, filename, mmap=False):
+        """
+        Inputs:
+        - filename: The .json graph written by nndl.export.export_model; the
+          weights are read from the .npz file it names, in the same directory.
+        - mmap: If True, map the weights into memory instead of reading them,
+          so that they are paged in on first use and shared between processes
+          serving the same file.
+        """
+        with open(filename) as f:
+            graph = json.load(f)
+        if graph.get('format') != FORMAT:
+            raise ValueError('%s is not an exported model' % filename)
+        if graph['version'] > FORMAT_VERSION:
+            raise ValueError('%s has format version %d, but this runtime only '
+                             'reads up to version %d' % (
+                             filename, graph['version'], FORMAT_VERSION))
+        self.graph = graph
+        self.input_dim = tuple(graph['input_dim'])
+        self.layers = graph['layers']
+
+        weights = os.path.join(os.path.dirname(filename), graph['weights'])
+        if mmap:
+            self.params = _npz_mmap(weights)
+        else:
+            with np.load(weights) as data:
+                self.params = {k: data[k] for k in data.files}
+
+    def loss(self, X, y=None):
+        """
+        Test-time forward pass.
+
+        Inputs:
+        - X: Array of input data of shape (N, d_1, ..., d_k)
+        - y: Must be None
+
+        Returns:
+        - scores: Array of shape (N, C) giving classification scores.
+        """
+        if y is not None:
+            raise ValueError('Runtime only supports inference')
+        p = self.params
+        out = X
+        for layer in self.layers:
+            op = layer['op']
+            if op == 'conv':
+                out = conv(out, p[layer['w']], p[layer['b']], layer['stride'],
+                           layer['pad'])
+            elif op == 'affine':
+                out = affine(out, p[layer['w']], p[layer['b']])
+            elif op == 'relu':
+                np.maximum(out, 0, out=out)
+            elif op == 'max_pool':
+                out = max_pool(out, layer['pool_height'], layer['pool_width'],
+                               layer['stride'])
+            elif op == 'global_avg_pool':
+                out = out.mean(axis=(2, 3))
+            else:
+                raise ValueError('Unknown op "%s"' % op)
+        return out
+
+    def predict(self, X):
+        """
+        Returns the predicted class of every example in X.
+        """
+        return np.argmax(self.loss(X), axis=1)
@@ -1,11 +1,27 @@
+import os
+import sys
 from distutils.core import setup
 from distutils.extension import Extension
 from Cython.Build import cythonize
 import numpy
 
+# The *_parallel kernels use OpenMP through cython.parallel.prange. Set
+# NO_OPENMP=1 to build without it (e.g. with Apple clang and no libomp), in
+# which case they run on a single thread.
+if os.environ.get('NO_OPENMP'):
+  openmp_compile_args, openmp_link_args = [], []
+elif sys.platform == 'win32':
+  openmp_compile_args, openmp_link_args = ['/openmp'], []
+elif sys.platform == 'darwin':
+  openmp_compile_args, openmp_link_args = ['-Xpreprocessor', '-fopenmp'], ['-lomp']
+else:
+  openmp_compile_args, openmp_link_args = ['-fopenmp'], ['-fopenmp']
+
 extensions = [
   Extension('im2col_cython', ['im2col_cython.pyx'],
-            include_dirs = [numpy.get_include()]
+            include_dirs = [numpy.get_include()],
+            extra_compile_args = openmp_compile_args,
+            extra_link_args = openmp_link_args,
   ),
 ]
 
@@ -7,6 +7,8 @@ import pickle as pickle
 import numpy as np
 
 from nndl import optim
+from nndl.flat_params import FlatParams
+from nndl.pruning import apply_prune_masks
 
 
 class Solver(object):
@@ -75,6 +77,10 @@ class Solver(object):
       - loss: Scalar giving the loss
       - grads: Dictionary with the same keys as self.params mapping parameter
         names to gradients of the loss with respect to those parameters.
+
+    If the model has been pruned with nndl.pruning.magnitude_prune, the
+    Solver re-applies model.prune_masks after every update, so training
+    fine-tunes the remaining weights with the sparsity pattern held fixed.
     """
 
     def __init__(self, model, data, **kwargs):
@@ -110,7 +116,18 @@ class Solver(object):
         - num_val_samples: Number of validation samples to use to check val
           accuracy; default is None, which uses the entire validation set.
         - checkpoint_name: If not None, then save model checkpoints here every
-          epoch.
+          epoch. Training can be resumed from one with load_checkpoint().
+        - flat_params: Boolean; if True, pack all of model.params and their
+          gradients into single contiguous buffers (see nndl/flat_params.py)
+          so that updates and snapshots are one vectorized operation each.
+          model.params stays a dictionary, holding views into the buffer.
+          Default is False.
+        - loss_scale: Either a fixed scalar by which the model scales its loss
+          gradients, or 'dynamic' to start at 2**15, halve the scale and skip
+          the update whenever a gradient overflows, and double it after 1000
+          steps without overflow. Gradients are unscaled before the update
+          rule sees them. The default is 'dynamic' for models built with
+          mixed_precision=True and 1.0 (no scaling) otherwise.
         """
         self.model = model
         self.X_train = data['X_train']
@@ -130,6 +147,9 @@ class Solver(object):
         self.checkpoint_name = kwargs.pop('checkpoint_name', None)
         self.print_every = kwargs.pop('print_every', 10)
         self.verbose = kwargs.pop('verbose', True)
+        self.flat_params = kwargs.pop('flat_params', False)
+        mixed = getattr(model, 'mixed_precision', False)
+        self.loss_scale = kwargs.pop('loss_scale', 'dynamic' if mixed else 1.0)
 
         # Throw an error if there are extra keyword arguments
         if len(kwargs) > 0:
@@ -142,6 +162,9 @@ class Solver(object):
             raise ValueError('Invalid update_rule "%s"' % self.update_rule)
         self.update_rule = getattr(optim, self.update_rule)
 
+        if self.loss_scale != 1.0 and not hasattr(model, 'loss_scale'):
+            raise ValueError('Model does not support loss scaling')
+
         self._reset()
 
 
@@ -158,6 +181,26 @@ class Solver(object):
         self.train_acc_history = []
         self.val_acc_history = []
 
+        # Loss scaling state
+        self.dynamic_loss_scale = self.loss_scale == 'dynamic'
+        if self.dynamic_loss_scale:
+            self.loss_scale = 2.0 ** 15
+        self.num_skipped_steps = 0
+        self._good_steps = 0
+
+        # With flat params every update rule sees the whole model as a single
+        # vector, so there is only one config to keep. It carries the layout
+        # of the parameters for rules that work per parameter (see
+        # optim._segmented).
+        self.flat = None
+        if self.flat_params:
+            self.flat = FlatParams(self.model)
+            self.best_flat = None
+            d = {k: v for k, v in self.optim_config.items()}
+            d['segments'] = self.flat.segments()
+            self.optim_configs = {'flat': d}
+            return
+
         # Make a deep copy of the optim_config for each parameter
         self.optim_configs = {}
         for p in self.model.params:
@@ -176,10 +219,29 @@ class Solver(object):
         X_batch = self.X_train[batch_mask]
         y_batch = self.y_train[batch_mask]
 
-        # Compute loss and gradient
+        # Compute loss and gradient. A dynamic scale is checked for overflow
+        # even when it has come down to 1.
+        scaled = self.dynamic_loss_scale or self.loss_scale != 1.0
+        if scaled:
+            self.model.loss_scale = self.loss_scale
         loss, grads = self.model.loss(X_batch, y_batch)
         self.loss_history.append(loss)
 
+        if self.flat is not None:
+            self.flat.load_grads(grads)
+            grads = self.flat.grads
+        if scaled and not self._unscale_grads(grads):
+            return
+
+        # Perform a single parameter update over the whole flat buffer
+        if self.flat is not None:
+            config = self.optim_configs['flat']
+            next_w, next_config = self.update_rule(self.flat.w, self.flat.dw, config)
+            self.flat.set(next_w)
+            self.optim_configs['flat'] = next_config
+            apply_prune_masks(self.model)
+            return
+
         # Perform a parameter update
         for p, w in self.model.params.items():
             dw = grads[p]
@@ -188,6 +250,40 @@ class Solver(object):
             self.model.params[p] = next_w
             self.optim_configs[p] = next_config
 
+        # Keep pruned weights at zero
+        apply_prune_masks(self.model)
+
+
+    def _unscale_grads(self, grads):
+        """
+        Divides the loss scale out of the gradients in place. With dynamic loss
+        scaling, also adjusts the scale. Returns False if a gradient overflowed,
+        in which case the update should be skipped.
+        """
+        if self.dynamic_loss_scale:
+            if self.flat is not None:
+                finite = np.all(np.isfinite(self.flat.dw))
+            else:
+                finite = all(np.all(np.isfinite(g)) for g in grads.values())
+            if not finite:
+                self.loss_scale /= 2.0
+                self._good_steps = 0
+                self.num_skipped_steps += 1
+                return False
+
+        if self.flat is not None:
+            self.flat.dw /= self.loss_scale
+        else:
+            for g in grads.values():
+                g /= self.loss_scale
+
+        if self.dynamic_loss_scale:
+            self._good_steps += 1
+            if self._good_steps == 1000:
+                self.loss_scale *= 2.0
+                self._good_steps = 0
+        return True
+
 
     def _save_checkpoint(self):
         if self.checkpoint_name is None: return
@@ -203,6 +299,11 @@ class Solver(object):
           'loss_history': self.loss_history,
           'train_acc_history': self.train_acc_history,
           'val_acc_history': self.val_acc_history,
+          'flat_params': self.flat_params,
+          'optim_configs': self.optim_configs,
+          'loss_scale': self.loss_scale,
+          'good_steps': self._good_steps,
+          'num_skipped_steps': self.num_skipped_steps,
         }
         filename = '%s_epoch_%d.pkl' % (self.checkpoint_name, self.epoch)
         if self.verbose:
@@ -211,6 +312,43 @@ class Solver(object):
             pickle.dump(checkpoint, f)
 
 
+    def load_checkpoint(self, filename):
+        """
+        Resumes training from a checkpoint written by _save_checkpoint: the
+        model, the epoch, the histories and the optimizer state of every
+        parameter, or of the flat buffer if the checkpoint was saved with
+        flat_params. The model's params are packed into a new flat buffer in
+        the same order, so the saved state lines up with it again. Under
+        dynamic loss scaling the scale and its step counters are restored
+        too, so a resumed run does not ramp down from 2**15 again.
+        """
+        with open(filename, 'rb') as f:
+            checkpoint = pickle.load(f)
+        self.model = checkpoint['model']
+        self.epoch = checkpoint['epoch']
+        self.loss_history = checkpoint['loss_history']
+        self.train_acc_history = checkpoint['train_acc_history']
+        self.val_acc_history = checkpoint['val_acc_history']
+
+        self.flat_params = checkpoint.get('flat_params', False)
+        self.flat = None
+        if self.flat_params:
+            self.flat = FlatParams(self.model)
+            self.best_flat = None
+        if 'optim_configs' in checkpoint:
+            self.optim_configs = checkpoint['optim_configs']
+        elif self.flat_params:
+            self.optim_configs = {'flat': dict(self.optim_config,
+                                               segments=self.flat.segments())}
+        else:
+            self.optim_configs = {p: dict(self.optim_config)
+                                  for p in self.model.params}
+        if self.dynamic_loss_scale and 'loss_scale' in checkpoint:
+            self.loss_scale = checkpoint['loss_scale']
+            self._good_steps = checkpoint['good_steps']
+            self.num_skipped_steps = checkpoint['num_skipped_steps']
+
+
     def check_accuracy(self, X, y, num_samples=None, batch_size=100):
         """
         Check accuracy of the model on the provided data.
@@ -260,6 +398,11 @@ class Solver(object):
         iterations_per_epoch = max(num_train // self.batch_size, 1)
         num_iterations = self.num_epochs * iterations_per_epoch
 
+        # Sparse inference copies of pruned weights go stale once training
+        # changes the weights
+        if getattr(self.model, 'sparse_params', None):
+            self.model.sparse_params = {}
+
         for t in range(num_iterations):
             self._step()
 
@@ -296,9 +439,17 @@ class Solver(object):
                 # Keep track of the best model
                 if val_acc > self.best_val_acc:
                     self.best_val_acc = val_acc
-                    self.best_params = {}
-                    for k, v in self.model.params.items():
-                        self.best_params[k] = v.copy()
+                    if self.flat is not None:
+                        self.best_flat = self.flat.snapshot()
+                        self.best_params = self.flat.views(self.best_flat)
+                    else:
+                        self.best_params = {}
+                        for k, v in self.model.params.items():
+                            self.best_params[k] = v.copy()
 
         # At the end of training swap the best params into the model
+        if self.flat is not None:
+            if self.best_flat is not None:
+                self.flat.restore(self.best_flat)
+            return
         self.model.params = self.best_params